@@ -5,36 +5,103 @@
 # SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
 # SPDX-License-Identifier: MIT
 
-from .util import garbage_collect
+from .util import garbage_collect, read_lines, dirname
+from .preprocess import preprocess, preprocess_file
 
-from .preprocess import preprocess
-from .assemble import Assembler
-from .link import make_binary
+# the assembler (and the opcodes of the CPU) and the build cache are imported
+# when first used, not here: e.g. loading a binary from the build cache never
+# needs the assembler, so it is never loaded. the preprocessor is small, and
+# binding its functions here keeps the package's preprocess name the function,
+# whatever is imported from the esp32_ulp.preprocess module later.
 garbage_collect('after import')
 
 
-def src_to_binary_ext(src, cpu):
-    assembler = Assembler(cpu)
-    src = preprocess(src)
-    assembler.assemble(src, remove_comments=False)  # comments already removed by preprocessor
+def __getattr__(name):
+    # the names the package exports, imported when first accessed
+    if name == 'Assembler':
+        from .assemble import Assembler
+        return Assembler
+    if name == 'make_binary':
+        from .link import make_binary
+        return make_binary
+    raise AttributeError(name)
+
+
+def lines_to_binary_ext(lines, cpu, profiler=None):
+    # lines: preprocessed source, as a string or an iterable of lines
+    from .assemble import Assembler
+    assembler = Assembler(cpu, profiler=profiler)
+    assembler.assemble(lines, remove_comments=False)  # comments already removed by preprocessor
     garbage_collect('before symbols export')
-    addrs_syms = assembler.symbols.export()
-    text, data, bss_len = assembler.fetch()
-    return make_binary(text, data, bss_len), addrs_syms
+    with assembler.stage('export_symbols'):
+        addrs_syms = assembler.symbols.export()
+    with assembler.stage('link'):
+        binary = assembler.fetch_image()
+    return binary, addrs_syms
+
+
+def src_to_binary_ext(src, cpu, profiler=None, include_paths=(), directory='.'):
+    # profiler: optional profiler.Profiler, to collect statistics per stage
+    # include_paths: directories to search for #included files, after
+    # directory (where src is from) for #include "file"
+    lines = preprocess(src, profiler=profiler, include_paths=include_paths, directory=directory)
+    return lines_to_binary_ext(lines, cpu, profiler)
 
 
-def src_to_binary(src, cpu):
-    binary, addrs_syms = src_to_binary_ext(src, cpu)
+def file_to_binary_ext(filename, cpu, profiler=None, include_paths=()):
+    # low memory: stream the source file line by line through preprocessing
+    # and parsing, only the parsed statements are kept in memory.
+    lines = preprocess_file(filename, profiler=profiler, include_paths=include_paths)
+    return lines_to_binary_ext(lines, cpu, profiler)
+
+
+def print_symbols(addrs_syms):
     for addr, sym in addrs_syms:
         print('%04d %s' % (addr, sym))
+
+
+def src_to_binary(src, cpu, cache_dir=None, include_paths=()):
+    # cache_dir: optional directory to cache assembled binaries in (see buildcache)
+    if cache_dir:
+        from . import buildcache
+        key = buildcache.key((src, ), cpu, include_paths=include_paths)
+        cached = buildcache.load(cache_dir, key)
+        if cached is not None:
+            binary, addrs_syms = cached
+            print_symbols(addrs_syms)
+            return binary
+    binary, addrs_syms = src_to_binary_ext(src, cpu, include_paths=include_paths)
+    print_symbols(addrs_syms)
+    if cache_dir:
+        buildcache.store(cache_dir, key, binary, addrs_syms)
     return binary
 
 
-def assemble_file(filename, cpu):
-    with open(filename) as f:
-        src = f.read()
+def assemble_file(filename, cpu, stream=False, cache_dir=None, include_paths=()):
+    cached = None
+    if cache_dir:
+        from . import buildcache
+        # the key is computed reading the file line by line, on a cache hit
+        # the source never needs to be in memory as a whole. includes are
+        # resolved like when assembling: from the file's directory first.
+        with open(filename) as f:
+            key = buildcache.key(read_lines(f), cpu, dirname(filename), include_paths)
+        cached = buildcache.load(cache_dir, key)
+    if cached is not None:
+        binary, addrs_syms = cached
+        print_symbols(addrs_syms)
+    elif stream:
+        binary, addrs_syms = file_to_binary_ext(filename, cpu, include_paths=include_paths)
+        print_symbols(addrs_syms)
+    else:
+        with open(filename) as f:
+            src = f.read()
 
-    binary = src_to_binary(src, cpu)
+        binary, addrs_syms = src_to_binary_ext(src, cpu, include_paths=include_paths,
+                                               directory=dirname(filename))
+        print_symbols(addrs_syms)
+    if cache_dir and cached is None:
+        buildcache.store(cache_dir, key, binary, addrs_syms)
 
     if filename.endswith('.s') or filename.endswith('.S'):
         filename = filename[:-2]
@@ -10,22 +10,91 @@ ESP32 ULP Co-Processor Assembler
 """
 
 import re
-from .nocomment import remove_comments as do_remove_comments
-from .util import garbage_collect
+try:
+    from ustruct import pack_into
+except ImportError:  # e.g. CPython
+    from struct import pack_into
+from .link import make_image, make_binary, HEADER_SIZE
+from .nocomment import iter_remove_comments
+from .profiler import NO_STAGE
+from .util import garbage_collect, import_module
 
 TEXT, DATA, BSS = 'text', 'data', 'bss'
 
 REL, ABS = 0, 1
 
+SINGLE_PASS = 0
+
+# number of arguments of the directives: (minimum, maximum), None: no maximum
+DIRECTIVE_ARG_COUNTS = {
+    'text': (0, 0),
+    'data': (0, 0),
+    'bss': (0, 0),
+    'skip': (1, 2),
+    'space': (1, 2),
+    'align': (0, 2),
+    'set': (2, 2),
+    'global': (1, 1),
+    'byte': (0, None),
+    'word': (0, None),
+    'long': (0, None),
+    'int': (0, None),
+}
+
+# dispatch tables, built once per assembler class and opcodes module
+_dispatch_tables = {}
+
+
+def make_dispatch_table(cls, module, opcodes):
+    """
+    return a dict mapping each (lowercase) directive and mnemonic to its
+    entry: (func, min_args, max_args, instr_count, is_directive)
+
+    directives are the d_* methods of the assembler class cls (called with
+    the assembler as first argument). mnemonics are the i_* functions of the
+    opcodes module, taken from opcodes (the module itself or a stand-in for
+    it, e.g. with profiled functions). instr_count is the number of machine
+    instructions, or a function of the arguments returning it.
+    """
+    table = {}
+    for name in dir(cls):
+        if name.startswith('d_'):
+            min_args, max_args = DIRECTIVE_ARG_COUNTS.get(name[2:], (0, None))
+            table['.' + name[2:]] = (getattr(cls, name), min_args, max_args, 0, True)
+    arg_counts = module.ARG_COUNTS
+    instr_counts = module.INSTR_COUNTS
+    for name in dir(module):
+        if name.startswith('i_'):
+            mnemonic = name[2:]
+            min_args, max_args = arg_counts.get(mnemonic, (0, None))
+            table[mnemonic] = (getattr(opcodes, name), min_args, max_args,
+                               instr_counts.get(mnemonic, 1), False)
+    return table
+
+
+def arg_count_error(opcode, min_args, max_args, count):
+    if max_args is None:
+        expected = 'at least %d' % min_args
+    elif min_args == max_args:
+        expected = '%d' % min_args
+    else:
+        expected = '%d to %d' % (min_args, max_args)
+    return '%s expects %s arguments, got %d' % (opcode, expected, count)
+
 
 class SymbolTable:
     def __init__(self, symbols, bases, globals):
         self._symbols = symbols
         self._bases = bases
         self._globals = globals
+        # incremented whenever symbols or bases change, so users can invalidate caches
+        self.generation = 0
+        # set when a symbol or a section base was looked up, but is not known (yet)
+        self.unresolved = False
 
     def set_bases(self, bases):
         self._bases = bases
+        self.generation += 1
 
     def set_from(self, from_section, from_offset):
         self._from_section, self._from_offset = from_section, from_offset
@@ -37,11 +106,16 @@ class SymbolTable:
         entry = (stype, section, value)
         if symbol in self._symbols and entry != self._symbols[symbol]:
             raise Exception('redefining symbol %s with different value %r -> %r.' % (symbol, self._symbols[symbol], entry))
-        self._symbols[symbol] = entry
+        if symbol not in self._symbols:
+            self._symbols[symbol] = entry
+            self.generation += 1
 
     def has_sym(self, symbol):
-        return symbol in self._symbols
-        
+        if symbol in self._symbols:
+            return True
+        self.unresolved = True
+        return False
+
     def get_sym(self, symbol):
         entry = self._symbols[symbol]
         return entry
@@ -57,7 +131,10 @@ class SymbolTable:
         return sorted(addrs_syms)
 
     def to_abs_addr(self, section, offset):
-        base = self._bases[section]
+        base = self._bases.get(section)
+        if base is None:
+            self.unresolved = True
+            raise KeyError(section)
         return base + offset
 
     def resolve_absolute(self, symbol):
@@ -94,7 +171,7 @@ class SymbolTable:
 
 class Assembler:
 
-    def __init__(self, cpu='esp32', symbols=None, bases=None, globals=None):
+    def __init__(self, cpu='esp32', symbols=None, bases=None, globals=None, profiler=None):
         if cpu == 'esp32':
             opcode_module = 'opcodes'
         elif cpu == 'esp32s2':
@@ -102,23 +179,51 @@ class Assembler:
         else:
             raise ValueError('Invalid CPU')
 
-        relative_import = 1 if '/' in __file__ else 0
-        self.opcodes = __import__(opcode_module, None, None, [], relative_import)
+        module = import_module(opcode_module)
+        self.opcodes = module
 
         self.symbols = SymbolTable(symbols or {}, bases or {}, globals or {})
         self.opcodes.symbols = self.symbols  # XXX dirty hack
 
+        # optional profiler.Profiler. if given, the instruction encoders are
+        # wrapped once here, so there is no per-instruction cost without it.
+        self.profiler = profiler
+        if profiler is not None:
+            self.opcodes = profiler.wrap_opcodes(module)
+            self.dispatch = make_dispatch_table(type(self), module, self.opcodes)
+        else:
+            key = (type(self), opcode_module)
+            self.dispatch = _dispatch_tables.get(key)
+            if self.dispatch is None:
+                self.dispatch = _dispatch_tables[key] = make_dispatch_table(type(self), module, module)
+
         # regex for parsing assembly lines
         # format: [[whitespace]label:][whitespace][opcode[whitespace arg[,arg...]]]
         # where [] means optional
         # initialized here once, instead of compiling once per line
         self.line_regex = re.compile(r'^(\s*([a-zA-Z0-9_$.]+):)?\s*((\S*)\s*(.*))$')
 
-    def init(self, a_pass):
+    def init(self, a_pass, sizes=None):
+        # a_pass: 1 or 2 for the two-pass mode, SINGLE_PASS for the single-pass mode
         self.a_pass = a_pass
-        self.sections = dict(text=[], data=[])
+        # section contents: if the section sizes are known already (pass 2), the
+        # final binary image is allocated once and the sections are views into
+        # it, so they get emitted right at their place in the image.
+        # otherwise the section buffers grow as needed.
+        if sizes is None:
+            self.image = None
+            self.sections = dict(text=bytearray(), data=bytearray())
+        else:
+            text_size, data_size = sizes[TEXT], sizes[DATA]
+            self.image = make_image(text_size, data_size, sizes[BSS])
+            data_offset = HEADER_SIZE + text_size
+            view = memoryview(self.image)
+            self.sections = dict(text=view[HEADER_SIZE:data_offset],
+                                 data=view[data_offset:data_offset + data_size])
         self.offsets = dict(text=0, data=0, bss=0)
         self.section = TEXT
+        # single-pass mode: instructions referring to not yet resolvable symbols
+        self.fixups = [] if a_pass == SINGLE_PASS else None
 
     def parse_line(self, line):
         """
@@ -142,13 +247,27 @@ class Assembler:
         return label, opcode, args
 
     def split_statements(self, lines):
-        for line in lines:
+        for line_no, line in enumerate(lines, 1):
             for statement in line.split(';'):
-                yield statement.rstrip()
+                yield line_no, statement.rstrip()
+
+    def parse_statements(self, lines):
+        """
+        parse all lines into a compact list of statements, to be used by all
+        assembler passes (so we only need to parse the source once).
+
+        a statement is a tuple: (label, opcode, args, line_no)
+        line_no is the 1-based number of the source line the statement is from.
+        """
+        statements = []
+        for line_no, line in self.split_statements(lines):
+            parsed = self.parse_line(line)
+            if parsed is not None:
+                statements.append(parsed + (line_no,))
+        return statements
 
     def parse(self, lines):
-        parsed = [self.parse_line(line) for line in self.split_statements(lines)]
-        return [p for p in parsed if p is not None]
+        return [statement[:3] for statement in self.parse_statements(lines)]
 
 
     def append_section(self, value, expected_section=None):
@@ -161,20 +280,49 @@ class Assembler:
             # just increase BSS size by length of value
             self.offsets[s] += len(value)
         else:
-            self.sections[s].append(value)
-            self.offsets[s] += len(value)
+            self.write_section(s, value)
+
+    def section_size_mismatch(self, section, end):
+        # pass 2 writes into a section of the size found in pass 1
+        return ValueError('Section size mismatch: .%s has %d bytes after pass 1, '
+                          'but pass 2 writes up to byte %d' % (section, len(self.sections[section]), end))
+
+    def write_section(self, section, value):
+        buf = self.sections[section]
+        offs = self.offsets[section]
+        end = offs + len(value)
+        if end > len(buf):
+            if self.image is not None:
+                raise self.section_size_mismatch(section, end)
+            buf.extend(value)  # growable buffer, we are writing at its end
+        else:
+            buf[offs:end] = value
+        self.offsets[section] = end
+
+    def append_instruction(self, instruction):
+        if self.section is not TEXT:
+            raise TypeError('only allowed in %s section' % TEXT)
+        buf = self.sections[TEXT]
+        offs = self.offsets[TEXT]
+        if offs == len(buf):
+            if self.image is not None:
+                raise self.section_size_mismatch(TEXT, offs + 4)
+            buf.extend(b'\0\0\0\0')
+        pack_into('<I', buf, offs, instruction)
+        self.offsets[TEXT] = offs + 4
 
     def finalize_sections(self):
         # make sure all sections have a bytelength dividable by 4,
         # thus having all sections aligned at 32bit-word boundaries.
-        for s in list(self.sections.keys()) + [BSS, ]:
+        for s in [TEXT, DATA, BSS]:
             offs = self.offsets[s]
             mod = offs % 4
             if mod:
-                fill = int(0).to_bytes(4 - mod, 'little')
-                self.offsets[s] += len(fill)
-                if s is not BSS:
-                    self.sections[s].append(fill)
+                fill = bytes(4 - mod)
+                if s is BSS:
+                    self.offsets[s] += len(fill)
+                else:
+                    self.write_section(s, fill)
 
     def compute_bases(self):
         bases = {}
@@ -189,22 +337,42 @@ class Assembler:
         print("Symbols:")
         self.symbols.dump()
         print("%s section:" % TEXT)
-        for t in self.sections[TEXT]:
-            print("%08x" % int.from_bytes(t, 'little'))
+        text = self.sections[TEXT]
+        for i in range(0, len(text), 4):
+            print("%08x" % int.from_bytes(text[i:i + 4], 'little'))
         print("size: %d" % self.offsets[TEXT])
         print("%s section:" % DATA)
-        for d in self.sections[DATA]:
-            print("%08x" % int.from_bytes(d, 'little'))
+        data = self.sections[DATA]
+        for i in range(0, len(data), 4):
+            print("%08x" % int.from_bytes(data[i:i + 4], 'little'))
         print("size: %d" % self.offsets[DATA])
         print("%s section:" % BSS)
         print("size: %d" % self.offsets[BSS])
 
     def fetch(self):
         def get_bytes(section):
-            return b''.join(self.sections[section])
+            # no copy, just a view into the section buffer
+            return memoryview(self.sections[section])[:self.offsets[section]]
 
         return get_bytes(TEXT), get_bytes(DATA), self.offsets[BSS]
 
+    def fetch_image(self):
+        """
+        return the complete binary image (header + .text + .data).
+
+        after a two-pass assembly, this is the buffer pass 2 emitted into,
+        returned without copying. single-pass assembly does not know the
+        section sizes upfront, so the image gets built from the sections.
+        """
+        if self.image is not None:
+            return self.image
+        return make_binary(*self.fetch())
+
+    def stage(self, name):
+        if self.profiler is None:
+            return NO_STAGE
+        return self.profiler.stage(name)
+
     def d_text(self):
         self.section = TEXT
 
@@ -220,9 +388,10 @@ class Assembler:
         if section is TEXT:  # TODO: text section should be filled with NOPs
             raise ValueError('fill/skip/align in text section not supported')
         fill = int(self.opcodes.eval_arg(str(fill_byte or 0))).to_bytes(1, 'little') * amount
-        self.offsets[section] += len(fill)
-        if section is not BSS:
-            self.sections[section].append(fill)
+        if section is BSS:
+            self.offsets[section] += len(fill)
+        else:
+            self.write_section(section, fill)
 
     def d_skip(self, amount, fill=None):
         amount = int(self.opcodes.eval_arg(amount))
@@ -263,49 +432,120 @@ class Assembler:
         # https://sourceware.org/binutils/docs/as/Long.html
         self.append_data(4, args)
 
-    def assembler_pass(self, lines):
-        for label, opcode, args in self.parse(lines):
+    def assembler_pass(self, statements):
+        dispatch = self.dispatch
+        a_pass = self.a_pass
+        for label, opcode, args, line_no in statements:
             self.symbols.set_from(self.section, self.offsets[self.section] // 4)
             if label is not None:
                 self.symbols.set_sym(label, REL, *self.symbols.get_from())
-            if opcode is not None:
-                if opcode[0] == '.':
-                    # assembler directive
-                    func = getattr(self, 'd_' + opcode[1:])
-                    if func is not None:
-                        result = func(*args)
-                        if result is not None:
-                            self.append_section(result)
-                        continue
-                else:
-                    # machine instruction
-                    opcode_lower = opcode.lower()
-                    func = getattr(self.opcodes, 'i_' + opcode_lower, None)
-                    if func is not None:
-                        if self.a_pass == 1:
-                            # during the first pass, symbols are not all known yet.
-                            # so we add empty instructions to the section, to determine
-                            # section sizes and symbol offsets for pass 2.
-                            result = (0,) * self.opcodes.no_of_instr(opcode_lower, args)
-                        else:
-                            result = func(*args)
-
-                        if not isinstance(result, tuple):
-                            result = (result,)
-
-                        for instruction in result:
-                            self.append_section(instruction.to_bytes(4, 'little'), TEXT)
-                        continue
-                raise ValueError('Unknown opcode or directive: %s' % opcode)
+            if opcode is None:
+                continue
+            entry = dispatch.get(opcode.lower())
+            if entry is None:
+                raise ValueError('Line %d: Unknown opcode or directive: %s' % (line_no, opcode))
+            func, min_args, max_args, instr_count, is_directive = entry
+            if len(args) < min_args or (max_args is not None and len(args) > max_args):
+                raise ValueError('Line %d: %s' % (line_no, arg_count_error(opcode, min_args, max_args, len(args))))
+            if is_directive:
+                # assembler directive
+                result = func(self, *args)
+                if result is not None:
+                    self.append_section(result)
+                continue
+            # machine instruction
+            if a_pass == 1:
+                # during the first pass, symbols are not all known yet.
+                # so we add empty instructions to the section, to determine
+                # section sizes and symbol offsets for pass 2.
+                result = (0,) * (instr_count if isinstance(instr_count, int) else instr_count(args))
+            elif a_pass == SINGLE_PASS:
+                result = self.encode_or_defer(func, instr_count, args, line_no)
+            else:
+                result = func(*args)
+
+            if not isinstance(result, tuple):
+                result = (result,)
+
+            for instruction in result:
+                self.append_instruction(instruction)
         self.finalize_sections()
 
-    def assemble(self, text, remove_comments=True):
-        lines = do_remove_comments(text) if remove_comments else text.splitlines()
-        self.init(1)  # pass 1 is only to get the symbol table right
-        self.assembler_pass(lines)
-        self.symbols.set_bases(self.compute_bases())
+    def encode_or_defer(self, func, instr_count, args, line_no):
+        """
+        single-pass mode: encode an instruction right away, if all symbols it
+        refers to can already be resolved. otherwise, emit placeholder
+        instructions and record a fixup, which is patched in apply_fixups.
+        instr_count: the number of instructions, or a function of args
+        returning it (see make_dispatch_table).
+        """
+        symbols = self.symbols
+        symbols.unresolved = False
+        try:
+            return func(*args)
+        except (KeyError, ValueError) as e:
+            # KeyError: symbol known, but its section base is not known yet
+            # ValueError: symbol not defined yet (forward reference)
+            # only those are deferred, other errors (e.g. a value out of range)
+            # are reported right away.
+            if not symbols.unresolved:
+                if isinstance(e, ValueError):
+                    raise ValueError('Line %d: %s' % (line_no, e))
+                raise
+        _, from_offset = self.symbols.get_from()
+        self.fixups.append((self.offsets[TEXT], from_offset, func, args, line_no))
+        return (0,) * (instr_count if isinstance(instr_count, int) else instr_count(args))
+
+    def apply_fixups(self):
+        """
+        single-pass mode: now that all symbols and section bases are known,
+        encode the deferred instructions and patch them into the text section.
+        """
+        text = self.sections[TEXT]
+        for offs, from_offset, func, args, line_no in self.fixups:
+            self.symbols.set_from(TEXT, from_offset)
+            try:
+                result = func(*args)
+            except ValueError as e:
+                raise ValueError('Line %d: %s' % (line_no, e))
+            if not isinstance(result, tuple):
+                result = (result,)
+            for instruction in result:
+                pack_into('<I', text, offs, instruction)
+                offs += 4
+        self.fixups = None
+
+    def assemble(self, text, remove_comments=True, single_pass=False):
+        """
+        text: the source, either as one string or as an iterable of lines, e.g.
+              a generator, so the source never needs to be in memory as a whole.
+              only the compact list of parsed statements is kept.
+              if comments are to be removed, the lines must end with a newline
+              (like the lines read from a file do).
+        """
+        if isinstance(text, str):
+            text = (text, ) if remove_comments else text.splitlines()
+        lines = iter_remove_comments(text) if remove_comments else text
+        with self.stage('parse'):
+            statements = self.parse_statements(lines)
+        del lines  # the source lines are not needed anymore, free them early
+        if single_pass:
+            # encode everything in one pass, patch forward references at the end
+            with self.stage('single_pass'):
+                self.init(SINGLE_PASS)
+                self.assembler_pass(statements)
+                self.symbols.set_bases(self.compute_bases())
+            with self.stage('fixups'):
+                self.apply_fixups()
+            garbage_collect('after single pass')
+            return
+        with self.stage('pass1'):
+            self.init(1)  # pass 1 is only to get the symbol table right
+            self.assembler_pass(statements)
+            self.symbols.set_bases(self.compute_bases())
+        sizes = dict(self.offsets)
         garbage_collect('before pass2')
-        self.init(2)  # now we know all symbols and bases, do the real assembler pass, pass 2
-        self.assembler_pass(lines)
+        with self.stage('pass2'):
+            self.init(2, sizes)  # now we know all symbols and bases, do the real assembler pass, pass 2
+            self.assembler_pass(statements)
         garbage_collect('after pass2')
-
@@ -0,0 +1,176 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Build cache: assembled binaries, stored by a hash of everything they depend on
+
+The key of a cache entry is a hash of:
+
+- the source text
+- the CPU
+- the package: size and modification time of the esp32_ulp modules, so an
+  updated assembler does not reuse binaries of an older version
+- the defines database: size and modification time of the database file
+- the paths and contents of the files #included by the source (and of those
+  they include), found like the preprocessor finds them
+
+An entry consists of two files in the cache directory: <key>.ulp (the
+binary) and <key>.sym (the exported symbols, one "address name" per line).
+Using an entry does not need the assembler at all.
+"""
+
+import os
+try:
+    import uhashlib as hashlib
+except ImportError:  # e.g. CPython
+    import hashlib
+try:
+    from ubinascii import hexlify
+except ImportError:  # e.g. CPython
+    from binascii import hexlify
+
+from .definesdb import DBNAME
+from .util import file_exists, read_lines, dirname, parse_include_name, find_include
+
+# version of the key and entry format, change it when they change
+FORMAT = 1
+
+# number of entries to keep in the cache directory, the oldest ones are
+# removed when storing a new one
+MAX_ENTRIES = 16
+
+_package_stamp = None
+
+
+def file_stamp(path):
+    """
+    return a string identifying the state of the file path (size and
+    modification time), without reading it.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return '-'  # does not exist
+    return '%d:%d' % (stat[6], stat[8])
+
+
+def package_stamp():
+    """
+    return a string identifying the installed version of this package:
+    names, sizes and modification times of its modules. it is determined
+    only once per process.
+    """
+    global _package_stamp
+    if _package_stamp is None:
+        try:
+            directory = dirname(__file__)
+            names = sorted(os.listdir(directory))
+        except (NameError, OSError):  # e.g. frozen modules
+            names = []
+        _package_stamp = ';'.join(name + '=' + file_stamp(directory + '/' + name)
+                                  for name in names if name.endswith('.py') or name.endswith('.mpy'))
+    return _package_stamp
+
+
+def included_chunks(lines, directory, include_paths, seen):
+    """
+    generator: yield the path and the contents (in chunks) of each file
+    #included in lines (and of the files they include). files are searched
+    like the preprocessor does (see util.find_include).
+    """
+    for chunk in lines:
+        if '#include' not in chunk:
+            continue
+        for line in chunk.split('\n'):
+            line = line.lstrip()
+            if not line.startswith('#include'):
+                continue
+            name = parse_include_name(line[8:])
+            if name is None:
+                continue
+            path = find_include(name, directory, include_paths)
+            if path is None or path in seen:
+                continue  # expected to be in the defines db, or included again
+            seen.add(path)
+            yield '\n' + path + '\n'
+            with open(path) as f:
+                lines = list(read_lines(f))
+            yield from lines
+            yield from included_chunks(lines, dirname(path), include_paths, seen)
+
+
+def key(lines, cpu, directory='.', include_paths=()):
+    """
+    return the cache key (a hex string) for the source lines (any iterable of
+    str chunks, e.g. (src, ) or an open file), assembled for cpu. directory
+    (where the lines are from) and include_paths are where included files
+    are searched, like when preprocessing.
+    """
+    include_paths = [path.rstrip('/') for path in include_paths]
+    h = hashlib.sha256()
+    h.update(('%d\n%s\n%s\n%s\n' % (FORMAT, cpu, package_stamp(), file_stamp(DBNAME))).encode())
+    includes = []
+    for chunk in lines:
+        h.update(chunk.encode())
+        if '#include' in chunk:
+            includes.append(chunk)
+    for chunk in included_chunks(includes, directory, include_paths, set()):
+        h.update(chunk.encode())
+    return hexlify(h.digest()).decode()
+
+
+def load(cache_dir, key):
+    """
+    return (binary, addrs_syms) stored for key, or None if not cached.
+    binary is a bytearray, like the one the assembler returns.
+    """
+    path = cache_dir + '/' + key
+    try:
+        with open(path + '.ulp', 'rb') as f:
+            binary = bytearray(os.stat(path + '.ulp')[6])
+            f.readinto(binary)
+        addrs_syms = []
+        with open(path + '.sym') as f:
+            for line in f:
+                addr, sym = line.split()
+                addrs_syms.append((int(addr), sym))
+    except OSError:
+        return None
+    return binary, addrs_syms
+
+
+def store(cache_dir, key, binary, addrs_syms):
+    """
+    store binary and addrs_syms for key. the .ulp file is written last (and
+    renamed into place), so an entry with a .ulp file is always complete.
+    """
+    if not file_exists(cache_dir):
+        os.mkdir(cache_dir)
+    prune(cache_dir, MAX_ENTRIES - 1)
+    path = cache_dir + '/' + key
+    with open(path + '.sym', 'w') as f:
+        for addr, sym in addrs_syms:
+            f.write('%d %s\n' % (addr, sym))
+    with open(path + '.tmp', 'wb') as f:
+        f.write(binary)
+    os.rename(path + '.tmp', path + '.ulp')
+
+
+def prune(cache_dir, max_entries):
+    """
+    remove the oldest entries, so that at most max_entries remain.
+    """
+    entries = [name[:-4] for name in os.listdir(cache_dir) if name.endswith('.ulp')]
+    if len(entries) <= max_entries:
+        return
+    entries.sort(key=lambda name: os.stat(cache_dir + '/' + name + '.ulp')[8])
+    for name in entries[:len(entries) - max_entries]:
+        for ext in ('.ulp', '.sym'):
+            try:
+                os.remove(cache_dir + '/' + name + ext)
+            except OSError:
+                pass
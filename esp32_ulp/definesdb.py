@@ -6,22 +6,87 @@
 # SPDX-License-Identifier: MIT
 
 import os
-import btree
+try:
+    import btree
+except ImportError:  # e.g. CPython, only sorted db files can be used then
+    btree = None
+from . import sorteddb
 from .util import file_exists
 
 DBNAME = 'defines.db'
 
+CACHE_SIZE = 4096  # bytes, default size of the lookup cache
+# rough estimate of the memory used by a cache entry, in addition to the
+# characters of its key and value (dict slot, str object headers).
+CACHE_ENTRY_OVERHEAD = 48
+
+
+class BtreeBackend:
+    """
+    store the defines in a btree database (needs the btree module).
+
+    a backend opens the database file and returns an object with the
+    interface of a btree object (keys and values are bytes):
+    __getitem__, __setitem__, keys, close
+    """
+    def __init__(self, cachesize=0):
+        # memory (bytes) the btree may use to cache pages. bigger values mean
+        # less flushing of pages to the file, e.g. when loading many defines.
+        # 0 means the btree module's default.
+        self.cachesize = cachesize
+
+    def open(self, f):
+        if btree is None:
+            raise ImportError('btree module needed')
+        return btree.open(f, cachesize=self.cachesize)
+
 
 class DefinesDB:
-    def __init__(self):
+    def __init__(self, cache_size=CACHE_SIZE, backend=None, filename=DBNAME):
+        # backend: BtreeBackend or sorteddb.SortedBackend (read-only, files
+        # built on a PC by tools/build_defines_db.py). by default, it is
+        # chosen when opening the file: an existing sorted db file is opened
+        # using the SortedBackend, everything else using the BtreeBackend.
+        self._backend = backend
+        self._filename = filename
         self._file = None
         self._db = None
         self._db_exists = None
+        # cache of recent lookups (also of keys not in the db), so the same
+        # keys do not need to be looked up in the btree again and again.
+        # cache_size is in bytes (estimated), 0 disables the cache.
+        self._cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.clear_cache()
+
+    def clear_cache(self):
+        # least recently used entries get dropped by using 2 generations:
+        # entries are added to the current one. when it is full, it becomes
+        # the old one and the previous old one is dropped. entries found in
+        # the old generation move to the current one again.
+        self._cache = {}  # key -> value, or None if key is not in the db
+        self._cache_old = {}
+        self._cache_bytes = 0
+
+    def cache_put(self, key, value):
+        if not self._cache_size:
+            return
+        self._cache[key] = value
+        self._cache_bytes += len(key) + (len(value) if value else 0) + CACHE_ENTRY_OVERHEAD
+        if self._cache_bytes > self._cache_size // 2:
+            self._cache_old = self._cache
+            self._cache = {}
+            self._cache_bytes = 0
+
+    def cache_stats(self):
+        return self.cache_hits, self.cache_misses
 
     def clear(self):
         self.close()
+        self.clear_cache()
         try:
-            os.remove(DBNAME)
+            os.remove(self._filename)
             self._db_exists = False
         except OSError:
             pass
@@ -33,10 +98,18 @@ class DefinesDB:
         if self.is_open():
             return
         try:
-            self._file = open(DBNAME, 'r+b')
+            self._file = open(self._filename, 'r+b')
         except OSError:
-            self._file = open(DBNAME, 'w+b')
-        self._db = btree.open(self._file)
+            self._file = open(self._filename, 'w+b')
+        backend = self._backend
+        if backend is None:
+            backend = SORTED_BACKEND if sorteddb.is_sorted_db(self._file) else BTREE_BACKEND
+        try:
+            self._db = backend.open(self._file)
+        except Exception:
+            self._file.close()
+            self._file = None
+            raise
         self._db_exists = True
 
     def close(self):
@@ -49,12 +122,13 @@ class DefinesDB:
 
     def db_exists(self):
         if self._db_exists is None:
-            self._db_exists = file_exists(DBNAME)
+            self._db_exists = file_exists(self._filename)
         return self._db_exists
 
     def update(self, dictionary):
-        for k, v in dictionary.items():
-            self.__setitem__(k, v)
+        # insert in key order, so the btree pages get filled sequentially
+        for k in sorted(dictionary):
+            self.__setitem__(k, dictionary[k])
 
     def get(self, key, default):
         try:
@@ -70,16 +144,45 @@ class DefinesDB:
         self.open()
         return [k.decode() for k in self._db.keys()]
 
-    def __getitem__(self, key):
+    def lookup(self, key):
+        """
+        look up key in the btree, returns None if key is not in the db.
+        """
         if not self.db_exists():
-            raise KeyError
+            return None
 
         self.open()
-        return self._db[key.encode()].decode()
+        try:
+            return self._db[key.encode()].decode()
+        except KeyError:
+            return None
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            self.cache_hits += 1
+            value = self._cache[key]
+        elif key in self._cache_old:
+            self.cache_hits += 1
+            value = self._cache_old.pop(key)
+            self.cache_put(key, value)  # used again, keep it
+        else:
+            self.cache_misses += 1
+            value = self.lookup(key)
+            self.cache_put(key, value)
+        if value is None:
+            raise KeyError(key)
+        return value
 
     def __setitem__(self, key, value):
         self.open()
         self._db[key.encode()] = str(value).encode()
+        # forget any cached value (or non-existence) of key
+        self._cache.pop(key, None)
+        self._cache_old.pop(key, None)
 
     def __iter__(self):
         return iter(self.keys())
+
+
+BTREE_BACKEND = BtreeBackend()
+SORTED_BACKEND = sorteddb.SortedBackend()
@@ -0,0 +1,101 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+ULP instruction layouts, shared by the ESP32 and ESP32-S2 instruction sets
+"""
+
+
+def make_ins_fields(layout):
+    """
+    transform textual instruction layout description into a tuple of
+    (name, pos, width) bitfield definitions
+    """
+    lines = layout.strip().splitlines()
+    pos = 0  # bitfield definitions start from lsb
+    fields = []
+    for line in lines:
+        bitfield = line.split('#', 1)[0]  # get rid of comment
+        name, width = bitfield.split(':', 1)
+        name = name.strip()
+        width = int(width.strip())
+        fields.append((name, pos, width))
+        pos += width
+    if pos != 32:
+        raise ValueError('make_ins: bit field widths must sum up to 32. [%s]' % layout)
+    return tuple(fields)
+
+
+def make_ins_struct_def(layout):
+    from uctypes import UINT32, BFUINT32, BF_POS, BF_LEN
+    struct_def = {}
+    for name, pos, width in make_ins_fields(layout):
+        struct_def[name] = BFUINT32 | pos << BF_POS | width << BF_LEN
+    struct_def['all'] = UINT32
+    return struct_def
+
+
+def make_ins(layout):
+    """
+    transform textual instruction layout description into a ready-to-use uctypes struct
+    """
+    from uctypes import struct, addressof, LITTLE_ENDIAN
+    struct_def = make_ins_struct_def(layout)
+    instruction = bytearray(4)
+    return struct(addressof(instruction), struct_def, LITTLE_ENDIAN)
+
+
+def make_ins_encoder(fields):
+    """
+    return a function, which encodes an instruction word from its field
+    values, given as keyword arguments (fields not given are 0). the shift
+    and mask of each field are computed once, here. unused fields are always
+    0, so they are not arguments of the encoder.
+    """
+    encoding = {name: (pos, (1 << width) - 1) for name, pos, width in fields
+                if not name.startswith('unused')}
+
+    def encode(**values):
+        word = 0
+        for name, value in values.items():
+            try:
+                pos, mask = encoding[name]
+            except KeyError:
+                raise TypeError('unknown field: %s' % name)
+            word |= (value & mask) << pos
+        return word
+
+    return encode
+
+
+class Ins:
+    """
+    instruction built from a textual instruction layout description.
+
+    encode(field=value, ...) returns the instruction word, using integer
+    arithmetic only. for decoding, assign an instruction word to .all and
+    read the fields as attributes.
+
+    the layout is only parsed (and the encoder made) when the instruction is
+    first used, most programs use only a few instructions.
+    """
+    def __init__(self, layout):
+        self.layout = layout
+        self.all = 0
+
+    def __getattr__(self, name):
+        if name == 'fields' or name == 'encode':
+            fields = make_ins_fields(self.layout)
+            self.fields = {field: (pos, (1 << width) - 1) for field, pos, width in fields}
+            self.encode = make_ins_encoder(fields)
+            return getattr(self, name)
+        try:
+            pos, mask = self.fields[name]
+        except KeyError:
+            raise AttributeError(name)
+        return (self.all >> pos) & mask
+
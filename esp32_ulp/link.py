@@ -5,29 +5,39 @@
 # SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
 # SPDX-License-Identifier: MIT
 
-from uctypes import struct, addressof, LITTLE_ENDIAN, UINT16, UINT32
+try:
+    from ustruct import pack_into
+except ImportError:  # e.g. CPython
+    from struct import pack_into
 
+HEADER_SIZE = 12
 
-def make_binary(text, data, bss_size):
-    if not isinstance(text, bytes):
-        raise TypeError('text section must be binary bytes')
-    if not isinstance(data, bytes):
-        raise TypeError('data section must be binary bytes')
-    binary_header_struct_def = dict(
-        magic = 0 | UINT32,
-        text_offset = 4 | UINT16,
-        text_size = 6 | UINT16,
-        data_size = 8 | UINT16,
-        bss_size = 10 | UINT16,
-    )
-    header = bytearray(12)
-    h = struct(addressof(header), binary_header_struct_def, LITTLE_ENDIAN)
+
+def make_image(text_size, data_size, bss_size):
+    """
+    allocate the complete binary image (header + .text + .data) in one buffer
+    and write the header into it. the sections are left zeroed, to be filled
+    in place at offsets HEADER_SIZE and HEADER_SIZE + text_size.
+    """
+    image = bytearray(HEADER_SIZE + text_size + data_size)
     # https://github.com/espressif/esp-idf/blob/master/components/ulp/ld/esp32.ulp.ld
     # ULP program binary should have the following format (all values little-endian):
-    h.magic = 0x00706c75  # (4 bytes)
-    h.text_offset = 12  # offset of .text section from binary start (2 bytes)
-    h.text_size = len(text)  # size of .text section (2 bytes)
-    h.data_size = len(data)  # size of .data section (2 bytes)
-    h.bss_size = bss_size  # size of .bss section (2 bytes)
-    return bytes(header) + text + data
+    pack_into('<IHHHH', image, 0,
+              0x00706c75,  # magic (4 bytes)
+              HEADER_SIZE,  # offset of .text section from binary start (2 bytes)
+              text_size,  # size of .text section (2 bytes)
+              data_size,  # size of .data section (2 bytes)
+              bss_size)  # size of .bss section (2 bytes)
+    return image
 
+
+def make_binary(text, data, bss_size):
+    if not isinstance(text, (bytes, bytearray, memoryview)):
+        raise TypeError('text section must be binary bytes')
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        raise TypeError('data section must be binary bytes')
+    image = make_image(len(text), len(data), bss_size)
+    data_offset = HEADER_SIZE + len(text)
+    image[HEADER_SIZE:data_offset] = text
+    image[data_offset:] = data
+    return image
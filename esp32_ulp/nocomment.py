@@ -25,93 +25,166 @@ def remove_comments(s):
     s: string with comments (can include newlines)
     returns: list of text lines
     """
+    return list(iter_remove_comments((s, )))
+
+
+def iter_remove_comments(chunks, keep_directives=False):
+    """
+    Generator version of remove_comments, to process a source without
+    having all of it in memory at once.
+
+    chunks: iterable of strings with comments, e.g. an open file.
+            a chunk must not end within a line, so all chunks except the
+            last one must end with a newline (like lines read from a file).
+    keep_directives: if true, a # starting a line (a preprocessor directive,
+            e.g. #if) does not start a comment, the line is kept as it is
+            instead. strings end at EOL then. this tells directives apart
+            from lines which are within a /* comment.
+    yields: text lines (see remove_comments)
+    """
     # note: micropython's ure module was not capable enough to process this:
     # missing methods, re modes, recursion limit exceeded, ...
     # simpler hacks also didn't seem powerful enough to address all the
-    # corner cases of CSLASHSTAR vs. *STR, so this state machine came to life:
+    # corner cases of CSLASHSTAR vs. *STR, so this state machine came to life.
+    # instead of looking at every char, it uses str.find to jump to the next
+    # char which is relevant in the current state and copies the runs of
+    # chars in between as a whole.
     SRC, CHASH, CSLASHSLASH, CSLASHSTAR, DSTR, SSTR = range(6)  # states
 
-    line = []  # collect chars of one line
-    lines = []  # collect result lines
+    line = []  # collect the parts of one line
+    lines = []  # collect result lines (of the current chunk)
+
+    def clean(text):
+        # try to get rid of trailing and most of leading whitespace
+        # (keep/put one tab for indented lines).
+        is_indented = text.startswith(' ') or text.startswith('\t')
+        text = text.strip()
+        if text and is_indented:
+            text = '\t' + text
+        return text
 
     def finish_line():
-        # assemble a line from characters, try to get rid of trailing and
-        # most of leading whitespace (keep/put one tab for indented lines).
-        nonlocal line
-        line = ''.join(line)
-        is_indented = line.startswith(' ') or line.startswith('\t')
-        line = line.strip()
-        if line and is_indented:
-            line = '\t' + line
-        lines.append(line)
-        line = []
+        # assemble a line from its parts
+        lines.append(clean(''.join(line)))
+        line.clear()
 
     state = SRC
-    i = 0
-    length = len(s)
-    while i < length:
-        c = s[i]
-        cn = s[i + 1] if i + 1 < length else '\0'
-        if state == SRC:
-            if c == '#':  # starting to-EOL comment
-                state = CHASH
-                i += 1
-            elif c == '/':
-                if cn == '/':  # starting to-EOL comment
-                    state = CSLASHSLASH
-                    i += 2
-                elif cn == '*':  # starting a /* comment
-                    state = CSLASHSTAR
-                    i += 2
-                else:
+    for s in chunks:
+        if state == SRC and not line and s.find('#') < 0 and s.find('/') < 0 \
+                and s.find('"') < 0 and s.find("'") < 0:
+            # fast path: no comments and strings in this chunk at all
+            texts = s.split('\n')
+            rest = texts.pop()  # not terminated by a \n (yet)
+            for text in texts:
+                stripped = text.strip()
+                if stripped and (text[0] == ' ' or text[0] == '\t'):
+                    stripped = '\t' + stripped
+                yield stripped
+            if rest:
+                line.append(rest)
+            continue
+        i = 0
+        length = len(s)
+        while i < length:
+            if state == SRC:
+                eol = s.find('\n', i)
+                if eol < 0:
+                    eol = length
+                # find the first char which could start a comment or a string
+                j = eol
+                for c in '#/"\'':
+                    k = s.find(c, i, j)
+                    if k >= 0:
+                        j = k
+                if j == eol:  # nothing special until the end of the line
+                    if eol == length:
+                        line.append(s[i:])
+                    elif line:
+                        line.append(s[i:eol])
+                        finish_line()
+                    else:
+                        lines.append(clean(s[i:eol]))  # fast path: plain line
+                    i = eol + 1
+                    continue
+                if j > i:
+                    line.append(s[i:j])
+                    i = j
+                c = s[i]
+                cn = s[i + 1] if i + 1 < length else '\0'
+                if c == '#':
+                    if keep_directives and not ''.join(line).strip():
+                        # a directive line, keep it as it is up to EOL
+                        eol = s.find('\n', i)
+                        if eol < 0:
+                            eol = length
+                        line.append(s[i:eol])
+                        i = eol
+                    else:  # starting to-EOL comment
+                        state = CHASH
+                        i += 1
+                elif c == '/':
+                    if cn == '/':  # starting to-EOL comment
+                        state = CSLASHSLASH
+                        i += 2
+                    elif cn == '*':  # starting a /* comment
+                        state = CSLASHSTAR
+                        i += 2
+                    else:
+                        i += 1
+                        line.append(c)
+                else:  # starting a string
+                    state = DSTR if c == '"' else SSTR
                     i += 1
                     line.append(c)
-            elif c == '"':
-                state = DSTR
-                i += 1
-                line.append(c)
-            elif c == "'":
-                state = SSTR
-                i += 1
-                line.append(c)
-            elif c == '\n':
-                i += 1
-                finish_line()
-            else:
-                i += 1
-                line.append(c)
-        elif state == CHASH or state == CSLASHSLASH:
-            if c != '\n':  # comment runs until EOL
-                i += 1
-            else:
-                state = SRC
-                i += 1
-                finish_line()
-        elif state == CSLASHSTAR:
-            if c == '*' and cn == '/':  # ending a comment */
-                state = SRC
-                i += 2
-            elif c == '\n':
-                i += 1
-                finish_line()
-            else:
-                i += 1
-        elif state == DSTR and c == '"' or state == SSTR and c == "'":  # string end
-            state = SRC
-            i += 1
-            line.append(c)
-        elif state == DSTR or state == SSTR:
-            i += 1
-            line.append(c)
-            if c == '\\':  # escaping backslash
-                i += 1  # do not look at char after the backslash
-                line.append(cn)
-        else:
-            raise Exception("state: %d c: %s cn: %s" % (state, c, cn))
+            elif state == CHASH or state == CSLASHSLASH:
+                eol = s.find('\n', i)  # comment runs until EOL
+                if eol < 0:
+                    i = length
+                else:
+                    state = SRC
+                    i = eol + 1
+                    finish_line()
+            elif state == CSLASHSTAR:
+                eol = s.find('\n', i)
+                if eol < 0:
+                    eol = length
+                end = s.find('*/', i, eol)
+                if end >= 0:  # ending a comment */
+                    state = SRC
+                    i = end + 2
+                else:
+                    i = eol + 1
+                    if eol < length:
+                        finish_line()
+            else:  # DSTR or SSTR, strings can span lines
+                end = s.find('"' if state == DSTR else "'", i)
+                if end < 0:
+                    end = length
+                if keep_directives:
+                    # like in C, strings end at EOL, e.g. don't in a skipped #if
+                    eol = s.find('\n', i, end)
+                    if eol >= 0:
+                        line.append(s[i:eol])
+                        state = SRC
+                        i = eol
+                        continue
+                escape = s.find('\\', i, end)
+                if escape >= 0:  # escaping backslash
+                    # do not look at char after the backslash
+                    line.append(s[i:escape + 1])
+                    line.append(s[escape + 1] if escape + 1 < length else '\0')
+                    i = escape + 2
+                else:
+                    line.append(s[i:end + 1])
+                    if end < length:  # string end
+                        state = SRC
+                    i = end + 1
+        yield from lines
+        lines.clear()
     if line:
         # no final \n triggered processing these chars yet, do it now
         finish_line()
-    return lines
+        yield from lines
 
 
 if __name__ == '__main__':
@@ -9,11 +9,14 @@
 ESP32 ULP Co-Processor Instructions
 """
 
-from ucollections import namedtuple
-from uctypes import struct, addressof, LITTLE_ENDIAN, UINT32, BFUINT32, BF_POS, BF_LEN
+try:
+    from ucollections import namedtuple
+except ImportError:  # e.g. CPython
+    from collections import namedtuple
 
+from .ins import make_ins_fields, make_ins_struct_def, make_ins, Ins
 from .soc import *
-from .util import split_tokens, validate_expression, parse_int
+from .util import eval_expression, parse_int
 
 # XXX dirty hack: use a global for the symbol table
 symbols = None
@@ -79,35 +82,9 @@ OPCODE_HALT = 11
 OPCODE_LD = 13
 
 
-def make_ins_struct_def(layout):
-    lines = layout.strip().splitlines()
-    pos = 0  # bitfield definitions start from lsb
-    struct_def = {}
-    for line in lines:
-        bitfield = line.split('#', 1)[0]  # get rid of comment
-        name, width = bitfield.split(':', 1)
-        name = name.strip()
-        width = int(width.strip())
-        struct_def[name] = BFUINT32 | pos << BF_POS | width << BF_LEN
-        pos += width
-    if pos != 32:
-        raise ValueError('make_ins: bit field widths must sum up to 32. [%s]' % layout)
-    struct_def['all'] = UINT32
-    return struct_def
-
-
-def make_ins(layout):
-    """
-    transform textual instruction layout description into a ready-to-use uctypes struct
-    """
-    struct_def = make_ins_struct_def(layout)
-    instruction = bytearray(4)
-    return struct(addressof(instruction), struct_def, LITTLE_ENDIAN)
-
-
 # instruction structure definitions
 
-_wr_reg = make_ins("""
+_wr_reg = Ins("""
     addr : 8        # Address within either RTC_CNTL, RTC_IO, or SARADC
     periph_sel : 2  # Select peripheral: RTC_CNTL (0), RTC_IO(1), SARADC(2)
     data : 8        # 8 bits of data to write
@@ -117,7 +94,7 @@ _wr_reg = make_ins("""
 """)
 
 
-_rd_reg = make_ins("""
+_rd_reg = Ins("""
     addr : 8        # Address within either RTC_CNTL, RTC_IO, or SARADC
     periph_sel : 2  # Select peripheral: RTC_CNTL (0), RTC_IO(1), SARADC(2)
     unused : 8      # Unused
@@ -127,7 +104,7 @@ _rd_reg = make_ins("""
 """)
 
 
-_i2c = make_ins("""
+_i2c = Ins("""
     sub_addr : 8    # address within I2C slave
     data : 8        # Data to write (not used for read)
     low : 3         # low bit
@@ -139,14 +116,14 @@ _i2c = make_ins("""
 """)
 
 
-_delay = make_ins("""
+_delay = Ins("""
     cycles : 16     # Number of cycles to sleep
     unused : 12     # Unused
     opcode : 4      # Opcode (OPCODE_DELAY)
 """)
 
 
-_tsens = make_ins("""
+_tsens = Ins("""
     dreg : 2        # Register where to store TSENS result
     delay : 14      # Number of cycles needed to obtain a measurement
     unused : 12     # Unused
@@ -154,7 +131,7 @@ _tsens = make_ins("""
 """)
 
 
-_adc = make_ins("""
+_adc = Ins("""
     dreg : 2        # Register where to store ADC result
     mux : 4         # Select SARADC pad (mux + 1)
     sar_sel : 1     # Select SARADC0 (0) or SARADC1 (1)
@@ -165,7 +142,7 @@ _adc = make_ins("""
 """)
 
 
-_st = make_ins("""
+_st = Ins("""
     sreg : 2        # Register which contains data to store
     dreg : 2        # Register which contains address in RTC memory (expressed in words)
     unused1 : 6     # Unused
@@ -176,7 +153,7 @@ _st = make_ins("""
 """)
 
 
-_alu_reg = make_ins("""
+_alu_reg = Ins("""
     dreg : 2        # Destination register
     sreg : 2        # Register with operand A
     treg : 2        # Register with operand B
@@ -187,7 +164,7 @@ _alu_reg = make_ins("""
 """)
 
 
-_alu_imm = make_ins("""
+_alu_imm = Ins("""
     dreg : 2        # Destination register
     sreg : 2        # Register with operand A
     imm : 16        # Immediate value of operand B
@@ -198,7 +175,7 @@ _alu_imm = make_ins("""
 """)
 
 
-_alu_cnt = make_ins("""
+_alu_cnt = Ins("""
     unused1 : 4     # Unused
     imm : 8         # Immediate value (to inc / dec stage counter)
     unused2 : 9     # Unused
@@ -208,7 +185,7 @@ _alu_cnt = make_ins("""
 """)
 
 
-_bx = make_ins("""
+_bx = Ins("""
     dreg : 2        # Register which contains target PC, expressed in words (used if .reg == 1)
     addr : 11       # Target PC, expressed in words (used if .reg == 0)
     unused : 8      # Unused
@@ -219,7 +196,7 @@ _bx = make_ins("""
 """)
 
 
-_br = make_ins("""
+_br = Ins("""
     imm : 16        # Immediate value to compare against
     cmp : 1         # Comparison to perform: BRCOND_LT or BRCOND_GE
     offset : 7      # Absolute value of target PC offset w.r.t. current PC, expressed in words
@@ -229,7 +206,7 @@ _br = make_ins("""
 """)
 
 
-_bs = make_ins("""
+_bs = Ins("""
     imm : 8         # Immediate value to compare against
     unused : 7      # Unused
     cmp : 2         # Comparison to perform: BRCOND_LT, GT or EQ
@@ -240,7 +217,7 @@ _bs = make_ins("""
 """)
 
 
-_end = make_ins("""
+_end = Ins("""
     wakeup : 1      # Set to 1 to wake up chip
     unused : 24     # Unused
     sub_opcode : 3  # Sub opcode (SUB_OPCODE_END)
@@ -248,7 +225,7 @@ _end = make_ins("""
 """)
 
 
-_sleep = make_ins("""
+_sleep = Ins("""
     cycle_sel : 4   # Select which one of SARADC_ULP_CP_SLEEP_CYCx_REG to get the sleep duration from
     unused : 21     # Unused
     sub_opcode : 3  # Sub opcode (SUB_OPCODE_SLEEP)
@@ -256,13 +233,13 @@ _sleep = make_ins("""
 """)
 
 
-_halt = make_ins("""
+_halt = Ins("""
     unused : 28     # Unused
     opcode : 4      # Opcode (OPCODE_HALT)
 """)
 
 
-_ld = make_ins("""
+_ld = Ins("""
     dreg : 2        # Register where the data should be loaded to
     sreg : 2        # Register which contains address in RTC memory (expressed in words)
     unused1 : 6     # Unused
@@ -279,22 +256,15 @@ ARG = namedtuple('ARG', ('type', 'value', 'raw'))
 
 
 def eval_arg(arg):
-    parts = []
-    for token in split_tokens(arg):
-        if symbols.has_sym(token):
-            _, _, sym_value = symbols.get_sym(token)
-            parts.append(str(sym_value))
-        else:
-            try:
-                # attempt to parse, to convert numbers with base prefix correctly
-                int_token = parse_int(token)
-                parts.append(str(int_token))
-            except ValueError:
-                parts.append(token)
-    parts = "".join(parts)
-    if not validate_expression(parts):
-        raise ValueError('Unsupported expression: %s' % parts)
-    return eval(parts)
+    return eval_expression(arg, symbols)
+
+
+ARG_CACHE_SIZE = 128
+_arg_cache = {}
+_arg_cache_symbols = None  # symbol table and its generation, the cached results are valid for
+_arg_cache_generation = None
+arg_cache_hits = 0
+arg_cache_misses = 0
 
 
 def arg_qualify(arg):
@@ -305,7 +275,36 @@ def arg_qualify(arg):
     then convert arg into a int value, e.g. 'R1' -> 1 or '0x20' -> 32.
 
     return result as ARG namedtuple
+
+    results are cached, until the symbol table changes.
     """
+    global _arg_cache_symbols, _arg_cache_generation, arg_cache_hits, arg_cache_misses
+    generation = symbols.generation if symbols is not None else None
+    if symbols is not _arg_cache_symbols or generation != _arg_cache_generation:
+        _arg_cache.clear()
+        _arg_cache_symbols = symbols
+        _arg_cache_generation = generation
+    else:
+        result = _arg_cache.get(arg)
+        if result is not None:
+            arg_cache_hits += 1
+            return result
+    arg_cache_misses += 1
+    result = _arg_qualify(arg)
+    if len(_arg_cache) >= ARG_CACHE_SIZE:
+        _arg_cache.clear()
+    _arg_cache[arg] = result
+    return result
+
+
+def arg_cache_stats():
+    """
+    return (hits, misses) of the arg_qualify cache
+    """
+    return arg_cache_hits, arg_cache_misses
+
+
+def _arg_qualify(arg):
     arg_lower = arg.lower()
     if len(arg) == 2:
         if arg_lower[0] == 'r' and arg[1] in '0123456789':
@@ -388,115 +387,117 @@ def _soc_reg_to_ulp_periph_sel(reg):
 def i_reg_wr(reg, high_bit, low_bit, val):
     reg = get_imm(reg)
     if reg <= DR_REG_MAX_DIRECT:  # see https://github.com/espressif/binutils-esp32ulp/blob/master/gas/config/tc-esp32ulp_esp32.c
-        _wr_reg.addr = reg & 0xff
-        _wr_reg.periph_sel = (reg & 0x300) >> 8
+        addr = reg & 0xff
+        periph_sel = (reg & 0x300) >> 8
     else:
-        _wr_reg.addr = (reg >> 2) & 0xff
-        _wr_reg.periph_sel = _soc_reg_to_ulp_periph_sel(reg)
-    _wr_reg.data = get_imm(val)
-    _wr_reg.low = get_imm(low_bit)
-    _wr_reg.high = get_imm(high_bit)
-    _wr_reg.opcode = OPCODE_WR_REG
-    return _wr_reg.all
+        addr = (reg >> 2) & 0xff
+        periph_sel = _soc_reg_to_ulp_periph_sel(reg)
+    return _wr_reg.encode(
+        addr=addr,
+        periph_sel=periph_sel,
+        data=get_imm(val),
+        low=get_imm(low_bit),
+        high=get_imm(high_bit),
+        opcode=OPCODE_WR_REG,
+    )
 
 
 def i_reg_rd(reg, high_bit, low_bit):
     reg = get_imm(reg)
     if reg <= DR_REG_MAX_DIRECT:  # see https://github.com/espressif/binutils-esp32ulp/blob/master/gas/config/tc-esp32ulp_esp32.c
-        _rd_reg.addr = reg & 0xff
-        _rd_reg.periph_sel = (reg & 0x300) >> 8
+        addr = reg & 0xff
+        periph_sel = (reg & 0x300) >> 8
     else:
-        _rd_reg.addr = (reg >> 2) & 0xff
-        _rd_reg.periph_sel = _soc_reg_to_ulp_periph_sel(reg)
-    _rd_reg.unused = 0
-    _rd_reg.low = get_imm(low_bit)
-    _rd_reg.high = get_imm(high_bit)
-    _rd_reg.opcode = OPCODE_RD_REG
-    return _rd_reg.all
+        addr = (reg >> 2) & 0xff
+        periph_sel = _soc_reg_to_ulp_periph_sel(reg)
+    return _rd_reg.encode(
+        addr=addr,
+        periph_sel=periph_sel,
+        low=get_imm(low_bit),
+        high=get_imm(high_bit),
+        opcode=OPCODE_RD_REG,
+    )
 
 
 def i_i2c_rd(sub_addr, high_bit, low_bit, slave_sel):
-    _i2c.sub_addr = get_imm(sub_addr)
-    _i2c.data = 0
-    _i2c.low = get_imm(low_bit)
-    _i2c.high = get_imm(high_bit)
-    _i2c.i2c_sel = get_imm(slave_sel)
-    _i2c.unused = 0
-    _i2c.rw = 0
-    _i2c.opcode = OPCODE_I2C
-    return _i2c.all
+    return _i2c.encode(
+        sub_addr=get_imm(sub_addr),
+        data=0,
+        low=get_imm(low_bit),
+        high=get_imm(high_bit),
+        i2c_sel=get_imm(slave_sel),
+        rw=0,
+        opcode=OPCODE_I2C,
+    )
 
 
 def i_i2c_wr(sub_addr, value, high_bit, low_bit, slave_sel):
-    _i2c.sub_addr = get_imm(sub_addr)
-    _i2c.data = get_imm(value)
-    _i2c.low = get_imm(low_bit)
-    _i2c.high = get_imm(high_bit)
-    _i2c.i2c_sel = get_imm(slave_sel)
-    _i2c.unused = 0
-    _i2c.rw = 1
-    _i2c.opcode = OPCODE_I2C
-    return _i2c.all
+    return _i2c.encode(
+        sub_addr=get_imm(sub_addr),
+        data=get_imm(value),
+        low=get_imm(low_bit),
+        high=get_imm(high_bit),
+        i2c_sel=get_imm(slave_sel),
+        rw=1,
+        opcode=OPCODE_I2C,
+    )
 
 
 def i_nop():
-    _delay.cycles = 0
-    _delay.unused = 0
-    _delay.opcode = OPCODE_DELAY
-    return _delay.all
+    return _delay.encode(
+        cycles=0,
+        opcode=OPCODE_DELAY,
+    )
 
 
 def i_wait(cycles):
-    _delay.cycles = get_imm(cycles)
-    _delay.unused = 0
-    _delay.opcode = OPCODE_DELAY
-    return _delay.all
+    return _delay.encode(
+        cycles=get_imm(cycles),
+        opcode=OPCODE_DELAY,
+    )
 
 
 def i_tsens(reg_dest, delay):
-    _tsens.dreg = get_reg(reg_dest)
-    _tsens.delay = get_imm(delay)
-    _tsens.unused = 0
-    _tsens.opcode = OPCODE_TSENS
-    return _tsens.all
+    return _tsens.encode(
+        dreg=get_reg(reg_dest),
+        delay=get_imm(delay),
+        opcode=OPCODE_TSENS,
+    )
 
 
 def i_adc(reg_dest, adc_idx, mux, _not_used=None):
-    _adc.dreg = get_reg(reg_dest)
-    _adc.mux = get_imm(mux)
-    _adc.sar_sel = get_imm(adc_idx)
-    _adc.unused1 = 0
-    _adc.cycles = 0
-    _adc.unused2 = 0
-    _adc.opcode = OPCODE_ADC
-    return _adc.all
+    return _adc.encode(
+        dreg=get_reg(reg_dest),
+        mux=get_imm(mux),
+        sar_sel=get_imm(adc_idx),
+        cycles=0,
+        opcode=OPCODE_ADC,
+    )
 
 
 def i_st(reg_val, reg_addr, offset):
-    _st.dreg = get_reg(reg_addr)
-    _st.sreg = get_reg(reg_val)
-    _st.unused1 = 0
-    _st.offset = get_imm(offset) // 4
-    _st.unused2 = 0
-    _st.sub_opcode = SUB_OPCODE_ST
-    _st.opcode = OPCODE_ST
-    return _st.all
+    return _st.encode(
+        dreg=get_reg(reg_addr),
+        sreg=get_reg(reg_val),
+        offset=get_imm(offset) // 4,
+        sub_opcode=SUB_OPCODE_ST,
+        opcode=OPCODE_ST,
+    )
 
 
 def i_halt():
-    _halt.unused = 0
-    _halt.opcode = OPCODE_HALT
-    return _halt.all
+    return _halt.encode(
+        opcode=OPCODE_HALT,
+    )
 
 
 def i_ld(reg_dest, reg_addr, offset):
-    _ld.dreg = get_reg(reg_dest)
-    _ld.sreg = get_reg(reg_addr)
-    _ld.unused1 = 0
-    _ld.offset = get_imm(offset) // 4
-    _ld.unused2 = 0
-    _ld.opcode = OPCODE_LD
-    return _ld.all
+    return _ld.encode(
+        dreg=get_reg(reg_dest),
+        sreg=get_reg(reg_addr),
+        offset=get_imm(offset) // 4,
+        opcode=OPCODE_LD,
+    )
 
 
 def i_move(reg_dest, reg_imm_src):
@@ -504,23 +505,23 @@ def i_move(reg_dest, reg_imm_src):
     dest = get_reg(reg_dest)
     src = arg_qualify(reg_imm_src)
     if src.type == REG:
-        _alu_reg.dreg = dest
-        _alu_reg.sreg = src.value
-        _alu_reg.treg = src.value  # XXX undocumented, this is the value binutils-esp32 uses
-        _alu_reg.unused = 0
-        _alu_reg.sel = ALU_SEL_MOV
-        _alu_reg.sub_opcode = SUB_OPCODE_ALU_REG
-        _alu_reg.opcode = OPCODE_ALU
-        return _alu_reg.all
+        return _alu_reg.encode(
+            dreg=dest,
+            sreg=src.value,
+            treg=src.value,  # XXX undocumented, this is the value binutils-esp32 uses
+            sel=ALU_SEL_MOV,
+            sub_opcode=SUB_OPCODE_ALU_REG,
+            opcode=OPCODE_ALU,
+        )
     if src.type == IMM or src.type == SYM:
-        _alu_imm.dreg = dest
-        _alu_imm.sreg = 0
-        _alu_imm.imm = get_abs(src)
-        _alu_imm.unused = 0
-        _alu_imm.sel = ALU_SEL_MOV
-        _alu_imm.sub_opcode = SUB_OPCODE_ALU_IMM
-        _alu_imm.opcode = OPCODE_ALU
-        return _alu_imm.all
+        return _alu_imm.encode(
+            dreg=dest,
+            sreg=0,
+            imm=get_abs(src),
+            sel=ALU_SEL_MOV,
+            sub_opcode=SUB_OPCODE_ALU_IMM,
+            opcode=OPCODE_ALU,
+        )
     raise TypeError('unsupported operand: %s' % src.raw)
 
 
@@ -532,23 +533,23 @@ def _alu3(reg_dest, reg_src1, reg_imm_src2, alu_sel):
     src1 = get_reg(reg_src1)
     src2 = arg_qualify(reg_imm_src2)
     if src2.type == REG:
-        _alu_reg.dreg = dest
-        _alu_reg.sreg = src1
-        _alu_reg.treg = src2.value
-        _alu_reg.unused = 0
-        _alu_reg.sel = alu_sel
-        _alu_reg.sub_opcode = SUB_OPCODE_ALU_REG
-        _alu_reg.opcode = OPCODE_ALU
-        return _alu_reg.all
+        return _alu_reg.encode(
+            dreg=dest,
+            sreg=src1,
+            treg=src2.value,
+            sel=alu_sel,
+            sub_opcode=SUB_OPCODE_ALU_REG,
+            opcode=OPCODE_ALU,
+        )
     if src2.type == IMM or src2.type == SYM:
-        _alu_imm.dreg = dest
-        _alu_imm.sreg = src1
-        _alu_imm.imm = get_abs(src2)
-        _alu_imm.unused = 0
-        _alu_imm.sel = alu_sel
-        _alu_imm.sub_opcode = SUB_OPCODE_ALU_IMM
-        _alu_imm.opcode = OPCODE_ALU
-        return _alu_imm.all
+        return _alu_imm.encode(
+            dreg=dest,
+            sreg=src1,
+            imm=get_abs(src2),
+            sel=alu_sel,
+            sub_opcode=SUB_OPCODE_ALU_IMM,
+            opcode=OPCODE_ALU,
+        )
     raise TypeError('unsupported operand: %s' % src2.raw)
 
 
@@ -581,13 +582,12 @@ def _alu_stage(imm, alu_sel):
     Stage counter instructions with 1 arg: stage_inc / stage_dec
     """
     imm = get_imm(imm)
-    _alu_cnt.unused1 = 0
-    _alu_cnt.imm = imm
-    _alu_cnt.unused2 = 0
-    _alu_cnt.sel = alu_sel
-    _alu_cnt.sub_opcode = SUB_OPCODE_ALU_CNT
-    _alu_cnt.opcode = OPCODE_ALU
-    return _alu_cnt.all
+    return _alu_cnt.encode(
+        imm=imm,
+        sel=alu_sel,
+        sub_opcode=SUB_OPCODE_ALU_CNT,
+        opcode=OPCODE_ALU,
+    )
 
 
 def i_stage_inc(imm):
@@ -603,19 +603,19 @@ def i_stage_rst():
 
 
 def i_wake():
-    _end.wakeup = 1
-    _end.unused = 0
-    _end.sub_opcode = SUB_OPCODE_END
-    _end.opcode = OPCODE_END
-    return _end.all
+    return _end.encode(
+        wakeup=1,
+        sub_opcode=SUB_OPCODE_END,
+        opcode=OPCODE_END,
+    )
 
 
 def i_sleep(timer_idx):
-    _sleep.cycle_sel = get_imm(timer_idx)
-    _sleep.unused = 0
-    _sleep.sub_opcode = SUB_OPCODE_SLEEP
-    _sleep.opcode = OPCODE_END
-    return _sleep.all
+    return _sleep.encode(
+        cycle_sel=get_imm(timer_idx),
+        sub_opcode=SUB_OPCODE_SLEEP,
+        opcode=OPCODE_END,
+    )
 
 
 def i_jump(target, condition='--'):
@@ -630,24 +630,24 @@ def i_jump(target, condition='--'):
     else:
         raise ValueError("invalid flags condition")
     if target.type == IMM or target.type == SYM:
-        _bx.dreg = 0
         # we track label addresses in 32bit words, but immediate values are in bytes and need to get divided by 4.
-        _bx.addr = get_abs(target) if target.type == SYM else get_abs(target) >> 2  # bitwise version of "// 4"
-        _bx.unused = 0
-        _bx.reg = 0
-        _bx.type = jump_type
-        _bx.sub_opcode = SUB_OPCODE_BX
-        _bx.opcode = OPCODE_BRANCH
-        return _bx.all
+        return _bx.encode(
+            dreg=0,
+            addr=get_abs(target) if target.type == SYM else get_abs(target) >> 2,  # bitwise version of "// 4"
+            reg=0,
+            type=jump_type,
+            sub_opcode=SUB_OPCODE_BX,
+            opcode=OPCODE_BRANCH,
+        )
     if target.type == REG:
-        _bx.dreg = target.value
-        _bx.addr = 0
-        _bx.unused = 0
-        _bx.reg = 1
-        _bx.type = jump_type
-        _bx.sub_opcode = SUB_OPCODE_BX
-        _bx.opcode = OPCODE_BRANCH
-        return _bx.all
+        return _bx.encode(
+            dreg=target.value,
+            addr=0,
+            reg=1,
+            type=jump_type,
+            sub_opcode=SUB_OPCODE_BX,
+            opcode=OPCODE_BRANCH,
+        )
     raise TypeError('unsupported operand: %s' % target.raw)
 
 
@@ -655,13 +655,14 @@ def _jump_relr(threshold, cond, offset):
     """
     Equivalent of I_JUMP_RELR macro in binutils-esp32ulp
     """
-    _br.imm = threshold
-    _br.cmp = cond
-    _br.offset = abs(offset)
-    _br.sign = 0 if offset >= 0 else 1
-    _br.sub_opcode = SUB_OPCODE_BR
-    _br.opcode = OPCODE_BRANCH
-    return _br.all
+    return _br.encode(
+        imm=threshold,
+        cmp=cond,
+        offset=abs(offset),
+        sign=0 if offset >= 0 else 1,
+        sub_opcode=SUB_OPCODE_BR,
+        opcode=OPCODE_BRANCH,
+    )
 
 
 def i_jumpr(offset, threshold, condition):
@@ -698,13 +699,14 @@ def _jump_rels(threshold, cond, offset):
     """
     Equivalent of I_JUMP_RELS macro in binutils-esp32ulp
     """
-    _bs.imm = threshold
-    _bs.cmp = cond
-    _bs.offset = abs(offset)
-    _bs.sign = 0 if offset >= 0 else 1
-    _bs.sub_opcode = SUB_OPCODE_BS
-    _bs.opcode = OPCODE_BRANCH
-    return _bs.all
+    return _bs.encode(
+        imm=threshold,
+        cmp=cond,
+        offset=abs(offset),
+        sign=0 if offset >= 0 else 1,
+        sub_opcode=SUB_OPCODE_BS,
+        opcode=OPCODE_BRANCH,
+    )
 
 
 def i_jumps(offset, threshold, condition):
@@ -741,11 +743,53 @@ def i_jumps(offset, threshold, condition):
     return _jump_rels(threshold, cmp_op, offset)
 
 
-def no_of_instr(opcode, args):
-    if opcode == 'jumpr' and get_cond(args[2]) == 'eq':
-        return 2
+# number of arguments of the instructions: (minimum, maximum)
+ARG_COUNTS = {
+    'reg_wr': (4, 4),
+    'reg_rd': (3, 3),
+    'i2c_rd': (4, 4),
+    'i2c_wr': (5, 5),
+    'nop': (0, 0),
+    'wait': (1, 1),
+    'tsens': (2, 2),
+    'adc': (3, 4),
+    'st': (3, 3),
+    'halt': (0, 0),
+    'ld': (3, 3),
+    'move': (2, 2),
+    'add': (3, 3),
+    'sub': (3, 3),
+    'and': (3, 3),
+    'or': (3, 3),
+    'lsh': (3, 3),
+    'rsh': (3, 3),
+    'stage_inc': (1, 1),
+    'stage_dec': (1, 1),
+    'stage_rst': (0, 0),
+    'wake': (0, 0),
+    'sleep': (1, 1),
+    'jump': (1, 2),
+    'jumpr': (3, 3),
+    'jumps': (3, 3),
+}
+
+
+def _jumpr_instr(args):
+    return 2 if get_cond(args[2]) == 'eq' else 1
+
+
+def _jumps_instr(args):
+    return 2 if get_cond(args[2]) in ('eq', 'gt') else 1
+
+
+# instructions which may assemble to more than 1 machine instruction:
+# function of the arguments, returning the number of machine instructions
+INSTR_COUNTS = {
+    'jumpr': _jumpr_instr,
+    'jumps': _jumps_instr,
+}
 
-    if opcode == 'jumps' and get_cond(args[2]) in ('eq', 'gt'):
-        return 2
 
-    return 1
+def no_of_instr(opcode, args):
+    count = INSTR_COUNTS.get(opcode)
+    return 1 if count is None else count(args)
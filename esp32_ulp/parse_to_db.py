@@ -8,11 +8,15 @@
 import sys
 
 from .preprocess import Preprocessor
-from .definesdb import DefinesDB
+from .definesdb import DefinesDB, BtreeBackend
 
+# memory (bytes) for the btree to cache pages while loading, so it needs to
+# flush pages to the file less often.
+BTREE_CACHESIZE = 16 * 1024
 
-def parse(files):
-    db = DefinesDB()
+
+def parse(files, btree_cachesize=BTREE_CACHESIZE):
+    db = DefinesDB(backend=BtreeBackend(cachesize=btree_cachesize))
 
     p = Preprocessor()
     p.use_db(db)
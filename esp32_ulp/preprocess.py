@@ -5,9 +5,25 @@
 # SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
 # SPDX-License-Identifier: MIT
 
+import os
+
 from . import nocomment
-from .util import split_tokens
+from .util import split_tokens, iter_tokens, parse_int, read_lines, dirname, parse_include_name, find_include
 from .definesdb import DefinesDB
+from .profiler import NO_STAGE
+
+
+# number of defines collected from an include file before storing them
+INCLUDE_BATCH_SIZE = 500
+
+# files included with #include are parsed only once (per process) and kept
+# in this cache, until they change: path -> ((size, mtime), defines, includes)
+INCLUDE_CACHE_SIZE = 16
+_include_cache = {}
+
+
+def clear_include_cache():
+    _include_cache.clear()
 
 
 class RTC_Macros:
@@ -37,10 +53,265 @@ class RTC_Macros:
         return RTC_Macros.WRITE_RTC_REG(rtc_reg, low_bit, 1, value + ' & 1')
 
 
+RTC_MACROS = {
+    'READ_RTC_REG': RTC_Macros.READ_RTC_REG,
+    'WRITE_RTC_REG': RTC_Macros.WRITE_RTC_REG,
+    'READ_RTC_FIELD': RTC_Macros.READ_RTC_FIELD,
+    'WRITE_RTC_FIELD': RTC_Macros.WRITE_RTC_FIELD,
+}
+
+# function-like macros are stored with the defines, as name + MACRO_SUFFIX
+# (which is not a valid identifier, so it can't clash with other defines)
+# and with the parameter list and body as value, e.g. "f()": "(a, b) a + b".
+MACRO_SUFFIX = '()'
+
+# the ESP-IDF SoC headers, e.g. #include "soc/rtc_cntl_reg.h": their defines
+# are expected to come from the defines db (see parse_to_db) and the RTC
+# macros of soc/soc_ulp.h are built in, so these are skipped if not found.
+ESP_IDF_INCLUDE_PREFIX = 'soc/'
+
+
+def compile_macro(definition):
+    """
+    compile the definition "(params) body" of a function-like macro into
+    (number of params, template), the template being a tuple of text parts
+    (str) and parameter slots: (index of the parameter, expand), where expand
+    is False for parameters pasted with ## (those are not expanded first).
+
+    returns None for macros which are not supported (variadic macros).
+    """
+    end = definition.find(')')
+    params = [p.strip() for p in definition[1:end].split(',')]
+    if params == ['']:
+        params = []
+    if '...' in params:
+        return None
+
+    # drop the ## and the whitespace around them, remember pasted tokens
+    items = []  # [token, pasted]
+    tokens = split_tokens(definition[end + 1:].strip())
+    pasted = False
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        i += 1
+        if t == '#' and i < len(tokens) and tokens[i] == '#':
+            while items and items[-1][0][0] in ' \t':
+                items.pop()
+            if items:
+                items[-1][1] = True
+            i += 1
+            while i < len(tokens) and tokens[i][0] in ' \t':
+                i += 1
+            pasted = True
+            continue
+        items.append([t, pasted])
+        pasted = False
+
+    template = []
+    text = ''
+    for t, pasted in items:
+        if t in params:
+            if text:
+                template.append(text)
+                text = ''
+            template.append((params.index(t), not pasted))
+        else:
+            text += t
+    if text:
+        template.append(text)
+    return len(params), tuple(template)
+
+
+# operators of #if expressions and their precedence (like in C)
+CONDITION_OPS = {
+    '*': 10, '/': 10, '%': 10,
+    '+': 9, '-': 9,
+    '<<': 8, '>>': 8,
+    '<': 7, '>': 7, '<=': 7, '>=': 7,
+    '==': 6, '!=': 6,
+    '&': 5,
+    '^': 4,
+    '|': 3,
+    '&&': 2,
+    '||': 1,
+}
+
+# states of an #if directive (or of one of its nested ones)
+TAKING, WAITING, DONE = 0, 1, 2  # in the taken branch, no branch taken yet, branch already taken
+
+
+def eval_condition(expr):
+    """
+    evaluate the integer expression of an #if or #elif directive, after its
+    defines were expanded. like in C, remaining identifiers evaluate to 0.
+    """
+    tokens = []
+    separated = True
+    for t in iter_tokens(expr):
+        if t[0] in ' \t':
+            separated = True
+            continue
+        if not separated and tokens and tokens[-1] + t in CONDITION_OPS:
+            tokens[-1] += t  # two char operators, e.g. <= or &&
+        else:
+            tokens.append(t)
+        separated = False
+    try:
+        value, i = _eval_condition(tokens, 0, 1)
+    except IndexError:
+        i = -1  # expression ended too early
+    if i != len(tokens):
+        raise ValueError('Invalid #if expression: %s' % expr)
+    return value
+
+
+def _eval_condition(tokens, i, min_precedence):
+    # precedence climbing: evaluate tokens[i:] as long as the operators bind
+    # at least as strong as min_precedence. returns the value and the index
+    # of the first token not evaluated.
+    t = tokens[i]
+    if t == '(':
+        value, i = _eval_condition(tokens, i + 1, 1)
+        if tokens[i] != ')':
+            raise IndexError
+        i += 1
+    elif t in ('!', '~', '-', '+'):
+        value, i = _eval_condition(tokens, i + 1, 11)  # unary operators bind strongest
+        if t == '!':
+            value = int(not value)
+        elif t == '~':
+            value = ~value
+        elif t == '-':
+            value = -value
+    elif t[0] in '0123456789':
+        value = parse_int(t.rstrip('uUlL'))  # C integer suffixes, e.g. 1UL
+        i += 1
+    elif t[0].isalpha() or t[0] == '_':
+        value = 0
+        i += 1
+    else:
+        raise IndexError
+    while i < len(tokens):
+        op = tokens[i]
+        precedence = CONDITION_OPS.get(op)
+        if precedence is None or precedence < min_precedence:
+            break
+        b, i = _eval_condition(tokens, i + 1, precedence + 1)  # left-associative
+        a = value
+        if op == '+':
+            value = a + b
+        elif op == '-':
+            value = a - b
+        elif op == '*':
+            value = a * b
+        elif op == '/' or op == '%':
+            if b == 0:
+                raise ValueError('Division by zero in #if expression')
+            # integer division truncating towards zero, like in C
+            q = abs(a) // abs(b)
+            if (a < 0) != (b < 0):
+                q = -q
+            value = q if op == '/' else a - b * q
+        elif op == '<<':
+            value = a << b
+        elif op == '>>':
+            value = a >> b
+        elif op == '&':
+            value = a & b
+        elif op == '^':
+            value = a ^ b
+        elif op == '|':
+            value = a | b
+        elif op == '&&':
+            value = int(bool(a and b))
+        elif op == '||':
+            value = int(bool(a or b))
+        elif op == '==':
+            value = int(a == b)
+        elif op == '!=':
+            value = int(a != b)
+        elif op == '<':
+            value = int(a < b)
+        elif op == '>':
+            value = int(a > b)
+        elif op == '<=':
+            value = int(a <= b)
+        else:
+            value = int(a >= b)
+    return value, i
+
+
+def blank_skipped_lines(lines, skipped):
+    """
+    generator: yield the lines, but empty lines instead of those within the
+    skipped regions (see Preprocessor.parse_directives), so line numbers stay.
+    the empty lines of a region are yielded at once, as one chunk.
+    """
+    skipped = iter(skipped)
+    start, end = next(skipped, (None, None))
+    for i, line in enumerate(lines):
+        if start is None or i < start:
+            yield line
+        elif i == end - 1:
+            yield '\n' * (end - start)
+            start, end = next(skipped, (None, None))
+
+
+def split_directive(line):
+    """
+    split a directive line (starting with #) into the directive name and the
+    rest of the line, e.g. '#if(X)' into ['if', '(X)']. like split(), there
+    is no rest in the list if it would be empty.
+    """
+    line = line[1:].lstrip()
+    end = 0
+    while end < len(line) and (line[end].isalnum() or line[end] == '_'):
+        end += 1
+    rest = line[end:].strip()
+    return [line[:end], rest] if rest else [line[:end]]
+
+
+def parse_macro_args(tokens, i):
+    """
+    parse the arguments of a macro call, tokens[i] being the first token
+    after the macro name. returns (list of arguments, index of the token
+    after the closing bracket) or None, if tokens[i:] is not a macro call.
+    """
+    n = len(tokens)
+    while i < n and tokens[i][0] in ' \t':
+        i += 1
+    if i == n or tokens[i] != '(':
+        return None
+    args = []
+    arg = []
+    depth = 0
+    for i in range(i + 1, n):
+        t = tokens[i]
+        if t == '(':
+            depth += 1
+        elif t == ')':
+            if depth == 0:
+                args.append(''.join(arg).strip())
+                return args, i + 1
+            depth -= 1
+        elif t == ',' and depth == 0:
+            args.append(''.join(arg).strip())
+            arg = []
+            continue
+        arg.append(t)
+    return None  # no closing bracket
+
+
 class Preprocessor:
     def __init__(self):
         self._defines_db = None
         self._defines = {}
+        self._profiler = None
+        self._expanded = {}  # identifier -> fully expanded value (or None)
+        self._macros = {}  # name -> compiled function-like macro (or None)
+        self._cycles = 0  # number of cycles found while expanding
+        self._include_paths = []
 
     def parse_define_line(self, line):
         line = line.strip()
@@ -49,69 +320,381 @@ class Preprocessor:
             return {}
         line = line[8:].strip()  # remove #define
         parts = line.split(None, 1)
-        if len(parts) != 2:
-            # skip defines without value
+        if not parts:
             return {}
-        identifier, value = parts
+        identifier = parts[0]
+        value = parts[1] if len(parts) == 2 else ''  # e.g. #define ESP32
         tmp = identifier.split('(', 1)
         if len(tmp) == 2:
-            # skip parameterized defines (macros)
-            return {}
+            # parameterized define (macro): the parameter list directly
+            # follows the name and ends at the first closing bracket
+            identifier, params = tmp
+            params, _, body = (params + ' ' + value).partition(')')
+            # ## (token pasting) must not be taken for a # comment
+            body = '##'.join("".join(nocomment.remove_comments(part)).strip() for part in body.split('##'))
+            if body.endswith('\\'):
+                # skip macros continued on the next line
+                return {}
+            return {identifier + MACRO_SUFFIX: '(%s) %s' % (params, body)}
         value = "".join(nocomment.remove_comments(value)).strip()
         return {identifier: value}
 
-    def parse_defines(self, content):
-        for line in content.splitlines():
-            self._defines.update(self.parse_define_line(line))
+    def reset_expansions(self):
+        # forget memoized expansions, they depend on the defines
+        self._expanded = {}
+        self._macros = {}
 
+    def parse_defines(self, content):
+        self.parse_directives((content, ))
         return self._defines
 
-    def expand_defines(self, line):
-        found = True
-        while found:  # do as many passes as needed, until nothing is replaced anymore
-            found = False
-            tokens = split_tokens(line)
-            line = ""
-            for t in tokens:
-                lu = self._defines.get(t, t)
-                if lu == t and self._defines_db:
-                    lu = self._defines_db.get(t, t)
-                if lu == t and t == 'BIT':
-                    # Special hack: BIT(..) translates to a 32-bit mask where only the specified bit is set.
-                    # But the reg_wr and reg_rd opcodes expect actual bit numbers for argument 2 and 3.
-                    # While the real READ_RTC_*/WRITE_RTC_* macros take in the output of BIT(x), they
-                    # ultimately convert these back (via helper macros) to the bit number (x). And since this
-                    # preprocessor does not (aim to) implement "proper" macro-processing, we can simply
-                    # short-circuit this round-trip via macros and replace "BIT" with nothing so that
-                    # "BIT(x)" gets mapped to "(x)".
+    def parse_directives(self, lines, directory='.'):
+        """
+        collect the defines from lines and evaluate the conditional directives
+        (#if, #ifdef, #ifndef, #elif, #else, #endif). defines within skipped
+        regions are ignored. the defines of files included with #include are
+        collected too (directory: where the lines are from, it is searched
+        for included files first).
+
+        lines: iterable of chunks of the source, see iter_remove_comments.
+        directives within /* */ comments are ignored.
+
+        within skipped regions, only lines starting with # are looked at, to
+        find the nested directives. nothing is expanded or tokenized there.
+
+        returns the skipped regions as a list of (index of first line, index
+        after last line), ordered by line.
+        """
+        self.reset_expansions()
+        skipped = []
+        stack = []  # [state, line index] of each open #if
+        skip_start = None  # first line of the current skipped region
+        with self.open_db():
+            for i, line in enumerate(nocomment.iter_remove_comments(lines, keep_directives=True)):
+                line = line.lstrip()
+                if not line.startswith('#'):
+                    continue
+                if skip_start is None and line.startswith('#define'):
+                    self._defines.update(self.parse_define_line(line))
+                    if self._expanded:
+                        self.reset_expansions()  # a condition used the defines so far
                     continue
-                if lu != t:
-                    found = True
-                line += lu
+                parts = split_directive(line)
+                directive = parts[0]
+                if directive == 'include' and skip_start is None:
+                    name = parse_include_name(parts[1]) if len(parts) == 2 else None
+                    if name is None:
+                        raise ValueError('Line %d: Invalid #include' % (i + 1))
+                    try:
+                        self.include(name, directory)
+                    except ValueError as e:
+                        raise ValueError('Line %d: %s' % (i + 1, e))
+                    if self._expanded:
+                        self.reset_expansions()
+                    continue
+                if directive not in ('if', 'ifdef', 'ifndef', 'elif', 'else', 'endif'):
+                    continue
+                if directive.startswith('if'):
+                    if skip_start is not None:
+                        stack.append([DONE, i])  # nested in a skipped region, skip all of it
+                        continue
+                    taken = self.evaluate_directive(directive, parts, i)
+                    stack.append([TAKING if taken else WAITING, i])
+                else:
+                    if not stack:
+                        raise ValueError('Line %d: #%s without #if' % (i + 1, directive))
+                    state = stack[-1][0]
+                    if directive == 'endif':
+                        stack.pop()
+                    elif state == TAKING:
+                        stack[-1][0] = DONE
+                    elif state == WAITING and (directive == 'else' or self.evaluate_directive(directive, parts, i)):
+                        stack[-1][0] = TAKING
+                # start or end a skipped region
+                active = not stack or stack[-1][0] == TAKING
+                if skip_start is None and not active:
+                    skip_start = i + 1
+                elif skip_start is not None and active:
+                    if i > skip_start:
+                        skipped.append((skip_start, i))
+                    skip_start = None
+        if stack:
+            raise ValueError('Line %d: #if without #endif' % (stack[-1][1] + 1))
+        self.reset_expansions()
+        return skipped
+
+    def find_include(self, name, directory):
+        """
+        return the path of the file included as name ("file" or <file>), or
+        None if not found. "file" is searched in directory first, then in the
+        include paths, <file> only in the include paths.
+        """
+        return find_include(name, directory, self._include_paths)
+
+    def parse_include(self, path):
+        """
+        return the defines of the file path and the names of the files it
+        includes. parsed files are cached, keyed by path, size and mtime, so
+        a file is parsed only once, no matter how often it is included.
+        """
+        stat = os.stat(path)
+        key = (stat[6], stat[8])  # size, mtime
+        cached = _include_cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+        defines = {}
+        includes = []
+        with open(path) as f:
+            for line in read_lines(f):
+                line = line.lstrip()
+                if line.startswith('#include'):
+                    name = parse_include_name(line[8:])
+                    if name is not None:
+                        includes.append(name)
+                else:
+                    defines.update(self.parse_define_line(line))
+        if len(_include_cache) >= INCLUDE_CACHE_SIZE:
+            _include_cache.clear()
+        _include_cache[path] = (key, defines, includes)
+        return defines, includes
+
+    def include(self, name, directory, including=()):
+        """
+        add the defines of the file included as name (and of the files it
+        includes) to the defines. like for process_include_file, all defines
+        of included files are used (conditionals are not evaluated there) and
+        anything else in them is ignored.
+
+        files which are not found are skipped, if their defines are expected
+        to be in the defines db: ESP-IDF SoC headers, or any file if there is
+        a defines db. otherwise, a ValueError is raised.
+        """
+        path = self.find_include(name, directory)
+        if path is None:
+            if name[1:].startswith(ESP_IDF_INCLUDE_PREFIX):
+                return
+            if self._defines_db is not None and self._defines_db.db_exists():
+                return
+            raise ValueError('Include file not found: %s' % name)
+        if path in including:
+            return  # included recursively, defines collected already
+        defines, includes = self.parse_include(path)
+        for nested in includes:
+            self.include(nested, dirname(path), including + (path,))
+        self._defines.update(defines)
+
+    def use_include_paths(self, paths):
+        """
+        set the directories to search for files included with #include
+        """
+        self._include_paths = [path.rstrip('/') for path in paths]
+
+    def is_defined(self, name):
+        return self.lookup_define(name) is not None or self.lookup_define(name + MACRO_SUFFIX) is not None
+
+    def evaluate_directive(self, directive, parts, i):
+        """
+        evaluate the condition of an #if, #ifdef, #ifndef or #elif directive
+        (split into parts) found in line i.
+        """
+        expr = "".join(nocomment.remove_comments(parts[1])).strip() if len(parts) == 2 else ''
+        if not expr:
+            raise ValueError('Line %d: #%s without condition' % (i + 1, directive))
+        if directive == 'ifdef':
+            return self.is_defined(expr.split()[0])
+        if directive == 'ifndef':
+            return not self.is_defined(expr.split()[0])
+        # replace defined(NAME) and defined NAME first, NAME must not be expanded
+        tokens = split_tokens(expr)
+        j = 0
+        while j < len(tokens):
+            if tokens[j] == 'defined':
+                k = j + 1
+                bracket = False
+                while k < len(tokens) and (tokens[k][0] in ' \t' or tokens[k] == '(' and not bracket):
+                    bracket = bracket or tokens[k] == '('
+                    k += 1
+                end = k + 1
+                while bracket and end < len(tokens) and tokens[end][0] in ' \t':
+                    end += 1
+                if k == len(tokens) or bracket and (end == len(tokens) or tokens[end] != ')'):
+                    raise ValueError('Line %d: Invalid #%s expression: %s' % (i + 1, directive, expr))
+                tokens[j] = '1' if self.is_defined(tokens[k]) else '0'
+                tokens[j + 1:end + 1 if bracket else end] = []
+            j += 1
+        expanded = self.expand_tokens(tokens)
+        try:
+            return eval_condition("".join(tokens) if expanded is None else expanded) != 0
+        except ValueError as e:
+            raise ValueError('Line %d: %s' % (i + 1, e))
+
+    def lookup_define(self, identifier):
+        """
+        return the value of a define, or None if identifier is not defined.
+        """
+        value = self._defines.get(identifier, identifier)
+        if value == identifier and self._defines_db:
+            value = self._defines_db.get(identifier, identifier)
+        if value == identifier:
+            return None
+        return value
+
+    def expand_identifier(self, identifier, expanding=()):
+        """
+        return the fully expanded value of a define (all defines used in its
+        value are expanded too), or None if identifier is not defined.
+
+        expanding: the identifiers currently being expanded. if one of them is
+        found again in its own expansion (a cycle), it is left as it is (like
+        the C preprocessor does), instead of expanding it endlessly.
+        """
+        try:
+            return self._expanded[identifier]
+        except KeyError:
+            pass
+        if identifier in expanding:
+            self._cycles += 1
+            return None
+        cycles = self._cycles
+        value = self.lookup_define(identifier)
+        if value is not None:
+            tokens = split_tokens(value)
+            expanded = self.expand_tokens(tokens, expanding + (identifier,))
+            if expanded is not None:
+                value = expanded
+        if self._cycles == cycles:
+            # only memoize complete expansions, those not cut short by a cycle
+            # do not depend on what else is being expanded.
+            self._expanded[identifier] = value
+        return value
+
+    def lookup_macro(self, name):
+        """
+        return the compiled function-like macro name, or None if there is no
+        such (supported) macro. macros are compiled only once.
+        """
+        try:
+            return self._macros[name]
+        except KeyError:
+            pass
+        definition = self.lookup_define(name + MACRO_SUFFIX)
+        macro = compile_macro(definition) if definition is not None else None
+        self._macros[name] = macro
+        return macro
+
+    def expand_macro(self, name, tokens, i, expanding=()):
+        """
+        expand the call of the function-like macro name, if tokens[i:] are
+        its arguments. returns (expansion, index of the token after the call)
+        or None if name is not a macro or not called.
+        """
+        call = parse_macro_args(tokens, i)
+        if call is None:
+            return None  # not called, no need to look up name
+        if name in expanding:
+            self._cycles += 1
+            return None
+        macro = self.lookup_macro(name)
+        if macro is None:
+            return None
+        args, end = call
+        count, template = macro
+        if count == 0 and args == ['']:
+            args = []
+        if len(args) != count:
+            raise ValueError('Macro %s expects %d arguments, got %d' % (name, count, len(args)))
+        parts = []
+        for part in template:
+            if isinstance(part, str):
+                parts.append(part)
+                continue
+            arg = args[part[0]]
+            if part[1]:
+                # like the C preprocessor, expand arguments before substituting them
+                expanded = self.expand_tokens(split_tokens(arg), expanding)
+                if expanded is not None:
+                    arg = expanded
+            parts.append(arg)
+        text = ''.join(parts)
+        # the result is scanned for defines and macros again
+        expanded = self.expand_tokens(split_tokens(text), expanding + (name,))
+        return (text if expanded is None else expanded), end
+
+    def expand_tokens(self, tokens, expanding=()):
+        """
+        replace all defined identifiers and macro calls in the list of tokens
+        with their expansions. returns the resulting string, or None if nothing
+        was replaced.
+        """
+        replaced = False
+        i = 0
+        n = len(tokens)
+        while i < n:
+            t = tokens[i]
+            start = i
+            i += 1
+            if not (t[0].isalpha() or t[0] == '_'):
+                continue  # whitespace, operators, numbers: not an identifier
+            value = self.expand_identifier(t, expanding)
+            if value is None and t != 'BIT' and t not in RTC_MACROS:
+                # BIT and the RTC macros are built in (see below and
+                # expand_rtc_macros), other names might be macros
+                call = self.expand_macro(t, tokens, i, expanding)
+                if call is not None:
+                    value, end = call
+                    for j in range(i, end):
+                        tokens[j] = ''
+                    i = end
+            if value is None:
+                if t != 'BIT':
+                    continue
+                # Special hack: BIT(..) translates to a 32-bit mask where only the specified bit is set.
+                # But the reg_wr and reg_rd opcodes expect actual bit numbers for argument 2 and 3.
+                # While the real READ_RTC_*/WRITE_RTC_* macros take in the output of BIT(x), they
+                # ultimately convert these back (via helper macros) to the bit number (x). And since this
+                # preprocessor does not (aim to) implement "proper" macro-processing, we can simply
+                # short-circuit this round-trip via macros and replace "BIT" with nothing so that
+                # "BIT(x)" gets mapped to "(x)".
+                value = ''
+            tokens[start] = value
+            replaced = True
+        if replaced:
+            return "".join(tokens)
+        return None
 
-        return line
+    def expand_defines(self, line):
+        """
+        expand all defines in line, in a single scan over its tokens. lines
+        not using any defines are returned unchanged, without rebuilding them.
+        """
+        expanded = self.expand_tokens(split_tokens(line))
+        if expanded is None:
+            return line
+        return expanded
 
     def process_include_file(self, filename):
+        self.reset_expansions()
         with self.open_db() as db:
             with open(filename, 'r') as f:
-                for line in f:
-                    result = self.parse_define_line(line)
-                    db.update(result)
+                # store the defines in batches, so the database can insert
+                # them sorted, instead of one by one in file order.
+                batch = {}
+                for line in read_lines(f):
+                    batch.update(self.parse_define_line(line))
+                    if len(batch) >= INCLUDE_BATCH_SIZE:
+                        db.update(batch)
+                        batch = {}
+                db.update(batch)
 
         return db
 
     def expand_rtc_macros(self, line):
-        clean_line = line.strip()
-        if not clean_line:
-            return line
-
-        macro = clean_line.split('(', 1)
-        if len(macro) != 2:
-            return line
+        if '(' not in line:
+            return line  # not a macro call
 
-        macro_name, macro_args = macro
+        macro_name, macro_args = line.strip().split('(', 1)
 
-        macro_fn = getattr(RTC_Macros, macro_name, None)
+        macro_fn = RTC_MACROS.get(macro_name)
         if macro_fn is None:
             return line
 
@@ -123,6 +706,15 @@ class Preprocessor:
 
     def use_db(self, defines_db):
         self._defines_db = defines_db
+        self.reset_expansions()
+
+    def use_profiler(self, profiler):
+        self._profiler = profiler
+
+    def stage(self, name):
+        if self._profiler is None:
+            return NO_STAGE
+        return self._profiler.stage(name)
 
     def open_db(self):
         class ctx:
@@ -142,22 +734,70 @@ class Preprocessor:
 
         return ctx(self._defines)
 
-    def preprocess(self, content):
-        self.parse_defines(content)
-
+    def process_lines(self, lines):
+        """
+        generator: expand defines and rtc macros in the (comment-free) lines.
+        """
+        expand_defines, expand_rtc_macros = self.expand_defines, self.expand_rtc_macros
+        if self._profiler is not None:
+            expand_defines = self._profiler.wrap('expand_defines', expand_defines)
+            expand_rtc_macros = self._profiler.wrap('expand_rtc_macros', expand_rtc_macros)
         with self.open_db():
-            lines = nocomment.remove_comments(content)
-            result = []
             for line in lines:
-                line = self.expand_defines(line)
-                line = self.expand_rtc_macros(line)
-                result.append(line)
-            result = "\n".join(result)
-
-        return result
+                line = expand_defines(line)
+                line = expand_rtc_macros(line)
+                yield line
+
+    def preprocess(self, content, directory='.'):
+        """
+        directory: where the content is from, files included with
+        #include "file" are searched there first.
+        """
+        with self.stage('parse_defines'):
+            skipped = self.parse_directives((content, ), directory)
+
+        with self.stage('remove_comments'):
+            if skipped:
+                lines = blank_skipped_lines(content.splitlines(True), skipped)
+                lines = list(nocomment.iter_remove_comments(lines))
+            else:
+                lines = nocomment.remove_comments(content)
+        return "\n".join(self.process_lines(lines))
+
+    def preprocess_file(self, filename):
+        """
+        generator: streaming variant of preprocess, for sources too big to
+        have them in memory as a whole (or even several times).
+
+        reads filename line by line twice: first to collect the defines,
+        then to remove the comments and expand the defines. yields the
+        resulting lines one by one.
+        """
+        with self.stage('parse_defines'):
+            with open(filename) as f:
+                skipped = self.parse_directives(read_lines(f), dirname(filename))
+
+        with open(filename) as f:
+            lines = read_lines(f)
+            if skipped:
+                lines = blank_skipped_lines(lines, skipped)
+            lines = nocomment.iter_remove_comments(lines)
+            if self._profiler is not None:
+                lines = self._profiler.iterate('remove_comments', lines)
+            yield from self.process_lines(lines)
+
+
+def preprocess(content, use_defines_db=True, profiler=None, include_paths=(), directory='.'):
+    preprocessor = Preprocessor()
+    preprocessor.use_db(DefinesDB())
+    preprocessor.use_profiler(profiler)
+    preprocessor.use_include_paths(include_paths)
+    return preprocessor.preprocess(content, directory)
 
 
-def preprocess(content, use_defines_db=True):
+def preprocess_file(filename, use_defines_db=True, profiler=None, include_paths=()):
     preprocessor = Preprocessor()
     preprocessor.use_db(DefinesDB())
-    return preprocessor.preprocess(content)
+    preprocessor.use_profiler(profiler)
+    preprocessor.use_include_paths(include_paths)
+    return preprocessor.preprocess_file(filename)
@@ -0,0 +1,154 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Optional instrumentation of the assembler stages
+
+Pass a Profiler to src_to_binary_ext (or Assembler / Preprocessor.use_profiler)
+to collect per-stage and per-opcode statistics. Without a profiler, nothing
+gets wrapped or measured, so there is no cost at all in the hot paths.
+"""
+
+import gc
+import time
+
+try:
+    ticks_us, ticks_diff = time.ticks_us, time.ticks_diff
+except AttributeError:  # e.g. CPython
+    ticks_us = lambda: int(time.perf_counter() * 1000000)
+    ticks_diff = lambda end, start: end - start
+
+try:
+    mem_alloc = gc.mem_alloc
+except AttributeError:  # e.g. CPython
+    mem_alloc = lambda: 0
+
+
+class NoStage:
+    """
+    context manager doing nothing, used for stages when not profiling
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NO_STAGE = NoStage()
+
+
+class Stage:
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._alloc = mem_alloc()
+        self._start = ticks_us()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        us = ticks_diff(ticks_us(), self._start)
+        self._profiler.add(self._profiler.stages, self._name, us, mem_alloc() - self._alloc)
+
+
+class ProfiledOpcodes:
+    """
+    stands in for an opcodes module, times and counts the instruction encoders
+    """
+    def __init__(self, profiler, opcodes):
+        self._profiler = profiler
+        self._opcodes = opcodes
+        self._encoders = {}
+
+    def __getattr__(self, name):
+        if not name.startswith('i_'):
+            return getattr(self._opcodes, name)
+        try:
+            return self._encoders[name]
+        except KeyError:
+            pass
+        func = getattr(self._opcodes, name)  # AttributeError for unknown opcodes
+        func = self._profiler.wrap(name[2:], func, self._profiler.opcodes)
+        self._encoders[name] = func
+        return func
+
+
+class Profiler:
+    """
+    collects statistics per stage and per opcode:
+
+    stages: stage name -> [count, time in us, allocation delta in bytes]
+    opcodes: opcode -> [count, time in us, 0]
+
+    allocation deltas (gc.mem_alloc() after - before) are only measured for
+    whole stages, not for the stages measured per call (e.g. expand_defines,
+    which is called for every line), as measuring them is not cheap.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.opcodes = {}
+
+    def add(self, stats, name, us, alloc=0):
+        try:
+            s = stats[name]
+        except KeyError:
+            stats[name] = [1, us, alloc]
+            return
+        s[0] += 1
+        s[1] += us
+        s[2] += alloc
+
+    def stage(self, name):
+        """
+        context manager measuring the code run within it as stage name
+        """
+        return Stage(self, name)
+
+    def wrap(self, name, func, stats=None):
+        """
+        return func wrapped to measure each call as stage name
+        (or as opcode name, if stats is self.opcodes)
+        """
+        if stats is None:
+            stats = self.stages
+        add = self.add
+
+        def wrapper(*args):
+            start = ticks_us()
+            try:
+                return func(*args)
+            finally:
+                add(stats, name, ticks_diff(ticks_us(), start))
+        return wrapper
+
+    def iterate(self, name, iterable):
+        """
+        generator: yield the items of iterable, measuring the time it takes
+        to produce each of them as stage name
+        """
+        it = iter(iterable)
+        while True:
+            start = ticks_us()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.add(self.stages, name, ticks_diff(ticks_us(), start))
+            yield item
+
+    def wrap_opcodes(self, opcodes):
+        return ProfiledOpcodes(self, opcodes)
+
+    def dump(self):
+        print("Stages:")
+        for name, (count, us, alloc) in self.stages.items():
+            print("%-18s %6d x %10d us %10d bytes" % (name, count, us, alloc))
+        print("Opcodes:")
+        for name, (count, us, _) in sorted(self.opcodes.items()):
+            print("%-18s %6d x %10d us" % (name, count, us))
@@ -0,0 +1,185 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Sorted key/value file, a read-only alternative to a btree database
+
+Such a file is written once (e.g. on a PC, see tools/build_defines_db.py)
+and then only read. Lookups do a binary search within the file, so the file
+never needs to be loaded into memory. Entries are read into buffers which
+are reused for all lookups, so a lookup allocates (almost) nothing except
+for the value found.
+
+File format (all integers are unsigned 32 bit, little-endian):
+
+    magic          4 bytes: MAGIC
+    count          number of entries
+    offsets        count + 1 offsets (from the start of the file) of the
+                   entries, the last one is the end of the last entry
+    entries        key + b'\\0' + value, sorted by key (as bytes)
+"""
+
+try:
+    from ustruct import pack, unpack
+except ImportError:  # e.g. CPython
+    from struct import pack, unpack
+
+MAGIC = b'ULPd'
+HEADER_SIZE = 8  # magic + count
+# size of the buffer entries are read into. keys must be shorter than this
+# to be looked up without allocations.
+BUFFER_SIZE = 128
+
+
+def is_sorted_db(f):
+    """
+    check whether the open (binary) file f is a sorted db file.
+    """
+    f.seek(0)
+    magic = f.read(len(MAGIC))
+    f.seek(0)
+    return magic == MAGIC
+
+
+def write(f, dictionary):
+    """
+    write all keys and values (str or bytes) of dictionary to the open
+    (binary) file f.
+    """
+    entries = []
+    for k, v in dictionary.items():
+        if isinstance(k, str):
+            k = k.encode()
+        if isinstance(v, str):
+            v = v.encode()
+        entries.append((k, v))
+    entries.sort()
+
+    count = len(entries)
+    f.write(MAGIC)
+    f.write(pack('<I', count))
+    offset = HEADER_SIZE + 4 * (count + 1)
+    for k, v in entries:
+        f.write(pack('<I', offset))
+        offset += len(k) + 1 + len(v)
+    f.write(pack('<I', offset))
+    for k, v in entries:
+        f.write(k)
+        f.write(b'\0')
+        f.write(v)
+
+
+class SortedDB:
+    """
+    read access to a sorted db file, with a (bytes) interface like the one
+    of the btree module.
+    """
+    def __init__(self, f):
+        self._file = f
+        f.seek(0)
+        header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or header[:4] != MAGIC:
+            raise ValueError('not a sorted db file')
+        self._count = unpack('<I', header[4:])[0]
+        self._offset_buf = bytearray(4)
+        self._buf = bytearray(BUFFER_SIZE)
+        self.common = 0
+
+    def offset(self, i):
+        # return the offset of the i-th entry (of the end of the last entry
+        # if i == count).
+        f = self._file
+        f.seek(HEADER_SIZE + 4 * i)
+        f.readinto(self._offset_buf)
+        return int.from_bytes(self._offset_buf, 'little')
+
+    def entry(self, i):
+        # return key and value of the i-th entry
+        start = self.offset(i)
+        end = self.offset(i + 1)
+        f = self._file
+        f.seek(start)
+        entry = f.read(end - start)
+        sep = entry.find(b'\0')
+        return entry[:sep], entry[sep + 1:]
+
+    def compare(self, key, i):
+        # compare the key of the entry in the buffer with key: returns a
+        # value < 0, 0 or > 0 if the entry key is smaller, equal or greater.
+        # the first i bytes are known to be equal already. the length of the
+        # common prefix of both keys is stored in self.common.
+        buf = self._buf
+        n = len(key)
+        while i < n:
+            c = buf[i]
+            if c != key[i]:
+                self.common = i
+                return c - key[i]  # a shorter entry key ends with \0 here, sorting first
+            i += 1
+        self.common = n
+        return buf[n]  # \0 if the entry key ends here too
+
+    def __getitem__(self, key):
+        if len(key) >= BUFFER_SIZE:
+            return self.lookup_long_key(key)
+        f = self._file
+        low, high = 0, self._count
+        # all entries between low and high share the shorter of these
+        # prefixes with key, so comparing can skip them.
+        low_common = high_common = 0
+        while low < high:
+            mid = (low + high) // 2
+            start = self.offset(mid)
+            f.seek(start)
+            n = f.readinto(self._buf)
+            c = self.compare(key, low_common if low_common < high_common else high_common)
+            if c == 0:
+                value_start = len(key) + 1
+                value_end = self.offset(mid + 1) - start
+                if value_end <= n:
+                    return bytes(self._buf[value_start:value_end])
+                f.seek(start + value_start)
+                return f.read(value_end - value_start)
+            if c < 0:
+                low = mid + 1
+                low_common = self.common
+            else:
+                high = mid
+                high_common = self.common
+        raise KeyError(key)
+
+    def lookup_long_key(self, key):
+        # keys not fitting into the buffer are compared the slow way
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            k, v = self.entry(mid)
+            if k == key:
+                return v
+            if k < key:
+                low = mid + 1
+            else:
+                high = mid
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        raise ValueError('sorted db is read-only')
+
+    def keys(self):
+        for i in range(self._count):
+            yield self.entry(i)[0]
+
+    def close(self):
+        pass
+
+
+class SortedBackend:
+    """
+    DefinesDB backend for (read-only) sorted db files, see definesdb.BtreeBackend
+    """
+    def open(self, f):
+        return SortedDB(f)
@@ -10,50 +10,100 @@ DEBUG = False
 import gc
 import os
 
-NORMAL, WHITESPACE = 0, 1
+# character classes for splitting lines into tokens
+OTHER, WORD, WHITESPACE = 0, 1, 2
+
+# kinds of items in a compiled expression (RPN)
+CONST, SYMBOL, UNARY, BINARY = 0, 1, 2, 3
+
+# binary operators and their precedence. binutils-esp32ulp parses expressions
+# with C precedence rules (e.g. 42|4&0xf == 46), which Python also uses.
+BINARY_OPS = {
+    '*': 6, '/': 6, '%': 6,
+    '+': 5, '-': 5,
+    '<<': 4, '>>': 4,
+    '&': 3,
+    '|': 1,
+}
+UNARY_OPS = ('-', '+', '~')
+
+EXPR_CACHE_SIZE = 256
+_expr_cache = {}
+
+READ_CHUNK_SIZE = 1024
 
 
 def garbage_collect(msg, verbose=DEBUG):
+    if not verbose:
+        gc.collect()
+        return
     free_before = gc.mem_free()
     gc.collect()
     free_after = gc.mem_free()
-    if verbose:
-        print("%s: %d --gc--> %d bytes free" % (msg, free_before, free_after))
+    print("%s: %d --gc--> %d bytes free" % (msg, free_before, free_after))
 
 
-def split_tokens(line):
-    buf = ""
-    tokens = []
-    state = NORMAL
-    for c in line:
-        if c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_":
-            if state != NORMAL:
-                if len(buf) > 0:
-                    tokens.append(buf)
-                    buf = ""
-                state = NORMAL
-            buf += c
-        elif c in " \t":
-            if state != WHITESPACE:
-                if len(buf) > 0:
-                    tokens.append(buf)
-                    buf = ""
-                state = WHITESPACE
-            buf += c
-        else:
-            if len(buf) > 0:
-                tokens.append(buf)
-                buf = ""
-            tokens.append(c)
+def import_module(name):
+    # import the module name of this package (e.g. 'opcodes') and return it.
+    # CPython requires a globals dict for relative imports, so pass ours.
+    relative_import = 1 if '/' in __file__ else 0
+    return __import__(name, globals(), None, [], relative_import)
 
-    if len(buf) > 0:
-        tokens.append(buf)
 
-    return tokens
+def _char_classes():
+    classes = bytearray(128)  # everything else: OTHER, a token on its own
+    for c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_":
+        classes[ord(c)] = WORD
+    for c in " \t":
+        classes[ord(c)] = WHITESPACE
+    return bytes(classes)
+
+
+# character class of every ASCII character (index: ord(c)), non-ASCII
+# characters are of class OTHER.
+CHAR_CLASSES = _char_classes()
+
+
+def iter_tokens(line):
+    """
+    generator: yield the tokens of line, i.e. runs of identifier characters
+    (letters, digits, _), runs of whitespace (spaces, tabs) and every other
+    character on its own.
+
+    the class of each character is looked up in CHAR_CLASSES and a token is
+    sliced out of line as a whole where the class changes, instead of
+    building it up one character at a time.
+    """
+    classes = CHAR_CLASSES
+    data = line.encode()
+    if len(data) != len(line):
+        # non-ASCII characters: map them to a byte of class OTHER, so that
+        # the positions in data are the positions in line again.
+        data = bytes(c if c < 128 else 0 for c in map(ord, line))
+    start = 0
+    previous = OTHER
+    i = 0
+    for c in data:
+        cls = classes[c]
+        if cls != previous or cls == OTHER:
+            if i > start:
+                yield line[start:i]
+            start = i
+            previous = cls
+        i += 1
+    if i > start:
+        yield line[start:i]
+
+
+def split_tokens(line):
+    """
+    split line into a list of tokens, see iter_tokens.
+    """
+    return list(iter_tokens(line))
 
 
 def validate_expression(param):
-    for token in split_tokens(param):
+    for token in iter_tokens(param):
         state = 0
         for c in token:
             if c not in ' \t+-*/%()<>&|~xX0123456789abcdefABCDEF':
@@ -77,6 +127,131 @@ def validate_expression(param):
     return True
 
 
+def compile_expression(expr):
+    """
+    compile an expression into a tuple of (kind, value) items in reverse polish
+    notation, or directly into an int, if the expression contains no symbols.
+    symbols are only resolved when evaluating the expression.
+    """
+    tokens = []
+    previous = None
+    for token in iter_tokens(expr):
+        if token == previous and token in ('<', '>'):
+            tokens[-1] += token  # << and >> (without whitespace in between)
+            previous = None
+            continue
+        previous = token
+        if token[0] not in ' \t':
+            tokens.append(token)
+
+    rpn = []
+    ops = []  # stack of pending operators and '('
+    expect_operand = True
+    for token in tokens:
+        if expect_operand:
+            if token in UNARY_OPS:
+                ops.append((UNARY, token))
+            elif token == '(':
+                ops.append(token)
+            elif token[0] in '0123456789':
+                try:
+                    rpn.append((CONST, parse_int(token)))
+                except ValueError:
+                    raise ValueError('Unsupported expression: %s' % expr)
+                expect_operand = False
+            elif token[0] in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_':
+                rpn.append((SYMBOL, token))
+                expect_operand = False
+            else:
+                raise ValueError('Unsupported expression: %s' % expr)
+        elif token == ')':
+            while ops and ops[-1] != '(':
+                rpn.append(ops.pop())
+            if not ops:
+                raise ValueError('Unsupported expression: %s' % expr)
+            ops.pop()
+        elif token in BINARY_OPS:
+            precedence = BINARY_OPS[token]
+            # unary operators bind strongest, binary operators are left-associative
+            while ops and ops[-1] != '(' and (ops[-1][0] == UNARY or BINARY_OPS[ops[-1][1]] >= precedence):
+                rpn.append(ops.pop())
+            ops.append((BINARY, token))
+            expect_operand = True
+        else:
+            raise ValueError('Unsupported expression: %s' % expr)
+    if expect_operand:
+        raise ValueError('Unsupported expression: %s' % expr)
+    while ops:
+        op = ops.pop()
+        if op == '(':
+            raise ValueError('Unsupported expression: %s' % expr)
+        rpn.append(op)
+
+    for kind, _ in rpn:
+        if kind == SYMBOL:
+            return tuple(rpn)
+    return eval_rpn(rpn, None, expr)  # constant expression: evaluate only once
+
+
+def eval_rpn(rpn, symbols, expr):
+    stack = []
+    for kind, value in rpn:
+        if kind == CONST:
+            stack.append(value)
+        elif kind == SYMBOL:
+            if symbols is None or not symbols.has_sym(value):
+                raise ValueError('Unsupported expression: %s' % expr)
+            stack.append(symbols.get_sym(value)[2])
+        elif kind == UNARY:
+            a = stack.pop()
+            if value == '-':
+                a = -a
+            elif value == '~':
+                a = ~a
+            stack.append(a)
+        else:
+            b = stack.pop()
+            a = stack.pop()
+            if value == '+':
+                a += b
+            elif value == '-':
+                a -= b
+            elif value == '*':
+                a *= b
+            elif value == '/' or value == '%':
+                # integer division truncating towards zero, like in C / binutils
+                q = abs(a) // abs(b)
+                if (a < 0) != (b < 0):
+                    q = -q
+                a = q if value == '/' else a - b * q
+            elif value == '<<':
+                a <<= b
+            elif value == '>>':
+                a >>= b
+            elif value == '&':
+                a &= b
+            elif value == '|':
+                a |= b
+            stack.append(a)
+    return stack[0]
+
+
+def eval_expression(expr, symbols):
+    """
+    evaluate an expression, resolving symbols via the symbol table symbols.
+    compiled expressions are cached, so repeated expressions are not parsed again.
+    """
+    compiled = _expr_cache.get(expr)
+    if compiled is None:
+        compiled = compile_expression(expr)
+        if len(_expr_cache) >= EXPR_CACHE_SIZE:
+            _expr_cache.clear()
+        _expr_cache[expr] = compiled
+    if isinstance(compiled, int):
+        return compiled
+    return eval_rpn(compiled, symbols, expr)
+
+
 def parse_int(literal):
     """
     GNU as compatible parsing of string literals into integers
@@ -89,6 +264,31 @@ def parse_int(literal):
     return int(literal, 0)
 
 
+def read_lines(f, chunk_size=READ_CHUNK_SIZE):
+    """
+    generator: yield the lines of the open file f, like iterating over f does
+    (each line ending with a newline, except maybe the last one).
+
+    f is read in chunks, which is much faster on MicroPython, where iterating
+    over a file reads it byte by byte to find the line ends.
+    """
+    rest = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        buf = rest + chunk
+        start = 0
+        end = buf.find('\n')
+        while end >= 0:
+            yield buf[start:end + 1]
+            start = end + 1
+            end = buf.find('\n', start)
+        rest = buf[start:]
+    if rest:
+        yield rest
+
+
 def file_exists(filename):
     try:
         os.stat(filename)
@@ -96,3 +296,44 @@ def file_exists(filename):
     except OSError:
         pass
     return False
+
+
+def dirname(path):
+    # poor man's os.path.dirname
+    r = path.rsplit('/', 1)
+    if len(r) == 1:
+        return '.'
+    return r[0] or '/'
+
+
+def parse_include_name(text):
+    """
+    return the name of the file in the argument of an #include directive,
+    i.e. "file" or <file> (with the quotes or brackets), or None if invalid.
+    """
+    text = text.strip()
+    if not text or text[0] not in '"<':
+        return None
+    end = text.find('"' if text[0] == '"' else '>', 1)
+    if end < 2:
+        return None
+    return text[:end + 1]
+
+
+def find_include(name, directory, include_paths):
+    """
+    return the path of the file included as name ("file" or <file>), or
+    None if not found. "file" is searched in directory first, then in the
+    include paths, <file> only in the include paths.
+    """
+    path = name[1:-1]
+    if path.startswith('/'):
+        return path if file_exists(path) else None
+    directories = include_paths
+    if name[0] == '"':
+        directories = [directory] + list(include_paths)
+    for directory in directories:
+        candidate = directory + '/' + path
+        if file_exists(candidate):
+            return candidate
+    return None
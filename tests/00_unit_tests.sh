@@ -10,7 +10,7 @@
 
 set -e
 
-LIST=${1:-opcodes opcodes_s2 assemble link util preprocess definesdb decode decode_s2}
+LIST=${1:-opcodes opcodes_s2 assemble link util preprocess definesdb decode decode_s2 disassemble profiler buildcache}
 
 for file in $LIST; do
     echo Testing $file...
@@ -8,6 +8,7 @@
 from esp32_ulp.assemble import Assembler, TEXT, DATA, BSS, REL, ABS
 from esp32_ulp.assemble import SymbolTable
 from esp32_ulp.nocomment import remove_comments
+from esp32_ulp.link import make_binary, HEADER_SIZE
 
 src = """\
         .set const, 123
@@ -104,11 +105,60 @@ def test_assemble():
     assert a.symbols.get_sym('const_left') == (ABS, None, 976)
     assert a.symbols.get_sym('start') == (REL, TEXT, 0)
     assert a.symbols.get_sym('end') == (REL, TEXT, 4)
-    assert len(b''.join(a.sections[TEXT])) == 16  # 4 instructions * 4B
+    assert len(a.sections[TEXT]) == 16  # 4 instructions * 4B
     assert len(a.sections[DATA]) == 0
     assert a.offsets[BSS] == 0
 
 
+def test_fetch_returns_views_of_section_buffers():
+    a = Assembler()
+    a.assemble(src_global)
+    text, data, bss_len = a.fetch()
+    assert isinstance(text, memoryview)
+    assert isinstance(data, memoryview)
+    assert bytes(text) == bytes(a.sections[TEXT])
+    assert len(text) == 16  # 2 words + 2 instructions * 4B
+    assert bytes(text[:8]) == bytes(8)  # 2 words, all 0
+    assert len(data) == 0
+    assert bss_len == 0
+
+    # a view, not a copy
+    a.sections[TEXT][0] = 0xff
+    assert text[0] == 0xff
+
+
+def test_fetch_image_is_the_buffer_assembled_into():
+    a = Assembler()
+    a.assemble(src_global)
+    image = a.fetch_image()
+    text, data, bss_len = a.fetch()
+    assert image == make_binary(text, data, bss_len)
+    assert a.fetch_image() is image  # returned as-is, not copied
+
+    # the sections were emitted straight into the image
+    image[HEADER_SIZE] = 0xff
+    assert text[0] == 0xff
+
+
+def test_section_size_mismatch_between_passes():
+    a = Assembler()
+    a.init(2, {TEXT: 4, DATA: 4, BSS: 0})  # the sizes pass 1 found
+    a.append_instruction(0x12345678)
+    a.section = DATA
+    a.append_section(b'\1\2\3\4')
+    for section, func, arg, message in (
+            (DATA, a.append_section, b'\5', 'Section size mismatch: .data has 4 bytes after pass 1, but pass 2 writes up to byte 5'),
+            (TEXT, a.append_instruction, 0, 'Section size mismatch: .text has 4 bytes after pass 1, but pass 2 writes up to byte 8'),
+    ):
+        a.section = section
+        try:
+            func(arg)
+        except ValueError as e:
+            assert str(e) == message, str(e)
+        else:
+            assert False, 'ValueError not raised for .%s' % section
+
+
 def test_assemble_bss():
     a = Assembler()
     try:
@@ -208,6 +258,22 @@ def test_assemble_optional_comment_removal():
     assert raised
 
 
+def test_assemble_lines_from_iterable():
+    a = Assembler()
+    a.assemble(src)
+    expected = bytes(a.fetch_image())
+
+    # e.g. lines read from a file, comments are removed line by line
+    a = Assembler()
+    a.assemble(iter(line + '\n' for line in src.splitlines()))
+    assert bytes(a.fetch_image()) == expected
+
+    # e.g. lines from the preprocessor, comments are removed already
+    a = Assembler()
+    a.assemble(iter(remove_comments(src)), remove_comments=False)
+    assert bytes(a.fetch_image()) == expected
+
+
 def test_assemble_test_regressions_from_evaluation():
     line = " reg_wr (0x3ff48400 + 0x10), 1, 1, 1"
 
@@ -277,6 +343,17 @@ def test_symbols():
     assert st.resolve_absolute('const') == 123
 
 
+def test_symbols_generation():
+    st = SymbolTable({}, {}, {})
+    generation = st.generation
+    st.set_sym('label', REL, TEXT, 4)
+    assert st.generation == generation + 1
+    st.set_sym('label', REL, TEXT, 4)  # same value again (e.g. in pass 2) is no change
+    assert st.generation == generation + 1
+    st.set_bases({TEXT: 0})
+    assert st.generation == generation + 2
+
+
 def test_support_multiple_statements_per_line():
     src = """
 label: nop; nop;
@@ -292,16 +369,134 @@ label: nop; nop;
     ]
 
 
+def test_parse_statements_keeps_line_numbers():
+    src = """
+label: nop; nop;
+
+    wait 42
+"""
+
+    statements = Assembler().parse_statements(src.splitlines())
+
+    assert statements == [
+        ('label', 'nop', (), 2),
+        (None, 'nop', (), 2),
+        (None, 'wait', ('42',), 4)
+    ]
+
+
+def assemble_to_binary(source, cpu='esp32', single_pass=False):
+    a = Assembler(cpu)
+    a.assemble(source, single_pass=single_pass)
+    return a.fetch_image(), a.symbols.export(True)
+
+
+def test_single_pass_matches_two_pass():
+    src_fwd = """\
+    .set const, 3
+    .data
+counter: .long 0
+    .text
+entry:
+    move r3, counter
+    move r0, later_const
+    jump later
+    jumpr entry, 42, eq
+    jumpr later, 42, eq
+    jumps later, const, gt
+    ld r0, r3, 0
+    add r0, r0, 1
+    st r0, r3, 0
+    move r1, later << 2
+later:
+    halt
+    .set later_const, 0x42
+    .bss
+    .long 0
+"""
+    for cpu in ('esp32', 'esp32s2'):
+        assert assemble_to_binary(src_fwd, cpu) == assemble_to_binary(src_fwd, cpu, single_pass=True)
+
+
+def test_single_pass_raises_for_undefined_symbol():
+    a = Assembler()
+    try:
+        a.assemble("jump undefined_label", single_pass=True)
+    except ValueError:
+        raised = True
+    else:
+        raised = False
+    assert raised
+
+
+def test_single_pass_reports_line_of_invalid_instruction():
+    for src, message in (
+            ("nop\n  jumpr 3, 1, ge", "Line 2: Relative offset must be a multiple of 4"),  # not deferred
+            ("nop\n  jump later, foo\nlater: halt", "Line 2: Unsupported expression: foo"),  # deferred
+    ):
+        try:
+            Assembler().assemble(src, single_pass=True)
+        except ValueError as e:
+            assert str(e) == message, str(e)
+        else:
+            assert False, "ValueError not raised for %s" % src
+
+
+def assemble_error(source, cpu='esp32'):
+    # return the message of the ValueError assembling source raises, or None
+    try:
+        Assembler(cpu).assemble(source)
+    except ValueError as e:
+        return str(e)
+
+
+def test_dispatch_table():
+    a, b = Assembler(), Assembler()
+    assert a.dispatch is b.dispatch  # built once per cpu
+    assert a.dispatch is not Assembler('esp32s2').dispatch
+    assert '.text' in a.dispatch and 'jumpr' in a.dispatch
+    assert 'sti32' not in a.dispatch and 'sti32' in Assembler('esp32s2').dispatch
+
+
+def test_assemble_unknown_opcode_or_directive():
+    assert assemble_error("  nop\n  foo r0") == "Line 2: Unknown opcode or directive: foo"
+    assert assemble_error("\n\n  .foo 1") == "Line 3: Unknown opcode or directive: .foo"
+    assert assemble_error("  sti32 r0, r1, 0") == "Line 1: Unknown opcode or directive: sti32"
+    assert assemble_error("  .DATA\n  .LONG 42") is None  # like opcodes, directives are case-insensitive
+
+
+def test_assemble_wrong_number_of_arguments():
+    assert assemble_error("  nop\n  move r0") == "Line 2: move expects 2 arguments, got 1"
+    assert assemble_error("  halt 1") == "Line 1: halt expects 0 arguments, got 1"
+    assert assemble_error("  jump") == "Line 1: jump expects 1 to 2 arguments, got 0"
+    assert assemble_error("  JUMPR 1, 2") == "Line 1: JUMPR expects 3 arguments, got 2"
+    assert assemble_error("  stl r0, r1, 0, 1, 2", 'esp32s2') == "Line 1: stl expects 3 to 4 arguments, got 5"
+    assert assemble_error("  .set a") == "Line 1: .set expects 2 arguments, got 1"
+    assert assemble_error("  .data\n  .long 1, 2, 3, 4") is None
+
+
 test_parse_line()
 test_parse_labels_correctly()
 test_parse()
 test_assemble()
+test_fetch_returns_views_of_section_buffers()
+test_fetch_image_is_the_buffer_assembled_into()
+test_section_size_mismatch_between_passes()
 test_assemble_bss()
 test_assemble_bss_with_value()
 test_assemble_global()
 test_assemble_uppercase_opcode()
 test_assemble_evaluate_expressions()
 test_assemble_optional_comment_removal()
+test_assemble_lines_from_iterable()
 test_assemble_test_regressions_from_evaluation()
 test_support_multiple_statements_per_line()
+test_parse_statements_keeps_line_numbers()
+test_single_pass_matches_two_pass()
+test_single_pass_raises_for_undefined_symbol()
+test_single_pass_reports_line_of_invalid_instruction()
+test_dispatch_table()
+test_assemble_unknown_opcode_or_directive()
+test_assemble_wrong_number_of_arguments()
 test_symbols()
+test_symbols_generation()
@@ -0,0 +1,227 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark: assembler throughput and memory use, stage by stage
+
+Generates synthetic sources of the given sizes (number of instructions),
+mixing ALU instructions, jumps, reg_rd/reg_wr via the RTC macros and .data
+directives, plus all kinds of comments and defines. Each source is assembled
+and every stage is timed separately:
+
+    remove_comments, preprocess, parse, pass1, pass2, link
+
+(preprocess includes removing the comments once more, like it does when
+assembling normally. pass2 assembles right into the binary image, so link
+just fetches that image.)
+
+Memory: the lowest gc.mem_free() seen is reported, sampled at the end of
+each stage and wherever the assembler calls util.garbage_collect.
+
+The results are printed as a table and, if --json is given, also written as
+JSON lines (one JSON object per source size) to be tracked over time.
+
+Run with: micropython bench_assemble.py [--json results.json] [--repeat N] [size ...]
+"""
+
+import gc
+import sys
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+import esp32_ulp
+import esp32_ulp.assemble
+from esp32_ulp.assemble import Assembler
+from esp32_ulp.nocomment import remove_comments
+from esp32_ulp.preprocess import preprocess
+from bench_util import ticks_us, ticks_diff, mem_free
+
+
+STAGES = ('remove_comments', 'preprocess', 'parse', 'pass1', 'pass2', 'link')
+SIZES = (100, 1000, 10000)
+
+HEADER = """\
+#define RTC_CNTL_STATE0_REG 0x3ff48018
+#define RTC_CNTL_ULP_CP_SLP_TIMER_EN_S 24
+#define RTC_IO_TOUCH_PAD2_REG (0x3ff48400 + 0x9c)
+#define RTC_IO_TOUCH_PAD2_HOLD_S 31
+#define LIMIT 100  /* upper limit */
+
+    .data
+"""
+
+# one block is BLOCK_INSTRUCTIONS instructions (the RTC macros and jumps
+# expand to a single instruction each).
+BLOCK_INSTRUCTIONS = 14
+BLOCK = """\
+/* block %(n)d */
+value_%(n)d: .long %(n)d, 0   // a counter and a result
+    .text
+    .global entry_%(n)d
+entry_%(n)d:
+    move r3, value_%(n)d       # address of the counter
+    ld r0, r3, 0
+    add r0, r0, 1
+    and r1, r0, 0xff
+    or r1, r1, (1 << 8)
+    lsh r2, r1, 2
+    sub r2, r2, r0
+    jumpr skip_%(n)d, LIMIT, ge
+    READ_RTC_REG(RTC_IO_TOUCH_PAD2_REG, RTC_IO_TOUCH_PAD2_HOLD_S, 1)
+    WRITE_RTC_FIELD(RTC_CNTL_STATE0_REG, RTC_CNTL_ULP_CP_SLP_TIMER_EN_S, 0)
+skip_%(n)d:
+    st r0, r3, 0
+    st r2, r3, 4
+    jump next_%(n)d, eq
+next_%(n)d:
+    nop
+    .data
+"""
+
+
+def make_source(instructions):
+    blocks = [HEADER]
+    for n in range((instructions + BLOCK_INSTRUCTIONS - 1) // BLOCK_INSTRUCTIONS):
+        blocks.append(BLOCK % dict(n=n))
+    return ''.join(blocks)
+
+
+class MemSampler:
+    """
+    keep the lowest gc.mem_free() seen, also hooks into util.garbage_collect
+    to get samples from within the assembler.
+    """
+    def __init__(self):
+        self.low = None
+        self.garbage_collect = esp32_ulp.garbage_collect
+
+    def sample(self):
+        if mem_free is not None:
+            free = mem_free()
+            if self.low is None or free < self.low:
+                self.low = free
+
+    def __enter__(self):
+        gc.collect()
+        esp32_ulp.garbage_collect = esp32_ulp.assemble.garbage_collect = self.hook
+        return self
+
+    def __exit__(self, type, value, traceback):
+        esp32_ulp.garbage_collect = esp32_ulp.assemble.garbage_collect = self.garbage_collect
+
+    def hook(self, msg, verbose=False):
+        self.sample()
+        self.garbage_collect(msg, verbose)
+
+
+def run_once(src, cpu, mem):
+    """
+    assemble src, stage by stage like esp32_ulp.src_to_binary does.
+    returns the binary and a dict of the time spent per stage in us.
+    """
+    times = {}
+
+    def timed(stage, start):
+        times[stage] = ticks_diff(ticks_us(), start)
+        mem.sample()
+
+    t = ticks_us()
+    remove_comments(src)
+    timed('remove_comments', t)
+
+    t = ticks_us()
+    lines = preprocess(src)
+    timed('preprocess', t)
+
+    a = Assembler(cpu)
+    t = ticks_us()
+    statements = a.parse_statements(lines.splitlines())
+    timed('parse', t)
+
+    t = ticks_us()
+    a.init(1)
+    a.assembler_pass(statements)
+    a.symbols.set_bases(a.compute_bases())
+    timed('pass1', t)
+
+    t = ticks_us()
+    a.init(2, dict(a.offsets))
+    a.assembler_pass(statements)
+    timed('pass2', t)
+
+    t = ticks_us()
+    binary = a.fetch_image()
+    timed('link', t)
+    return binary, times
+
+
+def bench(instructions, cpu, repeat):
+    src = make_source(instructions)
+    best = {}
+    with MemSampler() as mem:
+        for _ in range(repeat):
+            binary, times = run_once(src, cpu, mem)
+            for stage in STAGES:
+                if stage not in best or times[stage] < best[stage]:
+                    best[stage] = times[stage]
+            del binary
+            gc.collect()
+    binary, _ = run_once(src, cpu, MemSampler())
+    assert binary == esp32_ulp.src_to_binary_ext(src, cpu)[0]
+    return dict(
+        implementation=sys.implementation.name,
+        cpu=cpu,
+        instructions=instructions,
+        source_bytes=len(src),
+        binary_bytes=len(binary),
+        repeat=repeat,
+        stages_us=best,
+        total_us=sum(best.values()),
+        mem_free_low=mem.low,
+    )
+
+
+def print_result(r):
+    print('%(instructions)d instructions (%(source_bytes)d bytes source, %(binary_bytes)d bytes binary):' % r)
+    for stage in STAGES:
+        print('  %-16s %10d us' % (stage, r['stages_us'][stage]))
+    print('  %-16s %10d us (%.1f us/instruction)' % ('total', r['total_us'], r['total_us'] / r['instructions']))
+    if r['mem_free_low'] is not None:
+        print('  lowest mem_free: %d bytes' % r['mem_free_low'])
+
+
+def main(args):
+    json_file = None
+    repeat = 3
+    cpu = 'esp32'
+    sizes = []
+    while args:
+        arg = args.pop(0)
+        if arg == '--json':
+            json_file = args.pop(0)
+        elif arg == '--repeat':
+            repeat = int(args.pop(0))
+        elif arg in ('-c', '--mcpu'):
+            cpu = args.pop(0)
+        else:
+            sizes.append(int(arg))
+
+    results = [bench(size, cpu, repeat) for size in sizes or SIZES]
+    for r in results:
+        print_result(r)
+
+    if json_file:
+        with open(json_file, 'a') as f:
+            for r in results:
+                f.write(json.dumps(r) + '\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
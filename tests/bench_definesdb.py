@@ -0,0 +1,112 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark: DefinesDB backends, btree database vs. sorted db file
+
+Stores the defines of the given header files (or of generated headers like
+the ESP-IDF soc/*_reg.h files, see bench_parse_to_db.py) in a btree database
+and in a sorted db file. Then measures for both backends how long it takes to
+open the database and to look up defines (with the DefinesDB lookup cache
+disabled), and how much memory each lookup allocates.
+
+The lookups are a mix like the preprocessor does them: defined register names
+(hits) and names which are not defined (misses, e.g. registers, mnemonics).
+
+Run with: micropython bench_definesdb.py [header.h ...]
+"""
+
+import gc
+import os
+import sys
+
+from esp32_ulp.definesdb import DefinesDB, BtreeBackend
+from esp32_ulp.preprocess import Preprocessor
+from esp32_ulp import sorteddb
+from bench_parse_to_db import write_headers
+from bench_util import ticks_us, ticks_diff, mem_alloc
+
+BTREE_FILE = 'bench_btree.db'
+SORTED_FILE = 'bench_sorted.db'
+MISSES = ('r0', 'r1', 'r2', 'r3', 'move', 'reg_rd', 'reg_wr', 'jumpr', 'entry', 'loop', 'ZZZ_NOT_DEFINED')
+
+
+def load_defines(files):
+    p = Preprocessor()
+    defines = {}
+    for f in files:
+        defines = p.process_include_file(f)
+    return defines
+
+
+def build(defines):
+    db = DefinesDB(cache_size=0, backend=BtreeBackend(), filename=BTREE_FILE)
+    db.clear()
+    db.update(defines)
+    db.close()
+    with open(SORTED_FILE, 'wb') as f:
+        sorteddb.write(f, defines)
+
+
+def bench_open(filename, rounds=20):
+    start = ticks_us()
+    for _ in range(rounds):
+        db = DefinesDB(cache_size=0, filename=filename)
+        db.open()
+        db.close()
+    return ticks_diff(ticks_us(), start) // rounds
+
+
+def bench_lookups(filename, keys):
+    db = DefinesDB(cache_size=0, filename=filename)
+    db.open()
+    get = db.get
+    gc.collect()
+    alloc = mem_alloc() if mem_alloc else 0
+    start = ticks_us()
+    for key in keys:
+        get(key, None)
+    duration = ticks_diff(ticks_us(), start)
+    alloc = mem_alloc() - alloc if mem_alloc else None
+    db.close()
+    return duration, alloc
+
+
+def main(files):
+    generated = not files
+    if generated:
+        files = write_headers()
+    try:
+        defines = load_defines(files)
+    finally:
+        if generated:
+            for filename in files:
+                os.remove(filename)
+    build(defines)
+    hits = sorted(defines)[::7]
+    del defines
+    keys = []
+    for i, key in enumerate(hits):
+        keys.append(key)
+        keys.append(MISSES[i % len(MISSES)])
+
+    try:
+        print('%d lookups (%d hits, %d misses)' % (len(keys), len(hits), len(keys) - len(hits)))
+        for name, filename in (('btree', BTREE_FILE), ('sorted', SORTED_FILE)):
+            t_open = bench_open(filename)
+            t_lookups, alloc = bench_lookups(filename, keys)
+            print('  %-7s %6d bytes file, open: %6d us, lookups: %8d us (%.1f us/lookup)' % (
+                name, os.stat(filename)[6], t_open, t_lookups, t_lookups / len(keys)))
+            if alloc is not None:
+                print('          %d bytes allocated (%d bytes/lookup)' % (alloc, alloc // len(keys)))
+    finally:
+        os.remove(BTREE_FILE)
+        os.remove(SORTED_FILE)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,77 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark: startup cost, time and heap needed to import the package
+
+Measures, step by step, how long it takes and how much heap is in use after
+importing esp32_ulp, creating an Assembler for each CPU and assembling a
+first small program, and which modules of the package are loaded by then.
+
+Imports are only done once per process, so run it in a fresh interpreter.
+
+Run with: micropython bench_import.py
+"""
+
+import gc
+import sys
+
+from bench_util import ticks_us, ticks_diff, traced_mem_alloc
+
+mem_alloc = traced_mem_alloc()
+
+SRC = """\
+    .global entry
+entry:
+    reg_wr 0x3f408400, 5, 3, 1
+    move r0, 42
+    halt
+"""
+
+
+def package_modules():
+    return sorted(name[10:] for name in sys.modules if name.startswith('esp32_ulp.'))
+
+
+def step(name, func):
+    gc.collect()
+    start = ticks_us()
+    func()
+    duration = ticks_diff(ticks_us(), start)
+    gc.collect()
+    print('  %-22s %8d us %8d bytes in use' % (name, duration, mem_alloc()))
+
+
+def import_package():
+    global esp32_ulp
+    import esp32_ulp
+
+
+def make_assembler(cpu):
+    def make():
+        from esp32_ulp.assemble import Assembler
+        Assembler(cpu)
+    return make
+
+
+def assemble():
+    esp32_ulp.src_to_binary_ext(SRC, 'esp32s2')
+
+
+def main():
+    gc.collect()
+    print('  %-22s %8s    %8d bytes in use' % ('start', '', mem_alloc()))
+    step('import esp32_ulp', import_package)
+    print('    loaded: %s' % ' '.join(package_modules()))
+    step("Assembler('esp32')", make_assembler('esp32'))
+    step("Assembler('esp32s2')", make_assembler('esp32s2'))
+    step('assemble (esp32s2)', assemble)
+    print('    loaded: %s' % ' '.join(package_modules()))
+
+
+if __name__ == '__main__':
+    main()
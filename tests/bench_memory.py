@@ -0,0 +1,123 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark: peak heap usage of assembling a source file in memory vs. streaming
+
+Generates a large synthetic source file and assembles it twice: once the
+usual way (read the whole file, preprocess, assemble) and once streaming it
+line by line (assemble_file(..., stream=True)).
+
+On MicroPython, the heap in use is sampled (after a gc) at each stage where
+the assembler collects garbage anyway, the peak of these samples is shown.
+On CPython, tracemalloc is used to get the real peak.
+
+Run with: micropython bench_memory.py [blocks]
+"""
+
+import gc
+import os
+import sys
+
+import esp32_ulp
+import esp32_ulp.assemble
+
+FILENAME = 'bench_memory.S'
+
+BLOCK = """\
+/*
+ * block %(n)d: count down a counter and store a value
+ */
+#define COUNT_%(n)d %(n)d  // iterations
+    .data
+value_%(n)d: .long 0
+    .text
+    .global entry_%(n)d
+entry_%(n)d:
+    move r3, value_%(n)d    # address of value
+    stage_rst
+loop_%(n)d:
+    stage_inc 1
+    jumps loop_%(n)d, COUNT_%(n)d, lt
+    st r0, r3, 0
+    jump done_%(n)d
+done_%(n)d:
+    nop
+"""
+
+
+def write_source(blocks):
+    with open(FILENAME, 'w') as f:
+        for n in range(blocks):
+            f.write(BLOCK % dict(n=n))
+
+
+class HeapSampler:
+    """
+    track the peak heap use, either using tracemalloc (CPython) or by
+    sampling gc.mem_alloc() whenever the assembler collects garbage.
+    """
+    def __init__(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+        self.tracemalloc = tracemalloc
+        self.garbage_collect = esp32_ulp.garbage_collect
+
+    def sample(self, msg, verbose=False):
+        self.garbage_collect(msg, verbose)
+        self.peak = max(self.peak, gc.mem_alloc() - self.base)
+
+    def run(self, func, *args):
+        gc.collect()
+        if self.tracemalloc:
+            self.tracemalloc.start()
+            try:
+                func(*args)
+                return self.tracemalloc.get_traced_memory()[1]
+            finally:
+                self.tracemalloc.stop()
+        self.base = gc.mem_alloc()
+        self.peak = 0
+        esp32_ulp.garbage_collect = esp32_ulp.assemble.garbage_collect = self.sample
+        try:
+            func(*args)
+            self.sample('done')
+        finally:
+            esp32_ulp.garbage_collect = esp32_ulp.assemble.garbage_collect = self.garbage_collect
+        return self.peak
+
+
+def in_memory():
+    with open(FILENAME) as f:
+        src = f.read()
+    return esp32_ulp.src_to_binary_ext(src, 'esp32')[0]
+
+
+def streaming():
+    return esp32_ulp.file_to_binary_ext(FILENAME, 'esp32')[0]
+
+
+def main(blocks):
+    write_source(blocks)
+    try:
+        assert in_memory() == streaming()
+        size = os.stat(FILENAME)[6]
+        sampler = HeapSampler()
+        peak_in_memory = sampler.run(in_memory)
+        peak_streaming = sampler.run(streaming)
+        binary = streaming()
+    finally:
+        os.remove(FILENAME)
+    print('source: %d bytes, binary: %d bytes' % (size, len(binary)))
+    print('  in memory: %8d bytes peak heap' % peak_in_memory)
+    print('  streaming: %8d bytes peak heap (%d%%)' % (peak_streaming, 100 * peak_streaming // peak_in_memory))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
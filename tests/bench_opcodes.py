@@ -0,0 +1,147 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark: integer instruction encoders vs. bitfield structs
+
+Assembles the all_opcodes fixtures and records the field values of every
+instruction encoded. Then encodes all of them again many times, once using
+the integer encoders of the Ins objects and once by writing the fields of
+uctypes structs (the way instructions were encoded before).
+
+Without uctypes (e.g. on CPython), the structs are emulated in Python: each
+field written reads, masks and writes back the instruction word in a
+bytearray, like uctypes bitfields do.
+
+Run with: micropython bench_opcodes.py [rounds]
+"""
+
+import sys
+
+try:
+    from uctypes import struct, addressof, LITTLE_ENDIAN, UINT32, BFUINT32, BF_POS, BF_LEN
+except ImportError:  # e.g. CPython
+    struct = None
+from esp32_ulp.assemble import Assembler
+from esp32_ulp.ins import Ins
+from esp32_ulp.preprocess import preprocess
+from bench_util import ticks_us, ticks_diff
+
+
+class BitfieldStruct:
+    """
+    python emulation of a uctypes struct of 32 bit little endian bitfields
+    """
+    def __init__(self, fields):
+        object.__setattr__(self, '_fields', fields)
+        object.__setattr__(self, '_data', bytearray(4))
+
+    def __setattr__(self, name, value):
+        pos, mask = self._fields[name]
+        data = self._data
+        word = data[0] | data[1] << 8 | data[2] << 16 | data[3] << 24
+        word = (word & ~(mask << pos)) | (value & mask) << pos
+        data[0] = word & 0xff
+        data[1] = (word >> 8) & 0xff
+        data[2] = (word >> 16) & 0xff
+        data[3] = (word >> 24) & 0xff
+
+    @property
+    def all(self):
+        data = self._data
+        return data[0] | data[1] << 8 | data[2] << 16 | data[3] << 24
+
+
+def record_encodes(cpu, filename):
+    """
+    assemble filename and return a list of (ins, fields) for every instruction encoded
+    """
+    a = Assembler(cpu)
+    layouts = [ins for ins in a.opcodes.__dict__.values() if isinstance(ins, Ins)]
+    records = []
+
+    def recorder(ins, encode):
+        def record(**fields):
+            records.append((ins, fields))
+            return encode(**fields)
+        return record
+
+    encoders = [ins.encode for ins in layouts]
+    for ins in layouts:
+        ins.encode = recorder(ins, ins.encode)
+    try:
+        with open(filename) as f:
+            a.assemble(preprocess(f.read()), remove_comments=False)
+    finally:
+        for ins, encode in zip(layouts, encoders):
+            ins.encode = encode
+    return records
+
+
+def make_struct(ins):
+    """
+    build the equivalent uctypes struct (or its emulation) for an Ins
+    """
+    if struct is None:
+        return BitfieldStruct(ins.fields)
+    struct_def = {}
+    for name, (pos, mask) in ins.fields.items():
+        width = len(bin(mask)) - 2
+        struct_def[name] = BFUINT32 | pos << BF_POS | width << BF_LEN
+    struct_def['all'] = UINT32
+    return struct(addressof(bytearray(4)), struct_def, LITTLE_ENDIAN)
+
+
+def bench_ins(records, rounds):
+    start = ticks_us()
+    for _ in range(rounds):
+        for ins, fields in records:
+            ins.encode(**fields)
+    return ticks_diff(ticks_us(), start)
+
+
+def bench_struct(records, rounds):
+    structs = {}
+    prepared = []
+    for ins, fields in records:
+        if ins not in structs:
+            structs[ins] = make_struct(ins)
+        # like the old encoders, also explicitly zero the unused fields
+        values = [(name, fields.get(name, 0)) for name in ins.fields]
+        prepared.append((structs[ins], values))
+    start = ticks_us()
+    for _ in range(rounds):
+        for s, values in prepared:
+            for name, value in values:
+                setattr(s, name, value)
+            s.all
+    return ticks_diff(ticks_us(), start)
+
+
+def check_equal(records):
+    for ins, fields in records:
+        s = make_struct(ins)
+        for name in ins.fields:
+            setattr(s, name, fields.get(name, 0))
+        assert ins.encode(**fields) == s.all, fields
+
+
+def main(rounds):
+    kind = 'emulated structs' if struct is None else 'uctypes structs'
+    for cpu in ('esp32', 'esp32s2'):
+        records = record_encodes(cpu, 'fixtures/all_opcodes.%s.S' % cpu)
+        check_equal(records)
+        t_ins = bench_ins(records, rounds)
+        t_struct = bench_struct(records, rounds)
+        count = len(records) * rounds
+        print('%s: %d instructions encoded' % (cpu, count))
+        print('  Ins encoders:     %8d us (%.2f us/instruction)' % (t_ins, t_ins / count))
+        print('  %-17s %8d us (%.2f us/instruction)' % (kind + ':', t_struct, t_struct / count))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,108 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark: loading defines from header files into the defines database
+
+Loads the given header files (e.g. the ESP-IDF register headers) into a
+DefinesDB twice: once one define at a time in file order (the way
+parse_to_db did it before) and once using parse_to_db.parse, which stores
+the defines in sorted batches and uses a bigger btree cache.
+
+Without header files given, headers like the ESP-IDF soc/*_reg.h files are
+generated (same structure, ~8000 defines in total).
+
+Run with: micropython bench_parse_to_db.py [header.h ...]
+e.g. micropython bench_parse_to_db.py esp-idf/components/soc/esp32/include/soc/*_reg.h
+"""
+
+import os
+import sys
+
+from esp32_ulp import parse_to_db
+from esp32_ulp.definesdb import DefinesDB, DBNAME
+from esp32_ulp.preprocess import Preprocessor
+from bench_util import ticks_ms, ticks_diff
+
+PERIPHERALS = ('RTC_CNTL', 'RTC_IO', 'SENS', 'APB_CTRL')
+FIELD_WORDS = ('EN', 'CLR', 'RST', 'FORCE_PU', 'FORCE_PD', 'SEL', 'DRV', 'HOLD', 'WAKEUP', 'INT_ST')
+
+REGISTER = """\
+#define %(reg)s_REG          (DR_REG_%(periph)s_BASE + 0x%(offset)x)
+"""
+
+FIELD = """\
+/* %(field)s : R/W ;bitpos:[%(bit)d] ;default: 1'd0 ; */
+/*description: %(field)s of register %(reg)s*/
+#define %(field)s  (BIT(%(bit)d))
+#define %(field)s_M  (BIT(%(bit)d))
+#define %(field)s_V  0x1
+#define %(field)s_S  %(bit)d
+"""
+
+
+def write_headers(registers_per_header=60, fields_per_register=8):
+    filenames = []
+    for periph in PERIPHERALS:
+        filename = 'bench_%s_reg.h' % periph.lower()
+        with open(filename, 'w') as f:
+            f.write('#ifndef _SOC_%s_REG_H_\n#define _SOC_%s_REG_H_\n\n#include "soc.h"\n' % (periph, periph))
+            for r in range(registers_per_header):
+                reg = '%s_%s%d' % (periph, FIELD_WORDS[r % len(FIELD_WORDS)], r)
+                f.write(REGISTER % dict(reg=reg, periph=periph, offset=4 * r))
+                for b in range(fields_per_register):
+                    field = '%s_%s_%s' % (reg, FIELD_WORDS[(r + b) % len(FIELD_WORDS)], b)
+                    f.write(FIELD % dict(field=field, reg=reg, bit=31 - b))
+            f.write('\n#endif /*_SOC_%s_REG_H_ */\n' % periph)
+        filenames.append(filename)
+    return filenames
+
+
+def one_by_one(files):
+    # like parse_to_db did before: every define is stored on its own, in
+    # file order, while iterating the lines of the file.
+    db = DefinesDB()
+    p = Preprocessor()
+    for filename in files:
+        with open(filename, 'r') as f:
+            for line in f:
+                for k, v in p.parse_define_line(line).items():
+                    db[k] = v
+        db.close()
+
+
+def timed(func, files):
+    DefinesDB().clear()
+    start = ticks_ms()
+    func(files)
+    duration = ticks_diff(ticks_ms(), start)
+    db = DefinesDB()
+    count = len(db.keys())
+    db.close()
+    return duration, count, os.stat(DBNAME)[6]
+
+
+def main(files):
+    generated = not files
+    if generated:
+        files = write_headers()
+    try:
+        results = [
+            ('one by one', timed(one_by_one, files)),
+            ('parse_to_db', timed(parse_to_db.parse, files)),
+        ]
+    finally:
+        if generated:
+            for filename in files:
+                os.remove(filename)
+        DefinesDB().clear()
+    for name, (duration, count, size) in results:
+        print('%-12s %8d ms, %d defines, %d bytes db file' % (name, duration, count, size))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
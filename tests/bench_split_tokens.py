@@ -0,0 +1,99 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark: splitting lines into tokens
+
+Splits typical ULP source lines (as they look after preprocessing, and
+expressions as evaluated by the assembler) into tokens many times, using
+util.split_tokens, util.iter_tokens and the previous implementation, which
+built every token up one character at a time.
+
+Run with: micropython bench_split_tokens.py [rounds]
+"""
+
+import sys
+
+from esp32_ulp.util import split_tokens, iter_tokens
+from bench_util import ticks_us, ticks_diff
+
+LINES = (
+    "entry:",
+    "  move r3, counter",
+    "  ld r0, r3, 0",
+    "  add r0, r0, 1",
+    "  st r0, r3, 0",
+    "  jumpr loop, 100, LT",
+    "  reg_wr RTC_GPIO_OUT_W1TS_REG, RTC_GPIO_OUT_DATA_W1TS_S + 12, RTC_GPIO_OUT_DATA_W1TS_S + 12, 1",
+    "  READ_RTC_FIELD(RTC_GPIO_IN_REG, RTC_GPIO_IN_NEXT)",
+    "  .set magic, (0x3ff48000 + 0x24) >> 2",
+    "  wait 8000",
+    "(DR_REG_RTCCNTL_BASE + 0x0)",
+    "((1 << 10) - 1) & 0x3ff",
+)
+
+
+def split_tokens_per_char(line):
+    # the previous implementation, for comparison
+    NORMAL, WHITESPACE = 0, 1
+    buf = ""
+    tokens = []
+    state = NORMAL
+    for c in line:
+        if c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_":
+            if state != NORMAL:
+                if len(buf) > 0:
+                    tokens.append(buf)
+                    buf = ""
+                state = NORMAL
+            buf += c
+        elif c in " \t":
+            if state != WHITESPACE:
+                if len(buf) > 0:
+                    tokens.append(buf)
+                    buf = ""
+                state = WHITESPACE
+            buf += c
+        else:
+            if len(buf) > 0:
+                tokens.append(buf)
+                buf = ""
+            tokens.append(c)
+
+    if len(buf) > 0:
+        tokens.append(buf)
+
+    return tokens
+
+
+def iterate_tokens(line):
+    for _ in iter_tokens(line):
+        pass
+
+
+def timed(func, rounds):
+    start = ticks_us()
+    for _ in range(rounds):
+        for line in LINES:
+            func(line)
+    return ticks_diff(ticks_us(), start)
+
+
+def main(rounds):
+    for line in LINES:
+        assert split_tokens(line) == split_tokens_per_char(line), line
+    calls = rounds * len(LINES)
+    print('%d lines, %d calls each' % (len(LINES), calls))
+    for name, func in (('per character', split_tokens_per_char),
+                       ('split_tokens', split_tokens),
+                       ('iter_tokens', iterate_tokens)):
+        duration = timed(func, rounds)
+        print('  %-14s %8d us (%.2f us/line)' % (name, duration, duration / calls))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
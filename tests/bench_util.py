@@ -0,0 +1,41 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Timers and heap statistics shared by the benchmarks
+
+Uses the micropython functions, falling back to CPython equivalents where
+they do not exist.
+"""
+
+import gc
+import time
+
+try:
+    ticks_us, ticks_ms, ticks_diff = time.ticks_us, time.ticks_ms, time.ticks_diff
+except AttributeError:  # e.g. CPython
+    ticks_us = lambda: int(time.perf_counter() * 1000000)
+    ticks_ms = lambda: int(time.perf_counter() * 1000)
+    ticks_diff = lambda end, start: end - start
+
+try:
+    mem_free, mem_alloc = gc.mem_free, gc.mem_alloc
+except AttributeError:  # e.g. CPython, where memory is freed right away
+    mem_free = mem_alloc = None
+
+
+def traced_mem_alloc():
+    """
+    return a function returning the number of heap bytes in use: gc.mem_alloc
+    or, if there is none (e.g. CPython), one using tracemalloc (which gets
+    started, so only memory allocated from now on is counted).
+    """
+    if mem_alloc is not None:
+        return mem_alloc
+    import tracemalloc
+    tracemalloc.start()
+    return lambda: tracemalloc.get_traced_memory()[0]
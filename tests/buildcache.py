@@ -0,0 +1,212 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+import os
+import sys
+
+import esp32_ulp
+from esp32_ulp import buildcache
+
+CACHE_DIR = 'buildcache_test'
+
+SRC = """\
+#include "buildcache_test.h"
+.global entry
+entry:
+    move r0, VALUE
+    halt
+"""
+
+
+def remove_cache_dir():
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        os.remove(CACHE_DIR + '/' + name)
+    os.rmdir(CACHE_DIR)
+
+
+def write_header(value):
+    with open('buildcache_test.h', 'w') as f:
+        f.write('#define VALUE %d\n' % value)
+
+
+def test_lazy_imports():
+    # neither the cache nor the package load the assembler
+    for name in ('assemble', 'ins', 'opcodes', 'opcodes_s2'):
+        assert 'esp32_ulp.' + name not in sys.modules, name
+
+
+def test_package_exports():
+    from esp32_ulp import preprocess, Assembler, make_binary
+    assert 'move r0, 1' in preprocess("#define X 1\nmove r0, X\n")  # the function, not the module
+    assert preprocess is esp32_ulp.preprocess
+    assert esp32_ulp.preprocess_file.__name__ == 'preprocess_file'
+    assert Assembler is esp32_ulp.Assembler and make_binary is esp32_ulp.make_binary
+    esp32_ulp.src_to_binary_ext('halt', 'esp32')  # using the preprocess module keeps it that way
+    assert esp32_ulp.preprocess is preprocess
+
+
+def test_preprocess_export_after_module_import():
+    # importing from the preprocess module first must not replace the
+    # function the package exports by the module
+    from esp32_ulp.preprocess import Preprocessor
+    from esp32_ulp import preprocess
+    assert preprocess is not sys.modules['esp32_ulp.preprocess']
+    assert preprocess.__name__ == 'preprocess' and 'move r0, 1' in preprocess("#define X 1\nmove r0, X\n")
+
+
+def test_assemble_file_includes_relative_to_the_file():
+    # #include "file" is searched in the directory of the source file, not
+    # in the current directory, whether the file is streamed or not
+    os.mkdir('buildcache_test_dir')
+    try:
+        with open('buildcache_test_dir/regs.h', 'w') as f:
+            f.write('#define VAL 3\n')
+        with open('buildcache_test_dir/prog.S', 'w') as f:
+            f.write('#include "regs.h"\n    move r0, VAL\n')
+        binaries = []
+        for stream in (False, True):
+            esp32_ulp.assemble_file('buildcache_test_dir/prog.S', 'esp32', stream=stream)
+            with open('buildcache_test_dir/prog.ulp', 'rb') as f:
+                binaries.append(f.read())
+        assert binaries[0] == binaries[1] == esp32_ulp.src_to_binary('move r0, 3', 'esp32')
+    finally:
+        for name in ('regs.h', 'prog.S', 'prog.ulp'):
+            os.remove('buildcache_test_dir/' + name)
+        os.rmdir('buildcache_test_dir')
+
+
+def test_key():
+    write_header(1)
+    try:
+        key = buildcache.key((SRC, ), 'esp32')
+        assert len(key) == 64
+        assert buildcache.key((SRC, ), 'esp32') == key
+        assert buildcache.key(SRC.splitlines(True), 'esp32') == key, "independent of chunking"
+        assert buildcache.key((SRC, ), 'esp32s2') != key
+        assert buildcache.key((SRC + 'nop\n', ), 'esp32') != key
+        write_header(22)  # included files are part of the key
+        assert buildcache.key((SRC, ), 'esp32') != key
+        # <file> is searched in the include paths, like by the preprocessor
+        src = SRC.replace('"buildcache_test.h"', '<buildcache_test.h>')
+        key = buildcache.key((src, ), 'esp32', include_paths=['.'])
+        write_header(1)
+        assert buildcache.key((src, ), 'esp32', include_paths=['.']) != key
+    finally:
+        os.remove('buildcache_test.h')
+
+
+def test_store_and_load():
+    remove_cache_dir()
+    try:
+        assert buildcache.load(CACHE_DIR, 'abc') is None
+        buildcache.store(CACHE_DIR, 'abc', b'\x01\x02', [(0, 'entry'), (4, 'data')])
+        assert buildcache.load(CACHE_DIR, 'abc') == (b'\x01\x02', [(0, 'entry'), (4, 'data')])
+        assert isinstance(buildcache.load(CACHE_DIR, 'abc')[0], bytearray)
+
+        for i in range(buildcache.MAX_ENTRIES + 2):
+            buildcache.store(CACHE_DIR, 'key%d' % i, b'', [])
+        assert len(os.listdir(CACHE_DIR)) == 2 * buildcache.MAX_ENTRIES  # .ulp and .sym files
+    finally:
+        remove_cache_dir()
+
+
+def test_src_to_binary_uses_cache():
+    remove_cache_dir()
+    write_header(3)
+    assemble = esp32_ulp.lines_to_binary_ext
+    try:
+        binary = esp32_ulp.src_to_binary(SRC, 'esp32', cache_dir=CACHE_DIR)
+        assert isinstance(binary, bytearray)
+        # a cache hit does not need the assembler
+        esp32_ulp.lines_to_binary_ext = None
+        cached = esp32_ulp.src_to_binary(SRC, 'esp32', cache_dir=CACHE_DIR)
+        assert cached == binary
+        assert isinstance(cached, bytearray), "same type as on a cache miss"
+        esp32_ulp.lines_to_binary_ext = assemble
+        # changing an included file makes it a cache miss
+        write_header(40)
+        assert esp32_ulp.src_to_binary(SRC, 'esp32', cache_dir=CACHE_DIR) != binary
+    finally:
+        esp32_ulp.lines_to_binary_ext = assemble
+        os.remove('buildcache_test.h')
+        remove_cache_dir()
+
+
+def test_assemble_file_uses_cache():
+    remove_cache_dir()
+    write_header(5)
+    with open('buildcache_test.S', 'w') as f:
+        f.write(SRC)
+    assemble = esp32_ulp.lines_to_binary_ext
+    try:
+        esp32_ulp.assemble_file('buildcache_test.S', 'esp32', cache_dir=CACHE_DIR)
+        with open('buildcache_test.ulp', 'rb') as f:
+            binary = f.read()
+        os.remove('buildcache_test.ulp')
+        esp32_ulp.lines_to_binary_ext = None
+        esp32_ulp.assemble_file('buildcache_test.S', 'esp32', cache_dir=CACHE_DIR)
+        with open('buildcache_test.ulp', 'rb') as f:
+            assert f.read() == binary
+        # the same source, assembled from a string, is the same entry
+        assert esp32_ulp.src_to_binary(SRC, 'esp32', cache_dir=CACHE_DIR) == binary
+    finally:
+        esp32_ulp.lines_to_binary_ext = assemble
+        for filename in ('buildcache_test.h', 'buildcache_test.S', 'buildcache_test.ulp'):
+            os.remove(filename)
+        remove_cache_dir()
+
+
+def test_assemble_file_in_subdirectory_uses_cache():
+    # the key depends on the header found next to the source file, the same
+    # one the assembler uses, so editing it invalidates the entry
+    remove_cache_dir()
+    os.mkdir('buildcache_test_dir')
+    assemble = esp32_ulp.lines_to_binary_ext
+    calls = []
+
+    def counting_assemble(*args, **kwargs):
+        calls.append(args)
+        return assemble(*args, **kwargs)
+
+    def build(value):
+        with open('buildcache_test_dir/regs.h', 'w') as f:
+            f.write('#define VAL %d\n' % value)
+        esp32_ulp.assemble_file('buildcache_test_dir/prog.S', 'esp32', cache_dir=CACHE_DIR)
+        with open('buildcache_test_dir/prog.ulp', 'rb') as f:
+            return f.read()
+
+    try:
+        with open('buildcache_test_dir/prog.S', 'w') as f:
+            f.write('#include "regs.h"\n    move r0, VAL\n')
+        expected = [esp32_ulp.src_to_binary('move r0, %d' % value, 'esp32') for value in (3, 12)]
+        esp32_ulp.lines_to_binary_ext = counting_assemble
+        assert build(3) == expected[0]
+        assert build(3) == expected[0]
+        assert len(calls) == 1, "assembled again, although cached"
+        assert build(12) == expected[1]
+        assert len(calls) == 2, "cached entry used, although the header changed"
+    finally:
+        esp32_ulp.lines_to_binary_ext = assemble
+        for name in ('regs.h', 'prog.S', 'prog.ulp'):
+            os.remove('buildcache_test_dir/' + name)
+        os.rmdir('buildcache_test_dir')
+        remove_cache_dir()
+
+
+test_lazy_imports()
+test_preprocess_export_after_module_import()
+test_package_exports()
+test_assemble_file_includes_relative_to_the_file()
+test_key()
+test_store_and_load()
+test_src_to_binary_uses_cache()
+test_assemble_file_uses_cache()
+test_assemble_file_in_subdirectory_uses_cache()
@@ -57,6 +57,7 @@ def assert_decode_fields(sequence, expected_field_details):
 @test
 def test_unknown_instruction():
     assert_decode_exception("10000001", 'Unknown instruction')
+    assert_decode_exception("00000094", 'Unknown instruction')  # known opcode (END), unknown sub opcode
 
 
 @test
@@ -7,7 +7,9 @@
 
 import os
 
-from esp32_ulp.definesdb import DefinesDB, DBNAME
+from esp32_ulp.definesdb import DefinesDB, DBNAME, CACHE_ENTRY_OVERHEAD
+from esp32_ulp import sorteddb
+from esp32_ulp.preprocess import Preprocessor
 from esp32_ulp.util import file_exists
 
 tests = []
@@ -61,6 +63,107 @@ def test_definesdb_should_not_create_a_db_file_when_only_reading():
     assert not file_exists(DBNAME)
 
 
+@test
+def test_definesdb_caches_lookups_and_misses():
+    db = DefinesDB()
+    db.clear()
+    db.update({'KEY1': 'VALUE1'})
+    db.close()
+
+    db = DefinesDB()
+    assert db.get('KEY1', None) == 'VALUE1'
+    assert db.get('r0', None) is None
+    assert db.cache_stats() == (0, 2)
+
+    assert db.get('KEY1', None) == 'VALUE1'
+    assert db.get('r0', None) is None  # misses are cached too
+    assert db.cache_stats() == (2, 2)
+
+    db.update({'r0': 'VALUE2'})  # updating a key invalidates its cache entry
+    assert db.get('r0', None) == 'VALUE2'
+    assert db.cache_stats() == (2, 3)
+
+    db.clear()
+    assert db.get('KEY1', None) is None
+
+
+@test
+def test_definesdb_cache_is_bounded():
+    db = DefinesDB(cache_size=10 * (CACHE_ENTRY_OVERHEAD + 5))
+    db.clear()
+
+    for i in range(100):
+        db.get('K%04d' % i, None)
+    assert len(db._cache) + len(db._cache_old) <= 10
+
+    # recently used keys are still cached
+    hits, misses = db.cache_stats()
+    db.get('K0099', None)
+    assert db.cache_stats() == (hits + 1, misses)
+
+    db = DefinesDB(cache_size=0)  # no cache
+    db.get('K0000', None)
+    db.get('K0000', None)
+    assert db.cache_stats() == (0, 2)
+
+
+@test
+def test_definesdb_reads_sorted_db_files():
+    filename = 'sorted_test.db'
+    defines = {'KEY%d' % i: 'VALUE%d' % i for i in range(20)}
+    defines['RTC_IO_TOUCH_PAD0_REG'] = '(DR_REG_RTCIO_BASE + 0x94)'
+    with open(filename, 'wb') as f:
+        sorteddb.write(f, defines)
+
+    try:
+        db = DefinesDB(filename=filename)
+        for k, v in defines.items():
+            assert db.get(k, None) == v
+        assert db.get('KEY', None) is None
+        assert db.get('KEY99', None) is None
+        assert db.get('r0', None) is None
+        assert db.get('ZZZ', None) is None
+        assert sorted(db.keys()) == sorted(defines)
+
+        try:
+            db.update({'KEY1': 'other'})
+        except ValueError:
+            raised = True
+        else:
+            raised = False
+        assert raised, 'sorted db files are read-only'
+        db.close()
+    finally:
+        os.remove(filename)
+
+
+@test
+def test_definesdb_contents_after_parsing_an_include_file():
+    filename = 'definesdb_test.h'
+    with open(filename, 'w') as f:
+        f.write('#ifndef _TEST_H_\n#define _TEST_H_\n#define CONST 42  // comment\n'
+                '#define ADD(a, b) ((a) + (b))\n#endif\n')
+
+    db = DefinesDB()
+    db.clear()
+    try:
+        p = Preprocessor()
+        p.use_db(db)
+        p.process_include_file(filename)
+
+        db.open()
+        # all defines are stored: include guards (without a value) as empty,
+        # function-like macros under their name followed by ()
+        assert sorted(db.keys()) == ['ADD()', 'CONST', '_TEST_H_']
+        assert db.get('_TEST_H_', None) == ''
+        assert db.get('CONST', None) == '42'
+        assert db.get('ADD()', None) == '(a, b) ((a) + (b))'
+        db.close()
+    finally:
+        os.remove(filename)
+        db.clear()
+
+
 if __name__ == '__main__':
     # run all methods marked with @test
     for t in tests:
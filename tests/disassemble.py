@@ -0,0 +1,66 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+import os
+import ubinascii
+
+from tools import disassemble
+from tools.disassemble import iter_words, iter_file_words, iter_decoded
+
+tests = []
+
+
+def test(param):
+    tests.append(param)
+
+
+CODE = ubinascii.unhexlify('e1af8c72' '01000068' '2705cc19' '0005681d' '000000a0' '00000074')
+WORDS = [0x728cafe1, 0x68000001, 0x19cc0527, 0x1d680500, 0xa0000000, 0x74000000]
+
+
+@test
+def test_iter_words():
+    assert list(iter_words(CODE)) == WORDS
+    assert list(iter_words(memoryview(CODE)[4:12])) == WORDS[1:3]
+    assert list(iter_words(CODE[:6])) == [WORDS[0], 0x0001]  # partial word at the end
+    assert list(iter_words(b'')) == []
+
+
+@test
+def test_iter_file_words():
+    filename = 'disassemble_test.bin'
+    with open(filename, 'wb') as f:
+        f.write(b'skip' + CODE + b'more')
+    try:
+        for chunk_size in (4, 8, 12, 1024):  # words are never split between chunks
+            with open(filename, 'rb') as f:
+                f.seek(4)
+                assert list(iter_file_words(f, len(CODE), chunk_size)) == WORDS, chunk_size
+                assert f.read() == b'more'  # does not read past the section
+        with open(filename, 'rb') as f:
+            assert list(iter_file_words(f, 100)) == list(iter_words(b'skip' + CODE + b'more'))  # file too short
+    finally:
+        os.remove(filename)
+
+
+@test
+def test_iter_decoded():
+    disassemble.load_decoder('esp32')
+    decoded = iter_decoded(iter([WORDS[0], 0, WORDS[5]]))
+    offset, word, ins, name = next(decoded)
+    assert (offset, word, name) == (0, WORDS[0], 'MOVE r1, 51966')
+    assert ins is not None
+    offset, word, ins, name = next(decoded)  # decoded lazily, one at a time
+    assert (offset, word, ins, str(name)) == (4, 0, None, '<empty>')
+    offset, word, ins, name = next(decoded)
+    assert (offset, word, name) == (8, WORDS[5], 'STAGE_INC 0')
+
+
+if __name__ == '__main__':
+    # run all methods marked with @test
+    for t in tests:
+        t()
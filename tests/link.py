@@ -5,7 +5,7 @@
 # SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
 # SPDX-License-Identifier: MIT
 
-from esp32_ulp.link import make_binary
+from esp32_ulp.link import make_binary, make_image, HEADER_SIZE
 
 
 def test_make_binary():
@@ -18,5 +18,22 @@ def test_make_binary():
     assert bin.endswith(text+data)
 
 
+def test_make_binary_accepts_views():
+    text = bytearray(b'\x12\x34\x56\x78')
+    data = memoryview(b'\x11\x22\x33\x44\x55\x66\x77\x88')[:4]
+    bin = make_binary(memoryview(text), data, 0)
+    assert bin[12:] == b'\x12\x34\x56\x78\x11\x22\x33\x44'
+
+
+def test_make_image():
+    image = make_image(8, 4, 40)
+    assert isinstance(image, bytearray)
+    assert len(image) == HEADER_SIZE + 8 + 4
+    assert image[:HEADER_SIZE] == b'\x75\x6c\x70\x00\x0c\x00\x08\x00\x04\x00\x28\x00'
+    assert image[HEADER_SIZE:] == bytes(12)  # sections not filled in yet
+
+
 test_make_binary()
+test_make_binary_accepts_views()
 
+test_make_image()
@@ -5,7 +5,7 @@
 # SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
 # SPDX-License-Identifier: MIT
 
-from esp32_ulp.nocomment import remove_comments
+from esp32_ulp.nocomment import remove_comments, iter_remove_comments
 
 ORIG = """\
 /*
@@ -64,4 +64,30 @@ def test_remove_comments():
     assert lines_expected == lines_got, "texts differ"
 
 
+def test_iter_remove_comments_line_by_line():
+    # like reading the lines of a file: multi-line comments span several chunks
+    chunks = [line + '\n' for line in ORIG.splitlines()]
+    lines_got = list(iter_remove_comments(chunks))
+    assert lines_got == remove_comments(ORIG), "texts differ"
+
+
+def test_iter_remove_comments_chunks_without_comments():
+    # chunks without any comment or string chars take a fast path, which
+    # must still respect comments and lines continued from previous chunks
+    chunks = ['  nop\n', 'move r0, 1 /* a\n', 'still a comment\n', 'end */ add\n', '\tlabel: ', 'x\n', 'y']
+    lines_got = list(iter_remove_comments(chunks))
+    assert lines_got == ['\tnop', 'move r0, 1', '', '\tadd', '\tlabel: x', 'y'], lines_got
+    assert lines_got == remove_comments(''.join(chunks)), "texts differ"
+
+
+def test_iter_remove_comments_keep_directives():
+    src = '#if A # comment\n  #define B(x) #x ## 1 // comment\nnop # comment\n/*\n#endif\n*/ #endif\n'
+    lines_got = list(iter_remove_comments((src, ), keep_directives=True))
+    assert lines_got == ['#if A # comment', '\t#define B(x) #x ## 1 // comment', 'nop', '', '', '\t#endif'], lines_got
+    assert remove_comments(src) == ['', '', 'nop', '', '', ''], "directives are comments by default"
+
+
 test_remove_comments()
+test_iter_remove_comments_line_by_line()
+test_iter_remove_comments_chunks_without_comments()
+test_iter_remove_comments_keep_directives()
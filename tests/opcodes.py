@@ -6,7 +6,7 @@
 # SPDX-License-Identifier: MIT
 
 from uctypes import UINT32, BFUINT32, BF_POS, BF_LEN
-from esp32_ulp.opcodes import make_ins, make_ins_struct_def
+from esp32_ulp.opcodes import make_ins, make_ins_struct_def, make_ins_fields, Ins
 from esp32_ulp.opcodes import get_reg, get_imm, get_cond, arg_qualify, parse_int, eval_arg, ARG, REG, IMM, SYM, COND
 from esp32_ulp.assemble import SymbolTable, ABS, REL, TEXT
 import esp32_ulp.opcodes as opcodes
@@ -39,6 +39,66 @@ def test_make_ins():
     assert _delay.all == 0x40000023
 
 
+def test_make_ins_fields():
+    assert make_ins_fields(LAYOUT_DELAY) == (
+        ('cycles', 0, 16),
+        ('unused', 16, 12),
+        ('opcode', 28, 4),
+    )
+    assert_raises(ValueError, make_ins_fields, "cycles : 16")
+
+
+def test_ins_encode():
+    _delay = Ins(LAYOUT_DELAY)
+    assert _delay.encode(cycles=0x23, opcode=OPCODE_DELAY) == 0x40000023
+    assert _delay.encode(opcode=OPCODE_DELAY) == 0x40000000  # fields not given are 0
+    assert _delay.encode(cycles=-1, opcode=OPCODE_DELAY) == 0x4000ffff  # values are truncated to the field width
+    assert_raises(TypeError, lambda: _delay.encode(unused=1), message='unknown field: unused')
+    # fields are given by name, so a different layout can't get them mixed up
+    reordered = Ins("opcode : 4\n unused : 12\n cycles : 16")
+    assert reordered.encode(cycles=0x23, opcode=OPCODE_DELAY) == 0x00230004
+
+    # same result as writing the fields of the uctypes struct
+    struct = make_ins(LAYOUT_DELAY)
+    struct.cycles = 0x12345
+    struct.unused = 0
+    struct.opcode = OPCODE_DELAY
+    assert _delay.encode(cycles=0x12345, opcode=OPCODE_DELAY) == struct.all
+
+
+def test_ins_decode():
+    _delay = Ins(LAYOUT_DELAY)
+    _delay.all = 0x40000023
+    assert _delay.cycles == 0x23
+    assert _delay.unused == 0
+    assert _delay.opcode == OPCODE_DELAY
+    assert_raises(AttributeError, getattr, _delay, 'not_a_field')
+
+
+def test_ins_layout_parsed_on_first_use():
+    bad = Ins("cycles : 16")  # does not sum up to 32 bits, but is not parsed yet
+    assert bad.all == 0
+    assert_raises(ValueError, getattr, bad, 'encode')
+
+    _delay = Ins(LAYOUT_DELAY)
+    _delay.all = 0x40000023
+    assert _delay.cycles == 0x23  # decoding parses the layout too
+    assert _delay.encode(cycles=0x23, opcode=OPCODE_DELAY) == 0x40000023
+
+
+def test_arg_counts():
+    instructions = [name[2:] for name in dir(opcodes) if name.startswith('i_')]
+    assert sorted(instructions) == sorted(opcodes.ARG_COUNTS)
+
+
+def test_no_of_instr():
+    for opcode, cond in (('jumpr', 'EQ'), ('jumps', 'GT')):
+        assert opcodes.no_of_instr(opcode, ('1', '2', cond)) == 2
+    for opcode, cond in (('jumpr', 'LT'), ):
+        assert opcodes.no_of_instr(opcode, ('1', '2', cond)) == 1
+    assert opcodes.no_of_instr('nop', ()) == 1
+
+
 def test_arg_qualify():
     assert arg_qualify('r0') == ARG(REG, 0, 'r0')
     assert arg_qualify('R3') == ARG(REG, 3, 'R3')
@@ -67,6 +127,31 @@ def test_arg_qualify():
     opcodes.symbols = None
 
 
+def test_arg_qualify_cache():
+    opcodes.symbols = SymbolTable({}, {}, {})
+    opcodes.symbols.set_sym('const', ABS, None, 42)
+
+    hits, misses = opcodes.arg_cache_stats()
+    assert arg_qualify('r1') == ARG(REG, 1, 'r1')
+    assert arg_qualify('r1') == ARG(REG, 1, 'r1')
+    assert arg_qualify('const + 1') == ARG(IMM, 43, 'const + 1')
+    assert arg_qualify('const + 1') == ARG(IMM, 43, 'const + 1')
+    assert opcodes.arg_cache_stats() == (hits + 2, misses + 2)
+
+    # changing the symbol table invalidates the cache
+    opcodes.symbols.set_sym('later', ABS, None, 1)
+    assert arg_qualify('const + 1') == ARG(IMM, 43, 'const + 1')
+    assert opcodes.arg_cache_stats() == (hits + 2, misses + 3)
+
+    # so does using another symbol table
+    opcodes.symbols = SymbolTable({}, {}, {})
+    opcodes.symbols.set_sym('const', ABS, None, 1)
+    assert arg_qualify('const + 1') == ARG(IMM, 2, 'const + 1')
+
+    # clean up
+    opcodes.symbols = None
+
+
 def test_get_reg():
     assert get_reg('r0') == 0
     assert get_reg('R3') == 3
@@ -217,7 +302,14 @@ def test_reg_address_translations_sens():
 
 test_make_ins_struct_def()
 test_make_ins()
+test_make_ins_fields()
+test_ins_encode()
+test_ins_decode()
+test_ins_layout_parsed_on_first_use()
+test_arg_counts()
+test_no_of_instr()
 test_arg_qualify()
+test_arg_qualify_cache()
 test_get_reg()
 test_get_imm()
 test_get_cond()
@@ -7,7 +7,7 @@
 
 import os
 
-from esp32_ulp.preprocess import Preprocessor
+from esp32_ulp.preprocess import Preprocessor, compile_macro, eval_condition, clear_include_cache, _include_cache
 from esp32_ulp.definesdb import DefinesDB, DBNAME
 from esp32_ulp.util import file_exists
 
@@ -61,8 +61,10 @@ def test_parse_defines():
     assert p.parse_define_line("#define a 1") == {"a": "1"}
     assert p.parse_define_line(" #define a 1") == {"a": "1"}
     assert p.parse_define_line("#define a 1 2") == {"a": "1 2"}
-    assert p.parse_define_line("#define f(a,b) 1") == {}  # macros not supported
-    assert p.parse_define_line("#define f(a, b) 1") == {}  # macros not supported
+    assert p.parse_define_line("#define f(a,b) 1") == {"f()": "(a,b) 1"}  # macros are stored as f()
+    assert p.parse_define_line("#define f(a, b) 1") == {"f()": "(a, b) 1"}
+    assert p.parse_define_line("#define f(a) a ## _S // comment") == {"f()": "(a) a##_S"}
+    assert p.parse_define_line("#define f(a) \\") == {}  # line continuations not supported
     assert p.parse_define_line("#define f (a,b) 1") == {"f": "(a,b) 1"}  # f is not a macro
     assert p.parse_define_line("#define f (a, b) 1") == {"f": "(a, b) 1"}  # f is not a macro
     assert p.parse_define_line("#define RTC_ADDR       0x12345    // start of range") == {"RTC_ADDR": "0x12345"}
@@ -80,8 +82,7 @@ def test_parse_defines_handles_multiple_input_lines():
 
 
 @test
-def test_parse_defines_does_not_understand_comments_by_current_design():
-    # comments are not understood. lines are expected to already have comments removed!
+def test_parse_defines_ignores_defines_in_block_comments():
     p = Preprocessor()
 
     multi_line_2 = """\
@@ -90,7 +91,7 @@ def test_parse_defines_does_not_understand_comments_by_current_design():
 #define ID2 somethingelse
 */
 """
-    assert "ID2" in p.parse_defines(multi_line_2)
+    assert "ID2" not in p.parse_defines(multi_line_2)
 
 
 @test
@@ -195,6 +196,236 @@ def preprocess_should_replace_defines_used_in_defines():
     assert "move r1, (0x1234 << 4)" in p.preprocess(lines)
 
 
+@test
+def preprocess_should_not_loop_endlessly_on_cyclic_defines():
+    p = Preprocessor()
+
+    lines = """\
+    #define A (B + 1)
+    #define B (A * 2)
+    #define C C
+
+    move r1, A
+    move r2, C"""
+
+    # like the C preprocessor, an identifier is not expanded again within its own expansion
+    assert "move r1, ((A * 2) + 1)" in p.preprocess(lines)
+    assert "move r2, C" in p.preprocess(lines)
+
+
+@test
+def test_expand_defines_returns_lines_without_defines_unchanged():
+    p = Preprocessor()
+    p.parse_defines("#define A 1")
+
+    line = "\tmove r1, r2  "
+    assert p.expand_defines(line) is line
+    assert p.expand_defines("\tmove r1, A") == "\tmove r1, 1"
+
+
+@test
+def test_compile_macro():
+    assert compile_macro("() 42") == (0, ("42",))
+    assert compile_macro("(a, b) ((a) + (b))") == (2, ("((", (0, True), ") + (", (1, True), "))"))
+    # pasted parameters are not expanded before substituting them
+    assert compile_macro("(r, f) r, f##_S") == (2, ((0, True), ", ", (1, False), "_S"))
+    assert compile_macro("(a, b) a ## b") == (2, ((0, False), (1, False)))
+    assert compile_macro("(a, ...) a") is None  # variadic macros not supported
+
+
+@test
+def test_expand_function_like_macros():
+    src = """\
+#define BASE 0x100
+#define ADD(a, b) ((a) + (b))
+#define FIELD(reg, f) reg, f##_S
+#define GPIO_S 14
+#define SEVEN() 7
+#define SELF(a) SELF(a + 1)
+    move r0, ADD(BASE, ADD(1, 2))
+    reg_rd FIELD(BASE, GPIO), 0
+    move r1, SEVEN() + ADD (1, (2, 3))
+    move r2, SELF(1)
+    move r3, ADD"""
+    lines = Preprocessor().preprocess(src).splitlines()[6:]
+    assert lines == [
+        "\tmove r0, ((0x100) + (((1) + (2))))",
+        "\treg_rd 0x100, 14, 0",
+        "\tmove r1, 7 + ((1) + ((2, 3)))",
+        "\tmove r2, SELF(1 + 1)",  # like C, a macro is not expanded in its own expansion
+        "\tmove r3, ADD",  # not called
+    ], lines
+
+    p = Preprocessor()
+    p.parse_defines("#define ADD(a, b) ((a) + (b))")
+    try:
+        p.expand_defines("move r0, ADD(1)")
+    except ValueError as e:
+        assert str(e) == "Macro ADD expects 2 arguments, got 1"
+    else:
+        assert False, "ValueError not raised"
+
+
+@test
+def test_builtin_macros_take_precedence_over_function_like_macros():
+    # e.g. from ESP-IDF include files parsed into the defines db
+    src = """\
+#define BIT(nr) (1UL << (nr))
+#define READ_RTC_REG(rtc_reg, low_bit, bit_width) reg_rd rtc_reg, ((low_bit) + (bit_width) - 1), (low_bit)
+    READ_RTC_REG(1, BIT(2), 3)"""
+    assert Preprocessor().preprocess(src).splitlines()[2] == "\treg_rd 1, (2) + 3 - 1, (2)"
+
+
+@test
+def test_eval_condition():
+    assert eval_condition("1") == 1
+    assert eval_condition("1 + 2 * 3") == 7
+    assert eval_condition("(1 + 2) * 3") == 9
+    assert eval_condition("1 << 4 | 1") == 17
+    assert eval_condition("!0 && 2 > 1") == 1
+    assert eval_condition("1 == 2 || 3 != 3") == 0
+    assert eval_condition("-7 / 2") == -3  # truncating towards zero, like C
+    assert eval_condition("0x10UL >= 16") == 1
+    assert eval_condition("UNDEFINED") == 0  # like C
+    for expr in ("", "1 +", "(1", "1 2", "1 / 0"):
+        try:
+            eval_condition(expr)
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError not raised for %s" % expr
+
+
+CONDITIONAL_SRC = """\
+#define ESP32
+#define LEVEL 2
+#ifdef ESP32
+#define VALUE 1
+#else
+#define VALUE 2
+    unknown_instruction
+#endif
+#ifndef ESP32
+    unknown_instruction
+#elif LEVEL > 1 && defined(ESP32) && !defined NOT_DEFINED
+    move r0, VALUE
+  #if 0
+    #if 1
+      unknown_instruction
+    #endif
+    don't tokenize this
+  #elif LEVEL == 2
+    move r1, LEVEL
+  #else
+    unknown_instruction
+  #endif
+#else
+    unknown_instruction
+#endif
+    halt"""
+
+
+@test
+def test_preprocess_conditionals():
+    p = Preprocessor()
+    lines = p.preprocess(CONDITIONAL_SRC).splitlines()
+    assert len(lines) == len(CONDITIONAL_SRC.splitlines()), "line numbers must stay"
+    assert [line for line in lines if line] == ["\tmove r0, 1", "\tmove r1, 2", "\thalt"], lines
+    assert p._defines["VALUE"] == "1", "defines in skipped regions are ignored"
+    assert p._defines["ESP32"] == "", "defines without value are defined too"
+
+
+@test
+def test_preprocess_conditionals_errors():
+    for src, message in (
+            ("#endif", "Line 1: #endif without #if"),
+            ("nop\n#ifdef X\n#else\n", "Line 2: #if without #endif"),
+            ("#if\n#endif", "Line 1: #if without condition"),
+            ("#if 1 +\n#endif", "Line 1: Invalid #if expression: 1 +"),
+    ):
+        try:
+            Preprocessor().preprocess(src)
+        except ValueError as e:
+            assert str(e) == message, str(e)
+        else:
+            assert False, "ValueError not raised for %s" % src
+
+
+@test
+def test_preprocess_directives_in_block_comments():
+    src = "/*\n#if 0\n*/\nnop\n#define A 1 /* comment */\n  /* #endif\n#else */\nmove r0, A"
+    p = Preprocessor()
+    assert p.preprocess(src).splitlines() == ["", "", "", "nop", "", "", "", "move r0, 1"]
+    assert p._defines == {"A": "1"}
+
+
+@test
+def test_preprocess_directive_name_followed_by_bracket():
+    src = "#if(1)\nmove r0, 1\n#elif(1)\nmove r0, 2\n#endif\n#if!(1)\nmove r0, 3\n#endif"
+    lines = Preprocessor().preprocess(src).splitlines()
+    assert [line for line in lines if line] == ["move r0, 1"], lines
+
+
+@test
+def test_preprocess_include():
+    p = Preprocessor()
+    p.use_include_paths([resolve_relative_path('fixtures')])
+    src = """\
+#include "incl.h"  // searched in the current directory, then the include paths
+#include <incl2.h>
+    move r0, CONST1
+    move r1, CONST2 + CONST3
+    move r2, MACRO(1, 2)"""
+    lines = p.preprocess(src).splitlines()
+    assert lines[2:] == ["\tmove r0, 42", "\tmove r1, 123 + 777", "\tmove r2, 1+2"], lines
+
+    # "file" is searched in the directory the source is from first
+    src = '#include "incl.h"\n\tmove r0, CONST1'
+    assert Preprocessor().preprocess(src, resolve_relative_path('fixtures')) == "\n\tmove r0, 42"
+
+    # files not found are an error, unless there is a defines db: their
+    # defines are expected to be in there then
+    try:
+        Preprocessor().preprocess('nop\n#include "incl.h"')
+    except ValueError as e:
+        assert str(e) == 'Line 2: Include file not found: "incl.h"', str(e)
+    else:
+        assert False, "ValueError not raised for a missing include file"
+    db = DefinesDB()
+    db.clear()
+    db.update({'CONST1': '7'})
+    try:
+        p = Preprocessor()
+        p.use_db(db)
+        assert p.preprocess(src) == "\n\tmove r0, 7"
+    finally:
+        db.clear()
+    # ESP-IDF SoC headers are always expected in the defines db
+    assert Preprocessor().preprocess('#include "soc/rtc_cntl_reg.h"\nnop') == "\nnop"
+
+
+@test
+def test_preprocess_include_caches_parsed_files():
+    clear_include_cache()
+    filename = 'include_test.h'
+    with open(filename, 'w') as f:
+        f.write('#include "include_test.h"\n#define VALUE 1\n')  # includes itself
+
+    try:
+        src = '#include "include_test.h"\n\tmove r0, VALUE'
+        assert Preprocessor().preprocess(src).endswith("move r0, 1")
+        # a cached file is not parsed again
+        _include_cache['./' + filename][1]['VALUE'] = 'cached'
+        assert Preprocessor().preprocess(src).endswith("move r0, cached")
+        # unless it changed
+        with open(filename, 'w') as f:
+            f.write('#define VALUE 22\n')
+        assert Preprocessor().preprocess(src).endswith("move r0, 22")
+    finally:
+        os.remove(filename)
+        clear_include_cache()
+
+
 @test
 def test_expand_rtc_macros():
     p = Preprocessor()
@@ -232,6 +463,7 @@ def test_process_include_file():
     assert defines['CONST2'] == '99'
     assert defines.get('MULTI_LINE', None) == 'abc \\'  # correct. line continuations not supported
     assert 'MACRO' not in defines
+    assert defines['MACRO()'] == '(x,y) x+y'
 
 
 @test
@@ -260,6 +492,7 @@ def test_process_include_file_using_database():
     assert db['CONST1'] == '42', "constant from incl.h"
     assert db['CONST2'] == '123', "constant overridden by incl2.h"
     assert db['CONST3'] == '777', "constant from incl2.h"
+    assert p.expand_defines("move r0, MACRO(1, CONST1)") == "move r0, 1+42", "macro from incl.h"
 
     db.close()
 
@@ -354,6 +587,41 @@ def test_preprocess_should_ensure_the_definesdb_is_properly_closed_after_use():
     assert not db.is_open()
 
 
+@test
+def test_preprocess_file_streams_same_result_as_preprocess():
+    content = """\
+#define RTC_ADDR 0x12 /* address */
+#define ONE 1
+    /* multi-line
+       comment */
+    move r1, RTC_ADDR  // comment
+    WRITE_RTC_REG(RTC_ADDR, 3, 2, ONE)
+"""
+    filename = 'preprocess_file_test.S'
+    with open(filename, 'w') as f:
+        f.write(content)
+
+    try:
+        lines = Preprocessor().preprocess_file(filename)
+        assert not isinstance(lines, str)  # a generator, not a big string
+        assert "\n".join(lines) == Preprocessor().preprocess(content)
+    finally:
+        os.remove(filename)
+
+
+@test
+def test_preprocess_file_evaluates_conditionals():
+    filename = 'preprocess_file_test.S'
+    with open(filename, 'w') as f:
+        f.write(CONDITIONAL_SRC)
+
+    try:
+        lines = Preprocessor().preprocess_file(filename)
+        assert "\n".join(lines) == Preprocessor().preprocess(CONDITIONAL_SRC)
+    finally:
+        os.remove(filename)
+
+
 if __name__ == '__main__':
     # run all methods marked with @test
     for t in tests:
@@ -0,0 +1,64 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+from esp32_ulp import src_to_binary_ext
+from esp32_ulp.assemble import Assembler
+from esp32_ulp.profiler import Profiler
+
+src = """\
+#define VALUE 42  // the answer
+    .data
+result: .long 0
+    .text
+entry:
+    move r3, result
+    move r0, VALUE
+    st r0, r3, 0
+    WRITE_RTC_REG(0x3ff48400, 2, 1, 1)
+    halt
+"""
+
+
+def test_profiler_collects_stages():
+    profiler = Profiler()
+    binary, _ = src_to_binary_ext(src, 'esp32', profiler=profiler)
+    assert binary == src_to_binary_ext(src, 'esp32')[0]
+
+    for stage in ('parse_defines', 'remove_comments', 'parse', 'pass1', 'pass2', 'export_symbols', 'link'):
+        count, us, alloc = profiler.stages[stage]
+        assert count == 1, stage
+    count, us, alloc = profiler.stages['expand_defines']
+    assert count == len(src.splitlines())  # once per line
+    assert profiler.stages['expand_rtc_macros'][0] == count
+
+
+def test_profiler_counts_opcodes():
+    profiler = Profiler()
+    Assembler(profiler=profiler).assemble("""\
+entry:
+    move r3, result
+    move r0, 42
+    st r0, r3, 0
+    halt
+result: .long 0
+""")
+
+    # instructions only get encoded in pass 2
+    assert profiler.opcodes['move'][0] == 2
+    assert profiler.opcodes['st'][0] == 1
+    assert profiler.opcodes['halt'][0] == 1
+
+
+def test_no_profiler_no_wrapping():
+    a = Assembler()
+    assert a.profiler is None
+    assert a.opcodes.i_move is a.opcodes.__dict__['i_move']  # the real opcodes module
+
+
+test_profiler_collects_stages()
+test_profiler_counts_opcodes()
+test_no_profiler_no_wrapping()
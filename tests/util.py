@@ -6,7 +6,8 @@
 # SPDX-License-Identifier: MIT
 
 import os
-from esp32_ulp.util import split_tokens, validate_expression, parse_int, file_exists
+from esp32_ulp.util import split_tokens, iter_tokens, validate_expression, parse_int, file_exists, read_lines
+from esp32_ulp.util import compile_expression, eval_expression, CONST, SYMBOL, BINARY
 
 tests = []
 
@@ -51,6 +52,20 @@ def test_split_tokens():
     assert split_tokens("#test") == ['#', 'test']
 
 
+@test
+def test_iter_tokens():
+    lines = [
+        "", "  move r0, 0x42  ", "\treg_wr RTC_GPIO_OUT_REG, 31, 14, 1",
+        "jumpr loop, 10, LT", "x+(1<<2)", "a\n\nb", "a äb  ü\t", "__x9_y",
+    ]
+    for line in lines:
+        tokens = list(iter_tokens(line))
+        assert tokens == split_tokens(line), line
+        assert "".join(tokens) == line, line
+    # non-ASCII characters are tokens on their own, like operators
+    assert split_tokens("a äb") == ['a', ' ', 'ä', 'b']
+
+
 @test
 def test_validate_expression():
     assert validate_expression('') is True
@@ -82,6 +97,56 @@ def test_validate_expression():
     assert validate_expression('def CAFE()') is False
 
 
+class Symbols:
+    # minimal stand-in for assemble.SymbolTable
+    def __init__(self, values):
+        self._values = values
+
+    def has_sym(self, symbol):
+        return symbol in self._values
+
+    def get_sym(self, symbol):
+        return (None, None, self._values[symbol])
+
+
+@test
+def test_compile_expression():
+    # constant expressions are evaluated at compile time
+    assert compile_expression('1 + 2') == 3
+    assert compile_expression('0x10 << 2') == 64
+    # expressions with symbols compile to RPN
+    assert compile_expression('a + 1') == ((SYMBOL, 'a'), (CONST, 1), (BINARY, '+'))
+    assert compile_expression('a+1*b') == ((SYMBOL, 'a'), (CONST, 1), (SYMBOL, 'b'), (BINARY, '*'), (BINARY, '+'))
+
+    for expr in ('', '1 +', '(1', '1)', '1 < 2', '1 < < 2', '2 ** 3', 'evil()', '1 ^ 2', '!100', '0xg'):
+        assert_raises(ValueError, compile_expression, expr)
+
+
+@test
+def test_eval_expression():
+    symbols = Symbols({'const': 42, 'shft': 2})
+
+    # C operator precedence, as binutils-esp32ulp uses it
+    assert eval_expression('1 + 2 * 3', None) == 7
+    assert eval_expression('1 + 2 << 3', None) == 24
+    assert eval_expression('42|4&0xf', None) == 46
+    assert eval_expression('(42|4)&0xf', None) == 14
+    assert eval_expression('-5 + ~0x7', None) == -13
+    assert eval_expression('3 - 2 - 1', None) == 0  # left-associative
+
+    # integer division and modulo, truncating towards zero like binutils does
+    assert eval_expression('7 / 2 * 2', None) == 6
+    assert eval_expression('-7 / 2', None) == -3
+    assert eval_expression('-7 % 3', None) == -1
+
+    # symbols are resolved at evaluation time
+    assert eval_expression('const >> 1', symbols) == 21
+    assert eval_expression('(shft + 10) * 2', symbols) == 24
+    symbols = Symbols({'const': 1, 'shft': 2})
+    assert eval_expression('const >> 1', symbols) == 0  # cached compiled expression, new symbol value
+    assert_raises(ValueError, eval_expression, 'undefined + 1', symbols)
+
+
 @test
 def test_parse_int():
     # decimal
@@ -125,6 +190,21 @@ def test_file_exists():
     assert not file_exists(testfile)
 
 
+@test
+def test_read_lines():
+    testfile = '.testfile'
+    contents = 'line 1\n\nline 3 is a bit longer\nno newline at the end'
+    with open(testfile, 'w') as f:
+        f.write(contents)
+
+    try:
+        for chunk_size in (1, 5, 1024):
+            with open(testfile) as f:
+                assert list(read_lines(f, chunk_size)) == contents.splitlines(True)
+    finally:
+        os.remove(testfile)
+
+
 if __name__ == '__main__':
     # run all methods marked with @test
     for t in tests:
@@ -0,0 +1,55 @@
+#
+# This file is part of the micropython-esp32-ulp project,
+# https://github.com/micropython/micropython-esp32-ulp
+#
+# SPDX-FileCopyrightText: 2018-2023, the micropython-esp32-ulp authors, see AUTHORS file.
+# SPDX-License-Identifier: MIT
+
+"""
+Tool for building a defines database on a PC, ready to be copied to devices
+
+Parses the given include files (e.g. the ESP-IDF soc/*_reg.h files) the same
+way esp32_ulp.parse_to_db does, but writes a sorted db file (see
+esp32_ulp/sorteddb.py) instead of a btree database. DefinesDB opens such a
+file directly, so the (slow) parsing on the device is not needed anymore:
+just copy the resulting file to the device as defines.db.
+
+Run this tool from the repo root like this:
+
+python tools/build_defines_db.py [-o defines.db] include.h ...
+
+Note:
+This tool works with both Python 3 and MicroPython.
+"""
+
+import sys
+
+from esp32_ulp.preprocess import Preprocessor
+from esp32_ulp.definesdb import DBNAME
+from esp32_ulp import sorteddb
+
+
+def parse(files):
+    # without a DefinesDB, the preprocessor collects the defines in a dict
+    p = Preprocessor()
+    defines = {}
+    for f in files:
+        print('Processing file:', f)
+        defines = p.process_include_file(f)
+    return defines
+
+
+def build(files, output=DBNAME):
+    defines = parse(files)
+    with open(output, 'wb') as f:
+        sorteddb.write(f, defines)
+    print('Wrote %d defines to %s' % (len(defines), output))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    output = DBNAME
+    if len(args) > 2 and args[0] in ('-o', '--output'):
+        output = args[1]
+        args = args[2:]
+    build(args, output)
@@ -14,48 +14,48 @@ jump_types = ('--', 'EQ', 'OV')
 cmp_ops = ('LT', 'GE', 'LE', 'EQ', 'GT')
 
 lookup = {
-    opcodes.OPCODE_ADC: ('ADC', opcodes._adc, lambda op: 'ADC r%s, %s, %s' % (op.dreg, op.mux, op.sar_sel)),
+    opcodes.OPCODE_ADC: ('ADC', opcodes._adc, lambda op: 'ADC r%s, %s, %s' % (op['dreg'], op['mux'], op['sar_sel'])),
     opcodes.OPCODE_ALU: ('ALU', opcodes._alu_imm, {
         opcodes.SUB_OPCODE_ALU_CNT: (
             'ALU_CNT',
             opcodes._alu_cnt,
-            lambda op: '%s%s' % (alu_cnt_ops[op.sel], '' if op.sel == opcodes.ALU_SEL_RST else ' %s' % op.imm)
+            lambda op: '%s%s' % (alu_cnt_ops[op['sel']], '' if op['sel'] == opcodes.ALU_SEL_RST else ' %s' % op['imm'])
         ),
         opcodes.SUB_OPCODE_ALU_IMM: (
             'ALU_IMM',
             opcodes._alu_imm,
-            lambda op: '%s r%s, %s' % (alu_ops[op.sel], op.dreg, op.imm) if op.sel == opcodes.ALU_SEL_MOV
-                else '%s r%s, r%s, %s' % (alu_ops[op.sel], op.dreg, op.sreg, op.imm)
+            lambda op: '%s r%s, %s' % (alu_ops[op['sel']], op['dreg'], op['imm']) if op['sel'] == opcodes.ALU_SEL_MOV
+                else '%s r%s, r%s, %s' % (alu_ops[op['sel']], op['dreg'], op['sreg'], op['imm'])
         ),
         opcodes.SUB_OPCODE_ALU_REG: (
             'ALU_REG',
             opcodes._alu_reg,
-            lambda op: '%s r%s, r%s' % (alu_ops[op.sel], op.dreg, op.sreg) if op.sel == opcodes.ALU_SEL_MOV
-                else '%s r%s, r%s, r%s' % (alu_ops[op.sel], op.dreg, op.sreg, op.treg)
+            lambda op: '%s r%s, r%s' % (alu_ops[op['sel']], op['dreg'], op['sreg']) if op['sel'] == opcodes.ALU_SEL_MOV
+                else '%s r%s, r%s, r%s' % (alu_ops[op['sel']], op['dreg'], op['sreg'], op['treg'])
         ),
     }),
     opcodes.OPCODE_BRANCH: ('BRANCH', opcodes._bx, {
         opcodes.SUB_OPCODE_BX: (
             'BX',
             opcodes._bx,
-            lambda op: 'JUMP %s%s' % (op.addr if op.reg == 0 else 'r%s' % op.dreg, ', %s' % jump_types[op.type]
-                if op.type != 0 else '')
+            lambda op: 'JUMP %s%s' % (op['addr'] if op['reg'] == 0 else 'r%s' % op['dreg'], ', %s' % jump_types[op['type']]
+                if op['type'] != 0 else '')
         ),
         opcodes.SUB_OPCODE_BR: (
             'BR',
             opcodes._br,
-            lambda op: 'JUMPR %s, %s, %s' % ('%s%s' % ('-' if op.sign == 1 else '', op.offset), op.imm, cmp_ops[op.cmp])
+            lambda op: 'JUMPR %s, %s, %s' % ('%s%s' % ('-' if op['sign'] == 1 else '', op['offset']), op['imm'], cmp_ops[op['cmp']])
         ),
         opcodes.SUB_OPCODE_BS: (
             'BS',
             opcodes._bs,
-            lambda op: 'JUMPS %s, %s, %s' % ('%s%s' % ('-' if op.sign == 1 else '', op.offset), op.imm, cmp_ops[op.cmp])
+            lambda op: 'JUMPS %s, %s, %s' % ('%s%s' % ('-' if op['sign'] == 1 else '', op['offset']), op['imm'], cmp_ops[op['cmp']])
         ),
     }),
     opcodes.OPCODE_DELAY: (
         'DELAY',
         opcodes._delay,
-        lambda op: 'NOP' if op.cycles == 0 else 'WAIT %s' % op.cycles
+        lambda op: 'NOP' if op['cycles'] == 0 else 'WAIT %s' % op['cycles']
     ),
     opcodes.OPCODE_END: ('END', opcodes._end, {
         opcodes.SUB_OPCODE_END: (
@@ -65,84 +65,114 @@ lookup = {
         opcodes.SUB_OPCODE_SLEEP: (
             'SLEEP',
             opcodes._sleep,
-            lambda op: 'SLEEP %s' % op.cycle_sel
+            lambda op: 'SLEEP %s' % op['cycle_sel']
         ),
     }),
     opcodes.OPCODE_HALT: ('HALT', opcodes._halt),
     opcodes.OPCODE_I2C: (
         'I2C',
         opcodes._i2c,
-        lambda op: 'I2C_%s %s, %s, %s, %s' % ('RD' if op.rw == 0 else 'WR', op.sub_addr, op.high, op.low, op.i2c_sel)
+        lambda op: 'I2C_%s %s, %s, %s, %s' % ('RD' if op['rw'] == 0 else 'WR', op['sub_addr'], op['high'], op['low'], op['i2c_sel'])
     ),
-    opcodes.OPCODE_LD: ('LD', opcodes._ld, lambda op: 'LD r%s, r%s, %s' % (op.dreg, op.sreg, op.offset)),
-    opcodes.OPCODE_ST: ('ST', opcodes._st, lambda op: 'ST r%s, r%s, %s' % (op.sreg, op.dreg, op.offset)),
+    opcodes.OPCODE_LD: ('LD', opcodes._ld, lambda op: 'LD r%s, r%s, %s' % (op['dreg'], op['sreg'], op['offset'])),
+    opcodes.OPCODE_ST: ('ST', opcodes._st, lambda op: 'ST r%s, r%s, %s' % (op['sreg'], op['dreg'], op['offset'])),
     opcodes.OPCODE_RD_REG: (
         'RD_REG',
         opcodes._rd_reg,
-        lambda op: 'REG_RD 0x%x, %s, %s' % (op.periph_sel << 8 | op.addr, op.high, op.low)
+        lambda op: 'REG_RD 0x%x, %s, %s' % (op['periph_sel'] << 8 | op['addr'], op['high'], op['low'])
     ),
     opcodes.OPCODE_WR_REG: (
         'WR_REG',
         opcodes._wr_reg,
-        lambda op: 'REG_WR 0x%x, %s, %s, %s' % (op.periph_sel << 8 | op.addr, op.high, op.low, op.data)
+        lambda op: 'REG_WR 0x%x, %s, %s, %s' % (op['periph_sel'] << 8 | op['addr'], op['high'], op['low'], op['data'])
     ),
-    opcodes.OPCODE_TSENS: ('TSENS', opcodes._tsens, lambda op: 'TSENS r%s, %s' % (op.dreg, op.delay)),
+    opcodes.OPCODE_TSENS: ('TSENS', opcodes._tsens, lambda op: 'TSENS r%s, %s' % (op['dreg'], op['delay'])),
 }
 
 
+def make_decoders():
+    """
+    flatten lookup into a table, so that decoding an instruction word needs
+    integer arithmetic and one dict lookup only:
+    opcode << 8 | sub_opcode -> (ins, name, pretty, fields)
+
+    fields are the (name, pos, mask) of all fields of the instruction, the
+    values of which are passed to pretty (as a dict). sub_opcode_fields has
+    the (pos, mask) of the sub_opcode field for each opcode, (0, 0) for
+    opcodes without sub opcodes.
+    """
+    decoders = {}
+    sub_opcode_fields = [(0, 0)] * 16
+    for opcode, params in lookup.items():
+        if len(params) == 3 and isinstance(params[2], dict):
+            sub_opcode_fields[opcode] = params[1].fields['sub_opcode']
+            entries = [(opcode << 8 | sub_opcode, sub_params) for sub_opcode, sub_params in params[2].items()]
+        else:
+            entries = [(opcode << 8, params)]
+        for key, params in entries:
+            name, ins = params[0], params[1]
+            pretty = params[2] if len(params) == 3 else None
+            fields = tuple((field, pos, mask) for field, (pos, mask) in ins.fields.items())
+            decoders[key] = (ins, name, pretty, fields)
+    return decoders, sub_opcode_fields
+
+
+decoders, sub_opcode_fields = make_decoders()
+
+
 def decode_instruction(i):
     if i == 0:
         raise Exception('<empty>')
 
-    ins = opcodes._end
-    ins.all = i  # abuse a struct to get opcode
-
-    params = lookup.get(ins.opcode, None)
+    opcode = i >> 28
+    pos, mask = sub_opcode_fields[opcode]
+    params = decoders.get(opcode << 8 | (i >> pos) & mask)
 
     if not params:
         raise Exception('Unknown instruction')
 
-    if len(params) == 3:
-        name, ins, third = params
-        ins.all = i
+    ins, name, pretty, fields = params
+    ins.all = i
+    if pretty is not None:
+        name = pretty({field: (i >> pos) & mask for field, pos, mask in fields})
 
-        if callable(third):
-            params = (third(ins), ins)
-        else:
-            params = third.get(ins.sub_opcode, ())
+    return ins, name
 
-    if len(params) == 3:
-        name, ins, pretty = params
-        ins.all = i
-        name = pretty(ins)
-    else:
-        name, ins = params
-        ins.all = i
 
-    return ins, name
+POSSIBLE_FIELDS = (
+    'addr', 'cmp', 'cycle_sel', 'cycles', 'data', 'delay', 'dreg',
+    'high', 'i2c_sel', 'imm', 'low', 'mux', 'offset', 'opcode',
+    'periph_sel', 'reg', 'rw', 'sar_sel', 'sel', 'sign', 'sreg',
+    'sub_addr', 'sub_opcode', 'treg', 'type', 'unused', 'unused1',
+    'unused2', 'wakeup'
+)
+
+# fields of each instruction, in the order of POSSIBLE_FIELDS
+_fields_in_order = {}  # id(ins) -> ((name, pos, mask), ...)
+
+
+def fields_in_order(ins):
+    try:
+        return _fields_in_order[id(ins)]
+    except KeyError:
+        pass
+    layout = ins.fields
+    fields = tuple((field,) + layout[field] for field in POSSIBLE_FIELDS if field in layout)
+    _fields_in_order[id(ins)] = fields
+    return fields
 
 
 def get_instruction_fields(ins):
-    possible_fields = (
-        'addr', 'cmp', 'cycle_sel', 'cycles', 'data', 'delay', 'dreg',
-        'high', 'i2c_sel', 'imm', 'low', 'mux', 'offset', 'opcode',
-        'periph_sel', 'reg', 'rw', 'sar_sel', 'sel', 'sign', 'sreg',
-        'sub_addr', 'sub_opcode', 'treg', 'type', 'unused', 'unused1',
-        'unused2', 'wakeup'
-    )
+    i = ins.all
+    fields = fields_in_order(ins)
+    values = {field: (i >> pos) & mask for field, pos, mask in fields}
     field_details = []
-    for field in possible_fields:
-        extra = ''
-        try:
-            # eval is ugly but constrained to possible_fields and variable ins
-            val = eval('i.%s' % field, {}, {'i': ins})
-            if (val>9):
-                extra = ' (0x%02x)' % val
-        except KeyError:
-            continue
+    for field, _, _ in fields:
+        val = values[field]
+        extra = ' (0x%02x)' % val if val > 9 else ''
 
         if field == 'sel':  # ALU
-            if ins.sub_opcode == opcodes.SUB_OPCODE_ALU_CNT:
+            if values['sub_opcode'] == opcodes.SUB_OPCODE_ALU_CNT:
                 extra = ' (%s)' % alu_cnt_ops[val]
             else:
                 extra = ' (%s)' % alu_ops[val]
@@ -8,6 +8,15 @@
 from uctypes import struct, addressof, LITTLE_ENDIAN, UINT16, UINT32
 import ubinascii
 import sys
+try:
+    from ustruct import unpack_from
+except ImportError:  # e.g. CPython
+    from struct import unpack_from
+
+HEADER_SIZE = 12
+# sections are read from the file in chunks of this many bytes (a multiple
+# of 4), into a buffer which is reused for all chunks
+CHUNK_SIZE = 1024
 
 
 # Placeholders:
@@ -32,14 +41,52 @@ def load_decoder(cpu):
 
 
 def chunk_into_words(code, bytes_per_word, byteorder):
-    chunks = [
-        ubinascii.hexlify(code[i:i + bytes_per_word])
+    return [
+        int.from_bytes(code[i:i + bytes_per_word], byteorder)
         for i in range(0, len(code), bytes_per_word)
     ]
 
-    words = [int.from_bytes(ubinascii.unhexlify(i), byteorder) for i in chunks]
 
-    return words
+def iter_words(buf):
+    """
+    generator: yield the 32 bit (little endian) words in buf, any object with
+    the buffer protocol, e.g. a memoryview, without copying it. a trailing
+    partial word is yielded as is (zero-extended).
+    """
+    end = len(buf) - len(buf) % 4
+    for offset in range(0, end, 4):
+        yield unpack_from('<I', buf, offset)[0]
+    if end < len(buf):
+        yield int.from_bytes(buf[end:], 'little')
+
+
+def iter_file_words(f, size, chunk_size=CHUNK_SIZE):
+    """
+    generator: yield the 32 bit words of the next size bytes of the open
+    (binary) file f. only chunk_size bytes are in memory at any time.
+    """
+    buf = memoryview(bytearray(chunk_size))
+    while size > 0:
+        n = f.readinto(buf[:min(size, chunk_size)])
+        if not n:
+            break  # file is shorter than the header says
+        size -= n
+        yield from iter_words(buf[:n])
+
+
+def iter_decoded(words):
+    """
+    generator: decode the instruction words one at a time, yielding
+    (byte_offset, word, ins, name). if a word cannot be decoded, ins is None
+    and name is the exception. ins is shared between instructions, so its
+    fields must be used before decoding the next one.
+    """
+    for idx, i in enumerate(words):
+        try:
+            ins, name = decode_instruction(i)
+        except Exception as e:
+            ins, name = None, e
+        yield idx << 2, i, ins, name
 
 
 def print_ulp_header(h):
@@ -66,27 +113,28 @@ def decode_instruction_and_print(byte_offset, i, verbose=False):
         print_code_line(byte_offset, i, e)
         return
 
+    print_decoded_line(byte_offset, i, ins, name, verbose)
+
+
+def print_decoded_line(byte_offset, i, ins, name, verbose=False):
     print_code_line(byte_offset, i, name)
 
-    if verbose:
+    if verbose and ins is not None:
         for field, val, extra in get_instruction_fields(ins):
             print("                 {:10} = {:3}{}".format(field, val, extra))
 
 
-def print_text_section(code, verbose=False):
+def print_text_section(words, verbose=False):
+    # words: any iterable of instruction words, e.g. iter_file_words(...)
     print('.text')
 
-    words = chunk_into_words(code, bytes_per_word=4, byteorder='little')
-
-    for idx, i in enumerate(words):
-        decode_instruction_and_print(idx << 2,i , verbose)
+    for byte_offset, i, ins, name in iter_decoded(words):
+        print_decoded_line(byte_offset, i, ins, name, verbose)
 
 
-def print_data_section(data_offset, code):
+def print_data_section(data_offset, words):
     print('.data')
 
-    words = chunk_into_words(code, bytes_per_word=4, byteorder='little')
-
     for idx, i in enumerate(words):
         asm = "<empty>" if i == 0 else "<non-empty>"
         print_code_line(data_offset + (idx << 2), i, asm)
@@ -96,49 +144,48 @@ def disassemble_manually(byte_sequence_string, cpu, verbose=False):
     load_decoder(cpu)
 
     sequence = byte_sequence_string.strip().replace(' ','')
-    chars_per_instruction = 8
-    list = [
-        sequence[i:i+chars_per_instruction]
-        for i in range(0, len(sequence), chars_per_instruction)
-    ]
+    code = ubinascii.unhexlify(sequence)
 
-    for idx, instruction in enumerate(list):
-        byte_sequence = ubinascii.unhexlify(instruction.replace(' ',''))
-        i = int.from_bytes(byte_sequence, 'little')
-        decode_instruction_and_print(idx << 2, i, verbose)
+    for byte_offset, i, ins, name in iter_decoded(iter_words(memoryview(code))):
+        print_decoded_line(byte_offset, i, ins, name, verbose)
 
 
 def disassemble_file(filename, cpu, verbose=False):
+    """
+    disassemble the .ulp file filename, streaming: the sections are read and
+    decoded in chunks and each line is printed as soon as it is decoded, so
+    the memory needed does not depend on the size of the file.
+    """
     load_decoder(cpu)
 
     with open(filename, 'rb') as f:
-        data = f.read()
-
-    binary_header_struct_def = dict(
-        magic = 0 | UINT32,
-        text_offset = 4 | UINT16,
-        text_size = 6 | UINT16,
-        data_size = 8 | UINT16,
-        bss_size = 10 | UINT16,
-    )
-    h = struct(addressof(data), binary_header_struct_def, LITTLE_ENDIAN)
-
-    if (h.magic != 0x00706c75):
-        print('Invalid signature: 0x%08x (should be: 0x%08x)' % (h.magic, 0x00706c75))
-        return
+        header = f.read(HEADER_SIZE)
+
+        binary_header_struct_def = dict(
+            magic = 0 | UINT32,
+            text_offset = 4 | UINT16,
+            text_size = 6 | UINT16,
+            data_size = 8 | UINT16,
+            bss_size = 10 | UINT16,
+        )
+        h = struct(addressof(header), binary_header_struct_def, LITTLE_ENDIAN)
+
+        if (h.magic != 0x00706c75):
+            print('Invalid signature: 0x%08x (should be: 0x%08x)' % (h.magic, 0x00706c75))
+            return
 
-    if verbose:
-        print_ulp_header(h)
+        if verbose:
+            print_ulp_header(h)
 
-    code = data[h.text_offset:(h.text_offset+h.text_size)]
-    print_text_section(code, verbose)
+        f.seek(h.text_offset)
+        print_text_section(iter_file_words(f, h.text_size), verbose)
 
-    if verbose:
-        print('----------------------------------------')
+        if verbose:
+            print('----------------------------------------')
 
-    data_offset = h.text_offset+h.text_size
-    code = data[data_offset:(data_offset+h.data_size)]
-    print_data_section(data_offset-h.text_offset, code)
+        data_offset = h.text_offset+h.text_size
+        f.seek(data_offset)
+        print_data_section(data_offset-h.text_offset, iter_file_words(f, h.data_size))
 
 
 def print_help():